@@ -2,27 +2,206 @@ import requests
 import time
 import hmac
 import hashlib
+import argparse
 from datetime import datetime, timedelta, timezone
 import json
+import math
+import os
 import re
-import yfinance as yf  # 需要安装：pip install yfinance
+import sys
+import random
+import sqlite3
+import threading
+import atexit
+import contextvars
+import base64
+import gzip
+import importlib
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from urllib.parse import urlparse, urlencode, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util.retry import Retry
 
+
+class LazyModule:
+    """首次访问属性时才导入的模块（numpy、yfinance/pandas导入耗时较长，只在对应功能首次使用时导入）"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+np = LazyModule("numpy")
+yf = LazyModule("yfinance")  # 需要安装：pip install yfinance（只有获取美股数据时才需要）
+websocket = LazyModule("websocket")  # 需要安装：pip install websocket-client（只有实时行情模式才需要）
+
 # --------------------------
 # 配置参数（从config.py导入）
 # --------------------------
-from config import (
-    DEEPSEEK_API_KEY,
-    DEEPSEEK_API_URL,
-    OKX_API_KEY,
-    OKX_SECRET_KEY,
-    OKX_PASSPHRASE,
-    OKX_API_URL,
-    SEARCH_API_KEY,
-    SEARCH_API_URL,
-    COINMARKETCAL_TOKEN
-)
+# 各数据源的密钥在首次请求该数据源时才读取，只使用部分功能时config.py中可以不填写其余数据源的密钥
+import config as _config
+
+DEEPSEEK_API_URL = getattr(_config, "DEEPSEEK_API_URL", "https://api.deepseek.com/chat/completions")
+OKX_API_URL = getattr(_config, "OKX_API_URL", "https://www.okx.com/api/v5/market/ticker")
+SEARCH_API_URL = getattr(_config, "SEARCH_API_URL", "https://api.bochaai.com/v1/web-search")
+
+# 可选配置：config.py中未定义时使用以下默认值
+# 各主机的限流参数：主机名 -> (每秒请求数, 突发容量)
+RATE_LIMITS = getattr(_config, "RATE_LIMITS", {
+    "www.okx.com": (10, 10),
+    "api.bochaai.com": (2, 5),
+    "query2.finance.yahoo.com": (2, 3),
+    "api.coinmarketcal.com": (1, 2),
+    "api.coingecko.com": (0.5, 2),
+    "api.deepseek.com": (2, 5),
+    "api.binance.com": (10, 10)
+})
+DEFAULT_RATE_LIMIT = getattr(_config, "DEFAULT_RATE_LIMIT", (2, 2))
+GATHER_MAX_WORKERS = getattr(_config, "GATHER_MAX_WORKERS", 16)
+# OKX批量行情接口（默认与OKX_API_URL同目录）及是否启用批量模式
+OKX_TICKERS_URL = getattr(_config, "OKX_TICKERS_URL", OKX_API_URL.rsplit("/", 1)[0] + "/tickers")
+OKX_BULK_TICKERS = getattr(_config, "OKX_BULK_TICKERS", True)
+# 行情数据源：启用的交易所（okx、binance），按最近的延迟与错误率排序后同时请求前PRICE_FANOUT个
+# 默认只使用OKX；多交易所需显式启用，例如PRICE_PROVIDERS = ["okx", "binance"]、PRICE_FANOUT = 2
+PRICE_PROVIDERS = getattr(_config, "PRICE_PROVIDERS", ["okx"])
+PRICE_FANOUT = getattr(_config, "PRICE_FANOUT", 1)
+# 多个数据源的合并方式："first"采用最先返回的有效行情；"median"等待各数据源返回后取最新价的中位数
+PRICE_AGGREGATION = getattr(_config, "PRICE_AGGREGATION", "first")
+# 排序依据：最近PRICE_STATS_WINDOW次请求的p90延迟 + 错误率 × PRICE_ERROR_PENALTY（秒）
+PRICE_STATS_WINDOW = getattr(_config, "PRICE_STATS_WINDOW", 50)
+PRICE_ERROR_PENALTY = getattr(_config, "PRICE_ERROR_PENALTY", 5.0)
+# 同时请求多个数据源时，单个数据源每次请求的超时（秒，较短的超时让慢的交易所尽快由其他数据源兜底）
+PRICE_TIMEOUT = getattr(_config, "PRICE_TIMEOUT", 10)
+# 实时行情（--live-prices）：订阅OKX公共WebSocket的tickers频道，价格从内存中的最新行情表读取
+PRICE_STREAM = getattr(_config, "PRICE_STREAM", False)
+OKX_WS_URL = getattr(_config, "OKX_WS_URL", "wss://ws.okx.com:8443/ws/v5/public")
+# 连接中断后行情仍视为有效的秒数、启动时等待首批行情的秒数
+PRICE_STREAM_MAX_AGE = getattr(_config, "PRICE_STREAM_MAX_AGE", 10)
+PRICE_STREAM_WARMUP = getattr(_config, "PRICE_STREAM_WARMUP", 3)
+# 无消息时发送"ping"的间隔（OKX在30秒无数据后断开连接）、重连等待的初始值与上限（秒，每次失败加倍）
+PRICE_STREAM_PING_INTERVAL = getattr(_config, "PRICE_STREAM_PING_INTERVAL", 20)
+PRICE_STREAM_RECONNECT_DELAY = getattr(_config, "PRICE_STREAM_RECONNECT_DELAY", 1.0)
+PRICE_STREAM_MAX_RECONNECT_DELAY = getattr(_config, "PRICE_STREAM_MAX_RECONNECT_DELAY", 30.0)
+# Binance 24小时行情接口（公开接口，无需密钥）
+BINANCE_TICKER_URL = getattr(_config, "BINANCE_TICKER_URL", "https://api.binance.com/api/v3/ticker/24hr")
+# OKX K线接口（默认与OKX_API_URL同目录）
+OKX_CANDLES_URL = getattr(_config, "OKX_CANDLES_URL", OKX_API_URL.rsplit("/", 1)[0] + "/candles")
+# 进程级共享连接池：最多缓存的主机数、每个主机保持的连接数
+HTTP_POOL_CONNECTIONS = getattr(_config, "HTTP_POOL_CONNECTIONS", 10)
+HTTP_POOL_MAXSIZE = getattr(_config, "HTTP_POOL_MAXSIZE", GATHER_MAX_WORKERS)
+# 统一重试策略：单次运行的重试次数与时间预算、重试退避基数（秒）
+RETRY_BUDGET = getattr(_config, "RETRY_BUDGET", 20)
+RUN_TIME_BUDGET = getattr(_config, "RUN_TIME_BUDGET", 600)
+RETRY_BACKOFF = getattr(_config, "RETRY_BACKOFF", 1.0)
+# 熔断：同一主机连续失败达到阈值后熔断，冷却期后放行一次探测请求（秒）
+CIRCUIT_FAILURE_THRESHOLD = getattr(_config, "CIRCUIT_FAILURE_THRESHOLD", 3)
+CIRCUIT_RESET_TIMEOUT = getattr(_config, "CIRCUIT_RESET_TIMEOUT", 60)
+# 财经日历对冲请求：主数据源超过该秒数未返回时并发请求备用数据源（None表示依次请求）
+CALENDAR_HEDGE_DELAY = getattr(_config, "CALENDAR_HEDGE_DELAY", 2.0)
+# 美股指数缓存：开盘期间的缓存秒数（休市期间缓存的收盘数据一直使用到下次开盘）
+US_STOCK_CACHE_TTL = getattr(_config, "US_STOCK_CACHE_TTL", 300)
+# 本地缓存目录（财经日历等跨运行复用的数据）
+CACHE_DIR = getattr(_config, "CACHE_DIR", ".cryptosift_cache")
+# 财经日历缓存：TTL内直接使用；超过TTL但未超过STALE_TTL时先返回旧数据并后台刷新（秒）
+CALENDAR_CACHE_TTL = getattr(_config, "CALENDAR_CACHE_TTL", 3600)
+CALENDAR_CACHE_STALE_TTL = getattr(_config, "CALENDAR_CACHE_STALE_TTL", 6 * 3600)
+# 分析模式："json"为单次请求的结构化输出；"legacy"为先预测再追问概率的两次请求
+ANALYSIS_MODE = getattr(_config, "ANALYSIS_MODE", "json")
+DEEPSEEK_MODEL = getattr(_config, "DEEPSEEK_MODEL", "deepseek-chat")
+# 批量分析：共享上下文只发送一次，一个请求覆盖ANALYSIS_BATCH_SIZE个交易对
+ANALYSIS_BATCH = getattr(_config, "ANALYSIS_BATCH", True)
+ANALYSIS_BATCH_SIZE = getattr(_config, "ANALYSIS_BATCH_SIZE", 10)
+# 分析阶段的最大并发数（同时进行的DeepSeek请求数上限，遇到429时自动降低）
+ANALYSIS_CONCURRENCY = getattr(_config, "ANALYSIS_CONCURRENCY", 4)
+# 流式输出：DeepSeek以SSE逐字返回，命令行未指定--stream时使用该默认值
+DEEPSEEK_STREAM = getattr(_config, "DEEPSEEK_STREAM", False)
+# 预测结果缓存：输入（时间段、价格区间、资讯、日历、美股）未变化时直接复用上次的预测，不再请求DeepSeek
+PREDICTION_CACHE_ENABLED = getattr(_config, "PREDICTION_CACHE_ENABLED", True)
+PREDICTION_CACHE_TTL = getattr(_config, "PREDICTION_CACHE_TTL", 3600)
+PREDICTION_CACHE_MAX_ENTRIES = getattr(_config, "PREDICTION_CACHE_MAX_ENTRIES", 500)
+# 价格容差（相对值）：价格变动在该比例以内视为同一价格区间，0表示价格必须完全相同
+PREDICTION_PRICE_TOLERANCE = getattr(_config, "PREDICTION_PRICE_TOLERANCE", 0.002)
+# 本地资讯索引（SQLite）：记录已见资讯并合并近似重复的报道；关闭后每次运行都重新搜索并只做完全相同去重
+NEWS_INDEX_ENABLED = getattr(_config, "NEWS_INDEX_ENABLED", True)
+# 提示词使用的资讯时间窗口（小时）与条数上限
+NEWS_WINDOW_HOURS = getattr(_config, "NEWS_WINDOW_HOURS", 24)
+NEWS_MAX_ITEMS = getattr(_config, "NEWS_MAX_ITEMS", 20)
+# 增量模式：只返回上次运行以来新出现的资讯
+NEWS_INCREMENTAL = getattr(_config, "NEWS_INCREMENTAL", False)
+# 同一关键词的最短搜索间隔（秒）；连续搜索无新资讯时间隔加倍，最长NEWS_QUERY_MAX_INTERVAL
+NEWS_QUERY_REFRESH_INTERVAL = getattr(_config, "NEWS_QUERY_REFRESH_INTERVAL", 900)
+NEWS_QUERY_MAX_INTERVAL = getattr(_config, "NEWS_QUERY_MAX_INTERVAL", 3600)
+# SimHash汉明距离不超过该值的两条资讯视为同一报道
+NEWS_SIMHASH_DISTANCE = getattr(_config, "NEWS_SIMHASH_DISTANCE", 10)
+# 索引中资讯的保留天数
+NEWS_RETENTION_DAYS = getattr(_config, "NEWS_RETENTION_DAYS", 7)
+# 全市场筛选（--screen）：计价货币、进入分析的交易对数量、最低24小时成交额与最大买卖价差（相对值）
+SCREEN_QUOTE = getattr(_config, "SCREEN_QUOTE", "USDT")
+SCREEN_TOP_K = getattr(_config, "SCREEN_TOP_K", 10)
+SCREEN_MIN_VOLUME = getattr(_config, "SCREEN_MIN_VOLUME", 1_000_000)
+SCREEN_MAX_SPREAD = getattr(_config, "SCREEN_MAX_SPREAD", 0.005)
+# 筛选得分中各指标的权重：24小时涨跌幅（绝对值）、24小时振幅、成交额（对数）、买卖价差（越小越好）
+SCREEN_WEIGHTS = getattr(_config, "SCREEN_WEIGHTS", {"change": 1.0, "volatility": 1.0, "volume": 0.5, "spread": 0.5})
+# 本地K线存储：K线周期、首次同步的K线数量与每个交易对最多保留的K线数量
+CANDLES_ENABLED = getattr(_config, "CANDLES_ENABLED", True)
+CANDLE_BAR = getattr(_config, "CANDLE_BAR", "1H")
+CANDLE_HISTORY = getattr(_config, "CANDLE_HISTORY", 200)
+CANDLE_MAX_BARS = getattr(_config, "CANDLE_MAX_BARS", 1000)
+# 预测历史与回测：是否记录每次预测、横盘的涨跌幅区间（与提示词中的±1%一致）、校准曲线的分箱数
+PREDICTION_HISTORY_ENABLED = getattr(_config, "PREDICTION_HISTORY_ENABLED", True)
+BACKTEST_FLAT_BAND = getattr(_config, "BACKTEST_FLAT_BAND", 0.01)
+BACKTEST_CALIBRATION_BINS = getattr(_config, "BACKTEST_CALIBRATION_BINS", 10)
+# 守护进程模式（--daemon）：各数据源的刷新间隔（秒），美股数据在休市期间由缓存提供、不会访问网络
+DAEMON_INTERVALS = getattr(_config, "DAEMON_INTERVALS", {
+    "prices": 60,
+    "news": 900,
+    "calendar": 3600,
+    "stocks": 300,
+    "candles": 300
+})
+# 数据源刷新失败后的重试间隔（秒），连续失败时翻倍，最长不超过该数据源的刷新间隔
+DAEMON_RETRY_DELAY = getattr(_config, "DAEMON_RETRY_DELAY", 30)
+# 重新分析的条件：价格相对上次分析变动超过该比例、相关资讯/日历变化、美股涨跌幅变化超过DAEMON_STOCK_CHANGE个百分点，
+# 或上次分析已超过DAEMON_MAX_PREDICTION_AGE秒
+DAEMON_PRICE_CHANGE = getattr(_config, "DAEMON_PRICE_CHANGE", 0.005)
+DAEMON_STOCK_CHANGE = getattr(_config, "DAEMON_STOCK_CHANGE", 0.5)
+DAEMON_MAX_PREDICTION_AGE = getattr(_config, "DAEMON_MAX_PREDICTION_AGE", 4 * 3600)
+# 只读HTTP接口（--serve）：监听地址与端口
+API_HOST = getattr(_config, "API_HOST", "127.0.0.1")
+API_PORT = getattr(_config, "API_PORT", 8765)
+# 界面分析引擎：共享上下文（资讯、日历、美股）在该秒数内复用，重新分析时不重复获取
+ENGINE_CONTEXT_TTL = getattr(_config, "ENGINE_CONTEXT_TTL", 900)
+# 提示词token预算（估算值）：各币种共用的前缀（美股、大盘资讯与日历）与每个币种的相关资讯
+PROMPT_SHARED_TOKEN_BUDGET = getattr(_config, "PROMPT_SHARED_TOKEN_BUDGET", 600)
+PROMPT_COIN_TOKEN_BUDGET = getattr(_config, "PROMPT_COIN_TOKEN_BUDGET", 300)
+# 资讯相关性匹配：币种 -> 别名（小写），未列出的币种只匹配币种代码
+COIN_ALIASES = getattr(_config, "COIN_ALIASES", {
+    "btc": ["btc", "bitcoin", "比特币"],
+    "eth": ["eth", "ethereum", "以太坊", "以太币"],
+    "sol": ["sol", "solana"],
+    "pepe": ["pepe", "佩佩"],
+    "doge": ["doge", "dogecoin", "狗狗币"],
+    "xrp": ["xrp", "ripple", "瑞波"],
+    "bnb": ["bnb", "币安币"],
+    "ada": ["ada", "cardano", "艾达币"],
+    "trx": ["trx", "tron", "波场"]
+})
+# 与大盘相关的关键词：命中的资讯放入各币种共用的前缀
+MARKET_KEYWORDS = getattr(_config, "MARKET_KEYWORDS", [
+    "加密货币", "数字货币", "大盘", "美联储", "降息", "加息", "利率", "通胀", "监管", "etf", "宏观", "美股", "美元",
+    "crypto", "fed", "sec", "market"
+])
 
 # 搜索关键词配置（压缩优化版）
 SEARCH_QUERIES = [
@@ -40,28 +219,38 @@ US_STOCKS = {
     "标普500指数": "^GSPC"
 }
 
-# 财经日历API配置
-FINANCIAL_CALENDAR_SOURCES = {
-    "coinmarketcal": {
-        "url": "https://api.coinmarketcal.com/v1/events",
-        "params": {
-            "max": 5,
-            "dateRangeStart": datetime.now().strftime("%Y-%m-%d"),
-            "dateRangeEnd": (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d"),
-            "access_token": COINMARKETCAL_TOKEN  # 从config导入
-        }
-    },
-    "coingecko": {
-        "url": "https://api.coingecko.com/api/v3/events",
-        "params": {
-            "upcoming_events_only": "true"
+
+def get_financial_calendar_sources():
+    """财经日历API配置（日期范围在请求时按date_range_days计算，见build_calendar_params）
+    
+    首次调用时才创建并保存为模块属性FINANCIAL_CALENDAR_SOURCES；需要修改配置时先调用本函数，再修改返回的字典。
+    """
+    global FINANCIAL_CALENDAR_SOURCES
+    if "FINANCIAL_CALENDAR_SOURCES" not in globals():
+        FINANCIAL_CALENDAR_SOURCES = {
+            "coinmarketcal": {
+                "url": "https://api.coinmarketcal.com/v1/events",
+                "params": {
+                    "max": 5,
+                    "access_token": getattr(_config, "COINMARKETCAL_TOKEN", "")  # 从config读取
+                },
+                "date_range_days": 7
+            },
+            "coingecko": {
+                "url": "https://api.coingecko.com/api/v3/events",
+                "params": {
+                    "upcoming_events_only": "true"
+                }
+            }
         }
-    }
-}
+    return FINANCIAL_CALENDAR_SOURCES
+
+
+# yfinance实际访问的主机（用于限流）
+YAHOO_FINANCE_HOST = "query2.finance.yahoo.com"
 
 CRYPTO_LIST = ["SOL-USDT", "BTC-USDT", "ETH-USDT", "PEPE-USDT", "DOGE-USDT"]
 PREDICTION_HOURS = 8
-REQUEST_DELAY = 3
 MAX_RETRIES = 3
 TIMEOUT = 60
 
@@ -84,252 +273,3052 @@ def okx_sign(timestamp, method, request_path, secret_key, body=""):
     return mac.hexdigest()
 
 
+def okx_headers(request_path, method="GET"):
+    """生成OKX API请求头（request_path需包含查询参数）"""
+    timestamp = get_utc_timestamp()
+    return {
+        "OK-ACCESS-KEY": getattr(_config, "OKX_API_KEY", ""),
+        "OK-ACCESS-SIGN": okx_sign(timestamp, method, request_path, getattr(_config, "OKX_SECRET_KEY", "")),
+        "OK-ACCESS-TIMESTAMP": timestamp,
+        "OK-ACCESS-PASSPHRASE": getattr(_config, "OKX_PASSPHRASE", "")
+    }
+
+
+# --------------------------
+# 工具函数：进程级共享HTTP连接池
+# --------------------------
+class ConnectionStats:
+    """按主机统计新建连接（需要TCP+TLS握手）与复用连接的次数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def record(self, host, reused):
+        with self.lock:
+            counters = self.hosts.setdefault(host, {"opened": 0, "reused": 0})
+            counters["reused" if reused else "opened"] += 1
+
+    def snapshot(self):
+        """返回 主机 -> {"opened": n, "reused": n} 的副本"""
+        with self.lock:
+            return {host: dict(counters) for host, counters in self.hosts.items()}
+
+    def reset(self):
+        with self.lock:
+            self.hosts.clear()
+
+
+HTTP_CONNECTION_STATS = ConnectionStats()
+
+
+class _CountingPoolMixin:
+    """取出连接时记录其是否已建立：已连接的视为复用，否则视为新建"""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        HTTP_CONNECTION_STATS.record(self.host, getattr(conn, "sock", None) is not None)
+        return conn
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """使用带统计功能的连接池的HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+
+_shared_adapter = None
+_shared_adapter_lock = threading.Lock()
+_http_local = threading.local()
+
+
+def get_shared_adapter():
+    """进程内唯一的HTTPAdapter：所有会话共用同一组按主机划分的连接池"""
+    global _shared_adapter
+    with _shared_adapter_lock:
+        if _shared_adapter is None:
+            # 连接层不再重试，重试统一由http_request按运行预算控制
+            _shared_adapter = PooledHTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=Retry(total=0, read=False, redirect=3, raise_on_status=False)
+            )
+        return _shared_adapter
+
+
+def get_http_pool_stats():
+    """连接复用统计：各主机的新建/复用次数及合计"""
+    hosts = HTTP_CONNECTION_STATS.snapshot()
+    return {
+        "hosts": hosts,
+        "opened": sum(c["opened"] for c in hosts.values()),
+        "reused": sum(c["reused"] for c in hosts.values())
+    }
+
+
 # --------------------------
 # 工具函数：创建带重试机制的会话
 # --------------------------
 def create_session_with_retry():
-    """创建具有自动重试功能的HTTP会话"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=2,  # 指数退避：2,4,8秒
-        status_forcelist=[429, 500, 502, 503, 504, 599]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("https://", adapter)
+    """返回当前线程的HTTP会话（重试由http_request统一处理）
+    
+    会话对象按线程隔离，底层连接池在进程内共享，因此可在工作线程（包括Kivy后台线程）中安全使用，
+    并在各阶段之间复用keep-alive连接。
+    """
+    session = getattr(_http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = get_shared_adapter()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_local.session = session
     return session
 
 
 # --------------------------
-# 新增：获取加密货币财经日历
+# 工具函数：按主机限流（令牌桶）
 # --------------------------
-def get_crypto_calendar_events():
-    """获取加密货币重要财经日历事件"""
-    session = create_session_with_retry()
-    calendar_events = []
+def url_host(url_or_host):
+    """限流、熔断与统计所用的主机键：URL中的host[:port]（默认端口时即主机名）"""
+    return urlparse(url_or_host).netloc if "://" in url_or_host else url_or_host
+
+
+class TokenBucket:
+    """令牌桶限流器：rate为每秒补充的令牌数，capacity为突发容量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌，返回实际等待的秒数"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url_or_host):
+    """获取（或创建）指定主机的限流器，同一主机在所有线程间共享"""
+    host = url_host(url_or_host)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(host)
+        if limiter is None:
+            rate, capacity = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            limiter = TokenBucket(rate, capacity)
+            _rate_limiters[host] = limiter
+        return limiter
+
+
+def rate_limit(url_or_host):
+    """请求前调用：按目标主机的限流配置等待令牌"""
+    return get_rate_limiter(url_or_host).acquire()
+
+
+# --------------------------
+# 工具函数：线程池并发执行
+# --------------------------
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """在提交任务时复制调用方的上下文（如当前运行预算），使工作线程沿用同一个运行范围"""
+    
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def parallel_map(func, items, max_workers=None):
+    """在线程池中并发执行func，按输入顺序返回结果（func需自行处理异常）"""
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(max_workers or GATHER_MAX_WORKERS, len(items)))
+    with ContextThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+# --------------------------
+# 工具函数：运行埋点（阶段耗时、请求延迟、重试与LLM用量）
+# --------------------------
+class RunMetrics:
+    """单次运行的埋点数据，可导出为JSON运行报告与Prometheus文本格式"""
     
-    for source_name, config in FINANCIAL_CALENDAR_SOURCES.items():
+    # 请求延迟直方图的分桶上限（秒）
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.started = time.monotonic()
+            self.spans = []
+            self.hosts = {}
+            self.counters = {}
+            self.llm_usage = {"calls": 0}
+            self.prompts = []
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """记录一段代码的耗时：with METRICS.span("gather.news"): ..."""
+        start = time.monotonic()
+        status = "ok"
         try:
-            time.sleep(REQUEST_DELAY)
-            response = session.get(
-                config["url"],
-                params=config.get("params", {}),
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            data = response.json()
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            end = time.monotonic()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start": round(start - self.started, 6),
+                    "duration": round(end - start, 6),
+                    "thread": threading.current_thread().name,
+                    "status": status,
+                    "attrs": attrs
+                })
+
+    def incr(self, name, value=1, **labels):
+        """累加计数器，labels用于区分主机等维度"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_request(self, host, duration, status):
+        """记录一次HTTP请求：按主机统计延迟直方图与状态码"""
+        with self.lock:
+            stats = self.hosts.setdefault(host, {
+                "count": 0,
+                "sum": 0.0,
+                "max": 0.0,
+                "buckets": [0] * len(self.LATENCY_BUCKETS),
+                "status": {}
+            })
+            stats["count"] += 1
+            stats["sum"] += duration
+            stats["max"] = max(stats["max"], duration)
+            for index, bound in enumerate(self.LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats["buckets"][index] += 1
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+
+    def record_prompt(self, name, tokens, **details):
+        """记录一次组装的提示词及其估算token数（details为共享前缀、币种上下文的token数等）"""
+        with self.lock:
+            self.prompts.append(dict({"name": name, "tokens": tokens}, **details))
+        self.incr("prompt_tokens_estimated_total", tokens)
+        self.incr("prompts_total")
+
+    def record_llm_usage(self, usage):
+        """累加DeepSeek响应中usage字段的各项token数"""
+        with self.lock:
+            self.llm_usage["calls"] += 1
+            for key, value in (usage or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.llm_usage[key] = self.llm_usage.get(key, 0) + value
+
+    def report(self):
+        """生成JSON运行报告"""
+        with self.lock:
+            stages = {}
+            for span in self.spans:
+                stage = stages.setdefault(span["name"], {"count": 0, "total": 0.0, "max": 0.0})
+                stage["count"] += 1
+                stage["total"] = round(stage["total"] + span["duration"], 6)
+                stage["max"] = max(stage["max"], span["duration"])
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label_text}}}" if label_text else name] = value
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "duration": round(time.monotonic() - self.started, 6),
+                "stages": stages,
+                "spans": list(self.spans),
+                "hosts": {
+                    host: {
+                        "count": stats["count"],
+                        "avg": round(stats["sum"] / stats["count"], 6) if stats["count"] else 0,
+                        "max": round(stats["max"], 6),
+                        "status": dict(stats["status"]),
+                        "buckets": dict(zip([str(b) for b in self.LATENCY_BUCKETS], stats["buckets"]))
+                    } for host, stats in self.hosts.items()
+                },
+                "counters": counters,
+                "llm_usage": dict(self.llm_usage),
+                "prompts": list(self.prompts),
+                "connections": get_http_pool_stats()
+            }
+
+    def to_prometheus(self):
+        """导出为Prometheus文本格式"""
+        def label_str(labels):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        
+        lines = [
+            "# TYPE cryptosift_run_duration_seconds gauge",
+            f"cryptosift_run_duration_seconds {time.monotonic() - self.started:.6f}"
+        ]
+        with self.lock:
+            stages = {}
+            for span in self.spans:
+                total, count = stages.get(span["name"], (0.0, 0))
+                stages[span["name"]] = (total + span["duration"], count + 1)
+            lines.append("# TYPE cryptosift_stage_duration_seconds summary")
+            for name, (total, count) in sorted(stages.items()):
+                lines.append(f'cryptosift_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+                lines.append(f'cryptosift_stage_duration_seconds_count{{stage="{name}"}} {count}')
             
-            if source_name == "coinmarketcal" and isinstance(data.get("data"), list):
-                for event in data["data"][:5]:
-                    title = event.get("title", {}).get("en", "无标题")
-                    date = event.get("date_event", "日期未知")
-                    coins = ", ".join([c["name"] for c in event.get("coins", [])])
-                    calendar_events.append(f"{date} {title} ({coins})")
+            lines.append("# TYPE cryptosift_http_request_duration_seconds histogram")
+            for host, stats in sorted(self.hosts.items()):
+                bucket = "cryptosift_http_request_duration_seconds_bucket"
+                for bound, value in zip(self.LATENCY_BUCKETS, stats["buckets"]):
+                    lines.append(f'{bucket}{{host="{host}",le="{bound}"}} {value}')
+                lines.append(f'{bucket}{{host="{host}",le="+Inf"}} {stats["count"]}')
+                lines.append(f'cryptosift_http_request_duration_seconds_sum{{host="{host}"}} {stats["sum"]:.6f}')
+                lines.append(f'cryptosift_http_request_duration_seconds_count{{host="{host}"}} {stats["count"]}')
+            lines.append("# TYPE cryptosift_http_responses_total counter")
+            for host, stats in sorted(self.hosts.items()):
+                for status, value in sorted(stats["status"].items()):
+                    lines.append(f'cryptosift_http_responses_total{{host="{host}",status="{status}"}} {value}')
             
-            elif source_name == "coingecko" and isinstance(data.get("data"), dict):
-                for event in data["data"].get("upcoming_events", [])[:5]:
-                    title = event.get("title", {}).get("en", "无标题")
-                    date = event.get("start_date", "日期未知")
-                    calendar_events.append(f"{date} {title}")
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE cryptosift_{name} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"cryptosift_{name}{label_str(labels)} {value}")
             
-            if calendar_events:
-                print(f"✅ 财经日历数据获取成功（{source_name}）")
-                break
-                
-        except Exception as e:
-            print(f"❌ 财经日历数据获取失败（{source_name}）：{str(e)}")
-            continue
-    
-    return "；".join(calendar_events) if calendar_events else "未获取到近期重要财经事件"
+            lines.append("# TYPE cryptosift_llm_tokens_total counter")
+            for key, value in sorted(self.llm_usage.items()):
+                if key != "calls":
+                    lines.append(f'cryptosift_llm_tokens_total{{type="{key}"}} {value}')
+            lines.append("# TYPE cryptosift_llm_calls_total counter")
+            lines.append(f"cryptosift_llm_calls_total {self.llm_usage['calls']}")
+        
+        lines.append("# TYPE cryptosift_http_connections_total counter")
+        for host, counters in sorted(get_http_pool_stats()["hosts"].items()):
+            for kind, value in sorted(counters.items()):
+                lines.append(f'cryptosift_http_connections_total{{host="{host}",kind="{kind}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory):
+        """将运行报告写入 directory/run_report.json 与 directory/metrics.prom，返回两个文件路径"""
+        os.makedirs(directory, exist_ok=True)
+        report_path = os.path.join(directory, "run_report.json")
+        prom_path = os.path.join(directory, "metrics.prom")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        return report_path, prom_path
+
+
+METRICS = RunMetrics()
+
 
 # --------------------------
-# 1. 获取美股数据（使用yfinance）
+# 工具函数：统一重试策略（运行预算 + 按主机熔断）
 # --------------------------
-def get_us_stock_data():
-    """获取美股三大指数的最新价格和涨跌幅"""
-    stock_data = {}
-    for name, symbol in US_STOCKS.items():
-        for attempt in range(MAX_RETRIES):
-            try:
-                # 使用yfinance获取股票信息
-                ticker = yf.Ticker(symbol)
-                data = ticker.info
-                
-                # 提取价格和计算涨跌幅
-                price = round(float(data.get('regularMarketPrice', 0)), 2)
-                prev_close = float(data.get('regularMarketPreviousClose', price))
-                change = round(((price - prev_close) / prev_close) * 100, 2)
-                
-                stock_data[name] = {
-                    "price": price,
-                    "change": change
-                }
-                print(f"✅ 美股数据 - {name}：{price}（{change}%）")
-                break
-            except Exception as e:
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(REQUEST_DELAY)
-                    continue
-                print(f"❌ 美股数据 - {name} 获取失败：{str(e)}")
-    return stock_data
+# 可重试的状态码：限流与服务端错误
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 599}
 
 
-def get_latest_news():
-    """根据博查API调试结果优化的最终版本：单关键词单请求，精准提取资讯"""
-    session = create_session_with_retry()
-    news_summary = []
-    
-    # 修改为获取更多结果
-    base_payload = {
-        "query": "",  # 动态填充搜索关键词
-        "count": 5,   # 从2增加到5
-        "freshness": "oneDay"     # 只获取1天内的最新资讯
-    }
+class CircuitOpenError(requests.RequestException):
+    """目标主机处于熔断状态，请求被快速拒绝"""
+
+
+class RetryBudgetExceeded(requests.RequestException):
+    """本轮运行的时间预算已用尽"""
+
+
+class RunBudget:
+    """单次运行的全局重试预算：限制总重试次数与总耗时，避免重试层层叠加"""
+
+    def __init__(self, max_retries, time_budget):
+        self.lock = threading.Lock()
+        self.reset(max_retries, time_budget)
+
+    def reset(self, max_retries=None, time_budget=None):
+        with self.lock:
+            if max_retries is not None:
+                self.max_retries = max_retries
+            if time_budget is not None:
+                self.time_budget = time_budget
+            self.retries = 0
+            self.started = time.monotonic()
+
+    def remaining_time(self):
+        return self.time_budget - (time.monotonic() - self.started)
+
+    def try_consume_retry(self):
+        """申请一次重试机会，预算不足时返回False"""
+        with self.lock:
+            if self.retries >= self.max_retries or self.remaining_time() <= 0:
+                return False
+            self.retries += 1
+            return True
+
+
+RUN_BUDGET = RunBudget(RETRY_BUDGET, RUN_TIME_BUDGET)
+# 当前运行范围内的预算（守护进程的每次刷新/分析周期各自独立）；未进入运行范围时使用全局预算
+_scoped_run_budget = contextvars.ContextVar("cryptosift_run_budget", default=None)
+
+
+def reset_run_budget():
+    """每轮运行开始时重置全局重试预算"""
+    RUN_BUDGET.reset(RETRY_BUDGET, RUN_TIME_BUDGET)
+
+
+def current_run_budget():
+    """当前生效的运行预算"""
+    return _scoped_run_budget.get() or RUN_BUDGET
+
+
+@contextmanager
+def run_budget_scope():
+    """在with块内使用一个新的运行预算（经ContextThreadPoolExecutor提交的任务同样生效），退出后恢复"""
+    token = _scoped_run_budget.set(RunBudget(RETRY_BUDGET, RUN_TIME_BUDGET))
+    try:
+        yield
+    finally:
+        _scoped_run_budget.reset(token)
+
+
+class CircuitBreaker:
+    """熔断器：closed（正常）-> 连续失败达到阈值 -> open（快速失败）-> 冷却后 half_open（放行一次探测）"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def is_open(self):
+        with self.lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url_or_host):
+    """获取（或创建）指定主机（即数据源）的熔断器"""
+    host = url_host(url_or_host)
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+            _circuit_breakers[host] = breaker
+        return breaker
+
+
+def _retry_delay(attempt, response=None):
+    """重试等待时间：优先使用Retry-After，否则指数退避并加随机抖动"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return RETRY_BACKOFF * (2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def http_request(method, url, max_attempts=None, on_throttle=None, **kwargs):
+    """统一的HTTP请求入口：按主机限流与熔断，在全局运行预算内重试可恢复的错误
     
-    # 经调试确认的有效认证头
-    headers = {
-        "Authorization": f"Bearer {SEARCH_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    返回最后一次的响应（由调用方raise_for_status）；网络错误重试耗尽后抛出最后一次的异常。
+    收到429时会先调用on_throttle()（如有），再按Retry-After退避重试。
+    """
+    host = url_host(url)
+    breaker = get_circuit_breaker(url)
+    budget = current_run_budget()
+    session = create_session_with_retry()
+    max_attempts = max_attempts or MAX_RETRIES
+    timeout = kwargs.pop("timeout", TIMEOUT)
     
-    for query in SEARCH_QUERIES:
+    for attempt in range(max_attempts):
+        if not breaker.allow_request():
+            METRICS.incr("circuit_open_rejections_total", host=host)
+            raise CircuitOpenError(f"{host} 处于熔断状态，快速失败")
+        remaining = budget.remaining_time()
+        if remaining <= 0:
+            raise RetryBudgetExceeded("本轮运行时间预算已用尽")
+        
+        if not is_replaying():
+            METRICS.incr("sleep_seconds_total", rate_limit(url), reason="rate_limit")
+        response = None
+        start = time.monotonic()
         try:
-            # 避免请求过于频繁，添加间隔
-            time.sleep(REQUEST_DELAY)
-            
-            # 填充当前关键词
-            base_payload["query"] = query
-            
-            # 执行单次有效请求
-            response = session.post(
-                SEARCH_API_URL,
-                headers=headers,
-                json=base_payload,
-                timeout=TIMEOUT
-            )
-            
-            # 确保请求成功（状态码200）
-            response.raise_for_status()
-            data = response.json()
-            
-            # 精准匹配博查API的响应结构：data -> webPages -> value
-            if ("data" in data and 
-                "webPages" in data["data"] and 
-                isinstance(data["data"]["webPages"].get("value"), list)):
-                
-                # 提取更多资讯内容
-                for item in data["data"]["webPages"]["value"][:5]:  # 从2增加到5
-                    # 提取标题（优先name字段）
-                    title = item.get("name", "无标题")
-                    # 提取摘要（优先snippet字段）
-                    snippet = item.get("snippet", "无摘要")
-                    # 拼接并限制长度，避免信息过载
-                    news_summary.append(f"{title}：{snippet[:150]}...")
-                
-                print(f"✅ 资讯获取成功（{query}）：{len(news_summary[-5:])}条结果")  # 从2改为5
+            if HTTP_CASSETTE is not None:
+                response = HTTP_CASSETTE.request(session, method, url, timeout=min(timeout, remaining), **kwargs)
+            else:
+                response = session.request(method, url, timeout=min(timeout, remaining), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            is_timeout = isinstance(e, requests.Timeout)
+            METRICS.observe_request(host, time.monotonic() - start, "timeout" if is_timeout else "error")
+            if is_timeout:
+                METRICS.incr("http_timeouts_total", host=host)
+            breaker.record_failure()
+            error = e
+        else:
+            METRICS.observe_request(host, time.monotonic() - start, response.status_code)
+            if response.status_code not in RETRYABLE_STATUS:
+                breaker.record_success()
+                return response
+            # 429说明主机正常但需要降速，不计入熔断失败
+            if response.status_code == 429:
+                breaker.record_success()
+                METRICS.incr("http_throttled_total", host=host)
+                if on_throttle:
+                    on_throttle()
+            else:
+                breaker.record_failure()
+            error = None
         
-        except Exception as e:
-            print(f"❌ 资讯获取失败（{query}）：{str(e)}")
+        if attempt == max_attempts - 1 or not budget.try_consume_retry():
+            break
+        if response is not None:
+            # 释放连接（流式请求未读取的响应体也需关闭）
+            response.close()
+        METRICS.incr("http_retries_total", host=host)
+        if is_replaying():
             continue
+        delay = min(_retry_delay(attempt, response), max(0.0, budget.remaining_time()))
+        METRICS.incr("sleep_seconds_total", delay, reason="backoff")
+        time.sleep(delay)
     
-    # 去除重复资讯（保留首次出现的内容）
-    unique_news = list(dict.fromkeys(news_summary))
-    
-    # 若有有效资讯则返回，否则提示无结果
-    return "；".join(unique_news[:20]) if unique_news else "未获取到最新资讯"  # 从100改为20
+    if error is not None:
+        raise error
+    return response
+
 
 # --------------------------
-# 3. 获取加密货币价格
+# 工具函数：HTTP录制与回放
 # --------------------------
-def get_crypto_prices(crypto_pairs):
-    prices = {}
-    session = create_session_with_retry()
+class CassetteMiss(requests.ConnectionError):
+    """回放时录制文件中没有匹配的请求（按网络错误处理）"""
+
+
+# 请求键中去除的查询参数（密钥）；请求头（Authorization、OKX签名等）不参与请求键，也不写入录制文件
+CASSETTE_SECRET_PARAMS = {"access_token", "api_key", "apikey", "token", "key", "secret"}
+# 保存的响应头
+CASSETTE_RESPONSE_HEADERS = ("Content-Type", "Retry-After")
+# 请求中随当前时间变化的部分（日期、提示词中的北京时间、毫秒时间戳），生成请求键时替换为占位符
+_VOLATILE_REQUEST_TEXT = re.compile(
+    r"\d{4}年\d{1,2}月\d{1,2}日\d{1,2}点(?:\d{1,2}分)?"
+    r"|\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?Z?)?"
+    r"|\b1\d{12}\b"
+)
+_REQUEST_WORDS = re.compile(r"\w+")
+
+
+def normalize_request(method, url, params=None, json_body=None, data=None):
+    """返回(请求键, 路由)：请求键由方法、地址、排序后的查询参数（去除密钥）与请求体组成，路由只含方法与地址"""
+    parsed = urlparse(url)
+    route = f"{method.upper()} {parsed.netloc}{parsed.path}"
+    query = [(name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)]
+    query += [(name, str(value)) for name, value in (params or {}).items() if value is not None]
+    query = sorted((name, value) for name, value in query if name.lower() not in CASSETTE_SECRET_PARAMS)
+    if json_body is not None:
+        body = json.dumps(json_body, ensure_ascii=False, sort_keys=True)
+    elif isinstance(data, bytes):
+        body = data.decode("utf-8", "replace")
+    else:
+        body = data or ""
+    key = f"{route}?{urlencode(query)}\n{body}"
+    return _VOLATILE_REQUEST_TEXT.sub("<time>", key), route
+
+
+class Cassette:
+    """HTTP录制文件（gzip压缩的JSON）
+    
+    录制模式下经http_request发出的每个请求与响应（以及yfinance的函数调用结果）都按请求键记录；
+    回放模式下按请求键依次返回录制的响应，不访问网络，也不进行限流与退避等待。
+    同一请求键的多次请求按录制顺序返回，用完后重复最后一次；没有匹配的请求键时抛出CassetteMiss，
+    说明录制文件需要重新录制。fuzzy_routes中的路由（方法与地址，目前只用于DeepSeek）例外：
+    没有完全匹配时（例如修改了提示词的生成逻辑）返回该路由中尚未使用、词语重合度最高的请求。
+    latency_scale大于0时回放前按录制的耗时乘以该系数等待，用于重现真实的时序。
+    """
     
-    for pair in crypto_pairs:
+    VERSION = 1
+    
+    def __init__(self, path, mode, latency_scale=0.0, fuzzy_routes=()):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的录制模式：{mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.fuzzy_routes = set(fuzzy_routes)
+        self.lock = threading.Lock()
+        self.interactions = []
+        self.calls = []
+        self.cursors = {}
+        if mode == "replay":
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                raise ValueError(f"不支持的录制文件版本：{data.get('version')}")
+            self.interactions = data["interactions"]
+            self.calls = data["calls"]
+        self.by_key = {}
+        self.by_route = {}
+        for index, interaction in enumerate(self.interactions):
+            self.by_key.setdefault(interaction["key"], []).append(index)
+            self.by_route.setdefault(interaction["route"], []).append(index)
+        self.calls_by_key = {}
+        for call in self.calls:
+            self.calls_by_key.setdefault(call["key"], []).append(call)
+        self.used = set()
+        self.words = {}
+    
+    def request(self, session, method, url, **kwargs):
+        """代替session.request：录制模式下发出请求并记录，回放模式下返回录制的响应"""
+        key, route = normalize_request(method, url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"))
+        if self.mode == "replay":
+            return self._replay(key, route, url)
+        start = time.monotonic()
+        interaction = {"key": key, "route": route}
         try:
-            timestamp = get_utc_timestamp()
-            request_path = "/api/v5/market/ticker"
-            sign = okx_sign(timestamp, "GET", request_path, OKX_SECRET_KEY)
-            
-            headers = {
-                "OK-ACCESS-KEY": OKX_API_KEY,
-                "OK-ACCESS-SIGN": sign,
-                "OK-ACCESS-TIMESTAMP": timestamp,
-                "OK-ACCESS-PASSPHRASE": OKX_PASSPHRASE
-            }
-            
-            time.sleep(REQUEST_DELAY)
-            response = session.get(
-                OKX_API_URL,
-                headers=headers,
-                params={"instId": pair},
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("code") == "0" and data.get("data"):
-                last_price = round(float(data["data"][0]["last"]), 15)
-                prices[pair] = last_price
-                print(f"✅ {pair} 价格：{last_price} 美元")
-        
+            response = session.request(method, url, **kwargs)
+            # 流式响应也完整读取后再返回，调用方从已缓冲的内容中逐行读取
+            content = response.content
+        except (requests.ConnectionError, requests.Timeout) as e:
+            interaction.update(error="timeout" if isinstance(e, requests.Timeout) else "connection",
+                               message=str(e), latency=time.monotonic() - start)
+            self._record(self.interactions, interaction)
+            raise
+        interaction.update(
+            status=response.status_code,
+            headers={name: response.headers[name] for name in CASSETTE_RESPONSE_HEADERS if name in response.headers},
+            encoding=response.encoding,
+            latency=time.monotonic() - start
+        )
+        try:
+            interaction["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interaction["body_base64"] = base64.b64encode(content).decode("ascii")
+        self._record(self.interactions, interaction)
+        return response
+    
+    def _record(self, records, record):
+        with self.lock:
+            records.append(record)
+    
+    def _next_index(self, key, route):
+        with self.lock:
+            index = next((i for i in self.by_key.get(key, ()) if i not in self.used), None)
+            if index is None and route in self.fuzzy_routes:
+                unused = [i for i in self.by_route.get(route, ()) if i not in self.used]
+                if unused:
+                    # 同一路由中词语重合度最高的请求（例如提示词略有不同、但交易对相同的分析请求）
+                    words = set(_REQUEST_WORDS.findall(key))
+                    index = max(unused, key=lambda i: (self._similarity(words, i), -i))
+                    METRICS.incr("cassette_fuzzy_matches_total")
+            if index is not None:
+                self.used.add(index)
+                return index
+            candidates = self.by_key.get(key)
+            return candidates[-1] if candidates else None
+    
+    def _similarity(self, words, index):
+        recorded = self.words.get(index)
+        if recorded is None:
+            recorded = self.words[index] = set(_REQUEST_WORDS.findall(self.interactions[index]["key"]))
+        return len(words & recorded) / (len(words | recorded) or 1)
+    
+    def _replay(self, key, route, url):
+        index = self._next_index(key, route)
+        if index is None:
+            raise CassetteMiss(f"录制文件中没有该请求：{route}")
+        interaction = self.interactions[index]
+        if self.latency_scale > 0:
+            time.sleep(interaction.get("latency", 0.0) * self.latency_scale)
+        if "error" in interaction:
+            error_type = requests.Timeout if interaction["error"] == "timeout" else requests.ConnectionError
+            raise error_type(interaction.get("message", "录制的网络错误"))
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.headers = requests.structures.CaseInsensitiveDict(interaction.get("headers", {}))
+        response.encoding = interaction.get("encoding")
+        response.url = url
+        if "body_base64" in interaction:
+            response._content = base64.b64decode(interaction["body_base64"])
+        else:
+            response._content = interaction.get("body", "").encode("utf-8")
+        response._content_consumed = True
+        return response
+    
+    def call(self, name, args, func):
+        """函数级录制（用于不经过http_request的yfinance）：录制模式下调用func并记录可JSON序列化的结果"""
+        key = f"{name}:{json.dumps(args, ensure_ascii=False, sort_keys=True)}"
+        if self.mode == "replay":
+            with self.lock:
+                calls = self.calls_by_key.get(key)
+                if not calls:
+                    raise CassetteMiss(f"录制文件中没有该调用：{key}")
+                call = calls.pop(0) if len(calls) > 1 else calls[0]
+            if self.latency_scale > 0:
+                time.sleep(call.get("latency", 0.0) * self.latency_scale)
+            if "error" in call:
+                raise RuntimeError(call["error"])
+            return call["result"]
+        start = time.monotonic()
+        try:
+            result = func()
+        except ImportError:
+            # 缺少依赖不属于数据源的响应，不记录
+            raise
         except Exception as e:
-            print(f"❌ {pair} 价格获取失败：{str(e)}")
+            self._record(self.calls, {"key": key, "error": str(e), "latency": time.monotonic() - start})
+            raise
+        self._record(self.calls, {"key": key, "result": result, "latency": time.monotonic() - start})
+        return result
     
-    return prices
+    def save(self):
+        """录制模式下写入录制文件（每次调用都写入完整内容）"""
+        if self.mode != "record":
+            return
+        with self.lock:
+            data = {
+                "version": self.VERSION,
+                "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "interactions": list(self.interactions),
+                "calls": list(self.calls)
+            }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        print(f"HTTP录制文件已写入：{self.path}（{len(data['interactions'])}个请求，{len(data['calls'])}次函数调用）")
+
+
+HTTP_CASSETTE = None
+
+
+def is_replaying():
+    return HTTP_CASSETTE is not None and HTTP_CASSETTE.mode == "replay"
+
+
+def use_cassette(path, mode, latency_scale=0.0, isolate_cache=True, fuzzy=False):
+    """启用HTTP录制（mode="record"）或回放（mode="replay"），返回Cassette
+    
+    isolate_cache为True时清空进程内缓存并改用临时的空缓存目录，使录制与回放的运行发出相同的请求。
+    fuzzy为True时，DeepSeek请求没有完全匹配的录制时按词语重合度选取（其他请求仍严格匹配）。
+    录制模式在进程退出时自动写入录制文件。
+    """
+    global HTTP_CASSETTE, CACHE_DIR
+    fuzzy_routes = [normalize_request("POST", DEEPSEEK_API_URL)[1]] if fuzzy else ()
+    cassette = Cassette(path, mode, latency_scale, fuzzy_routes=fuzzy_routes)
+    if isolate_cache:
+        clear_caches()
+        CACHE_DIR = tempfile.mkdtemp(prefix=f"cryptosift-{mode}-")
+    HTTP_CASSETTE = cassette
+    if mode == "record":
+        atexit.register(cassette.save)
+    return cassette
+
+
+def cassette_call(name, args, func):
+    """经过录制文件调用func（未启用录制/回放时直接调用）"""
+    if HTTP_CASSETTE is None:
+        return func()
+    return HTTP_CASSETTE.call(name, args, func)
 
 
 # --------------------------
-# 4. 时间取整工具函数
+# 工具函数：本地JSON缓存文件读写
 # --------------------------
-def round_time(current_time):
-    minute = current_time.minute
-    if minute < 15:
-        return current_time.replace(minute=0, second=0, microsecond=0)
-    elif 15 <= minute < 45:
-        return current_time.replace(minute=30, second=0, microsecond=0)
-    else:
-        return current_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+def cache_path(filename):
+    """返回缓存目录下的文件路径（目录不存在时自动创建）"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, filename)
+
+
+def load_json_file(path, default=None):
+    """读取JSON文件，文件不存在或损坏时返回default"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json_file(path, data):
+    """原子写入JSON文件，避免并发或中断时留下半个文件"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
 
 # --------------------------
-# 5. 单个加密货币分析（含AI预测）
+# 新增：获取加密货币财经日历
 # --------------------------
-def analyze_single_crypto(crypto_pair, price, prediction_hours, stock_data, latest_news):
-    crypto_name = crypto_pair.split('-')[0].lower()
-    current_time = datetime.now()
-    rounded_time = round_time(current_time)
-    time_str = rounded_time.strftime("%Y年%m月%d日%H点") + ("30分" if rounded_time.minute == 30 else "")
+def build_calendar_params(source_config, now=None):
+    """在请求时生成日历接口参数，日期范围以当前时间为起点"""
+    params = dict(source_config.get("params", {}))
+    days = source_config.get("date_range_days")
+    if days is not None:
+        now = now or datetime.now()
+        params["dateRangeStart"] = now.strftime("%Y-%m-%d")
+        params["dateRangeEnd"] = (now + timedelta(days=days)).strftime("%Y-%m-%d")
+    return params
+
+
+def fetch_calendar_source(source_name, source_config):
+    """从单个日历数据源获取事件列表，失败时抛出异常"""
+    response = http_request(
+        "GET",
+        source_config["url"],
+        params=build_calendar_params(source_config),
+        timeout=TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    calendar_events = []
     
-    # 获取财经日历事件
-    calendar_events = get_crypto_calendar_events()
+    if source_name == "coinmarketcal" and isinstance(data.get("data"), list):
+        for event in data["data"][:5]:
+            title = event.get("title", {}).get("en", "无标题")
+            date = event.get("date_event", "日期未知")
+            coins = ", ".join([c["name"] for c in event.get("coins", [])])
+            calendar_events.append(f"{date} {title} ({coins})".replace("；", "，"))
     
-    # 构建提示词
-    prompt = f"""现在是北京时间{time_str}，{crypto_name}现价{price}美元。
-    近期财经日历：{calendar_events}
-    美股参考：{"；".join([f"{name} {info['price']}（{'涨' if info['change'] >=0 else '跌'}{abs(info['change'])}%）" for name, info in stock_data.items()])}
-    最新市场资讯：{latest_news}
-    请综合分析以上所有信息，预测{prediction_hours}小时后{crypto_name}的价格走势。"""
+    elif source_name == "coingecko" and isinstance(data.get("data"), dict):
+        for event in data["data"].get("upcoming_events", [])[:5]:
+            title = event.get("title", {}).get("en", "无标题")
+            date = event.get("start_date", "日期未知")
+            calendar_events.append(f"{date} {title}".replace("；", "，"))
     
-    try:
-        session = create_session_with_retry()
-        time.sleep(REQUEST_DELAY)
-        
-        # 第一次请求：获取价格预测
-        response = session.post(
-            DEEPSEEK_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [{"role": "user", "content": prompt}]
-            },
-            timeout=TIMEOUT
-        )
+    if calendar_events:
+        print(f"✅ 财经日历数据获取成功（{source_name}）")
+    return calendar_events
+
+
+def _first_calendar_events(futures, timeout):
+    """等待已提交的数据源请求，返回第一个非空结果；超时或全部失败时返回None"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while futures:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, _ = wait(list(futures), timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            return None
+        for future in done:
+            source_name = futures.pop(future)
+            try:
+                events = future.result()
+            except Exception as e:
+                print(f"❌ 财经日历数据获取失败（{source_name}）：{str(e)}")
+                continue
+            if events:
+                return events
+    return None
+
+
+def fetch_crypto_calendar_events():
+    """获取重要财经事件，全部数据源失败时返回None
+    
+    CALENDAR_HEDGE_DELAY不为None时使用对冲请求：主数据源在该时间内未返回有效结果，
+    就并发请求下一个数据源，采用最先返回的有效结果。
+    """
+    sources = list(get_financial_calendar_sources().items())
+    
+    if CALENDAR_HEDGE_DELAY is None:
+        for source_name, source_config in sources:
+            try:
+                calendar_events = fetch_calendar_source(source_name, source_config)
+            except Exception as e:
+                print(f"❌ 财经日历数据获取失败（{source_name}）：{str(e)}")
+                continue
+            if calendar_events:
+                return "；".join(calendar_events)
+        return None
+    
+    executor = ContextThreadPoolExecutor(max_workers=len(sources) or 1)
+    try:
+        futures = {}
+        for source_name, source_config in sources:
+            futures[executor.submit(fetch_calendar_source, source_name, source_config)] = source_name
+            calendar_events = _first_calendar_events(futures, CALENDAR_HEDGE_DELAY)
+            if calendar_events:
+                return "；".join(calendar_events)
+        calendar_events = _first_calendar_events(futures, None)
+        return "；".join(calendar_events) if calendar_events else None
+    finally:
+        # 不等待较慢的数据源
+        executor.shutdown(wait=False)
+
+
+# 财经日历缓存：进程内共享，并持久化到CACHE_DIR供下次运行使用
+CALENDAR_CACHE_FILE = "calendar.json"
+_calendar_cache = {"events": None, "fetched_at": 0.0, "loaded": False, "refreshing": False}
+_calendar_lock = threading.Lock()
+_calendar_fetch_lock = threading.RLock()
+
+
+def _refresh_calendar_cache():
+    """获取最新日历并写入缓存，返回事件字符串（获取失败时返回None）"""
+    with _calendar_fetch_lock:
+        events = fetch_crypto_calendar_events()
+        with _calendar_lock:
+            if events is not None:
+                _calendar_cache["events"] = events
+                _calendar_cache["fetched_at"] = time.time()
+                try:
+                    save_json_file(cache_path(CALENDAR_CACHE_FILE), {
+                        "events": events,
+                        "fetched_at": _calendar_cache["fetched_at"]
+                    })
+                except OSError as e:
+                    print(f"❌ 财经日历缓存写入失败：{str(e)}")
+            _calendar_cache["refreshing"] = False
+        return events
+
+
+def get_crypto_calendar_events(force_refresh=False):
+    """获取加密货币重要财经日历事件（带TTL缓存，过期后先返回旧数据并在后台刷新）"""
+    with _calendar_lock:
+        if not _calendar_cache["loaded"]:
+            cached = load_json_file(os.path.join(CACHE_DIR, CALENDAR_CACHE_FILE), {})
+            if cached.get("events"):
+                _calendar_cache["events"] = cached["events"]
+                _calendar_cache["fetched_at"] = float(cached.get("fetched_at", 0))
+            _calendar_cache["loaded"] = True
+        
+        events = _calendar_cache["events"]
+        age = time.time() - _calendar_cache["fetched_at"]
+        if events is not None and not force_refresh:
+            if age < CALENDAR_CACHE_TTL:
+                return events
+            if age < CALENDAR_CACHE_STALE_TTL:
+                # 数据略旧：直接返回，同时在后台刷新（同一时间只刷新一次）
+                if not _calendar_cache["refreshing"]:
+                    _calendar_cache["refreshing"] = True
+                    threading.Thread(target=contextvars.copy_context().run, args=(_refresh_calendar_cache,),
+                                     daemon=True).start()
+                return events
+        _calendar_cache["refreshing"] = True
+    
+    # 无缓存或缓存过旧：同步获取（并发调用方共用同一次请求）
+    with _calendar_fetch_lock:
+        with _calendar_lock:
+            if not force_refresh and _calendar_cache["events"] is not None and \
+                    time.time() - _calendar_cache["fetched_at"] < CALENDAR_CACHE_TTL:
+                _calendar_cache["refreshing"] = False
+                return _calendar_cache["events"]
+        events = _refresh_calendar_cache()
+    
+    if events is None:
+        events = _calendar_cache["events"]
+    return events if events is not None else "未获取到近期重要财经事件"
+
+# --------------------------
+# 1. 获取美股数据（使用yfinance）
+# --------------------------
+def _new_york_utc_offset(utc_time):
+    """纽约时区相对UTC的偏移（按美国夏令时规则：3月第二个周日至11月第一个周日）"""
+    year = utc_time.year
+    march = datetime(year, 3, 8, tzinfo=timezone.utc)
+    november = datetime(year, 11, 1, tzinfo=timezone.utc)
+    # 夏令时切换发生在当地凌晨2点（即UTC 7点 / 6点）
+    dst_start = march + timedelta(days=(6 - march.weekday()) % 7, hours=7)
+    dst_end = november + timedelta(days=(6 - november.weekday()) % 7, hours=6)
+    return timedelta(hours=-4) if dst_start <= utc_time < dst_end else timedelta(hours=-5)
+
+
+def us_market_session(now=None):
+    """返回(是否开盘, 下一次状态切换的UTC时间)；美股常规交易时段为工作日9:30-16:00（不含节假日）"""
+    now = now or datetime.now(timezone.utc)
+    offset = _new_york_utc_offset(now)
+    local = (now + offset).replace(tzinfo=None)
+    open_time = local.replace(hour=9, minute=30, second=0, microsecond=0)
+    close_time = local.replace(hour=16, minute=0, second=0, microsecond=0)
+    
+    if local.weekday() < 5 and open_time <= local < close_time:
+        return True, (close_time - offset).replace(tzinfo=timezone.utc)
+    
+    next_open = open_time if local < open_time else open_time + timedelta(days=1)
+    while next_open.weekday() >= 5:
+        next_open += timedelta(days=1)
+    # 开盘日与当前可能分处夏令时切换的两侧，需按开盘当天的偏移换算
+    open_offset = _new_york_utc_offset((next_open - offset).replace(tzinfo=timezone.utc))
+    return False, (next_open - open_offset).replace(tzinfo=timezone.utc)
+
+
+def fetch_us_index_quotes(symbols):
+    """一次请求批量获取多个指数的日线收盘价，返回 代码 -> (最新价, 前收盘价)"""
+    return cassette_call("yfinance.download", list(symbols), lambda: _download_us_index_quotes(symbols))
+
+
+def _download_us_index_quotes(symbols):
+    data = yf.download(
+        list(symbols),
+        period="5d",
+        interval="1d",
+        group_by="column",
+        auto_adjust=False,
+        progress=False
+    )
+    quotes = {}
+    if data is None or data.empty:
+        return quotes
+    
+    closes = data["Close"]
+    for symbol in symbols:
+        if symbol not in closes:
+            continue
+        series = closes[symbol].dropna()
+        if len(series) >= 2:
+            quotes[symbol] = (float(series.iloc[-1]), float(series.iloc[-2]))
+    return quotes
+
+
+def fetch_us_index_quote_single(symbol):
+    """批量结果缺失时的单个指数兜底：fast_info只读取价格字段"""
+    def fetch():
+        info = yf.Ticker(symbol).fast_info
+        return float(info["lastPrice"]), float(info["previousClose"])
+    
+    return cassette_call("yfinance.fast_info", symbol, fetch)
+
+
+US_STOCK_CACHE_FILE = "us_stocks.json"
+_us_stock_cache = {}
+_us_stock_lock = threading.Lock()
+
+
+def get_us_stock_data(force_refresh=False):
+    """获取美股三大指数的最新价格和涨跌幅
+    
+    所有指数通过一次批量请求获取，结果按交易时段缓存：开盘期间缓存US_STOCK_CACHE_TTL秒，
+    休市期间直接复用收盘数据到下次开盘，不发起任何网络请求。
+    """
+    symbols = sorted(US_STOCKS.values())
+    if not symbols:
+        return {}
+    now = time.time()
+    with _us_stock_lock:
+        if not _us_stock_cache:
+            _us_stock_cache.update(load_json_file(os.path.join(CACHE_DIR, US_STOCK_CACHE_FILE), {}))
+        if (not force_refresh and _us_stock_cache.get("symbols") == symbols
+                and now < _us_stock_cache.get("valid_until", 0)):
+            return dict(_us_stock_cache["data"])
+    
+    breaker = get_circuit_breaker(YAHOO_FINANCE_HOST)
+    quotes = {}
+    for attempt in range(MAX_RETRIES):
+        if not breaker.allow_request():
+            print("❌ 美股数据获取失败：Yahoo处于熔断状态")
+            break
+        METRICS.incr("sleep_seconds_total", rate_limit(YAHOO_FINANCE_HOST), reason="rate_limit")
+        start = time.monotonic()
+        try:
+            quotes = fetch_us_index_quotes(symbols)
+            if not quotes:
+                # yfinance下载失败时返回空表而不抛异常
+                raise ValueError("未返回任何指数数据")
+            METRICS.observe_request(YAHOO_FINANCE_HOST, time.monotonic() - start, 200)
+            breaker.record_success()
+            break
+        except ImportError as e:
+            # 未安装yfinance时不重试，也不计入Yahoo的熔断
+            print(f"❌ 美股数据获取失败：{str(e)}（需要安装：pip install yfinance）")
+            return {}
+        except Exception as e:
+            METRICS.observe_request(YAHOO_FINANCE_HOST, time.monotonic() - start, "error")
+            breaker.record_failure()
+            if attempt < MAX_RETRIES - 1 and current_run_budget().try_consume_retry():
+                METRICS.incr("http_retries_total", host=YAHOO_FINANCE_HOST)
+                delay = _retry_delay(attempt)
+                METRICS.incr("sleep_seconds_total", delay, reason="backoff")
+                time.sleep(delay)
+                continue
+            print(f"❌ 美股数据批量获取失败：{str(e)}")
+    
+    stock_data = {}
+    for name, symbol in US_STOCKS.items():
+        quote = quotes.get(symbol)
+        if quote is None and breaker.allow_request():
+            METRICS.incr("sleep_seconds_total", rate_limit(YAHOO_FINANCE_HOST), reason="rate_limit")
+            start = time.monotonic()
+            try:
+                quote = fetch_us_index_quote_single(symbol)
+                METRICS.observe_request(YAHOO_FINANCE_HOST, time.monotonic() - start, 200)
+                breaker.record_success()
+            except Exception as e:
+                METRICS.observe_request(YAHOO_FINANCE_HOST, time.monotonic() - start, "error")
+                breaker.record_failure()
+                print(f"❌ 美股数据 - {name} 获取失败：{str(e)}")
+        if quote is None:
+            continue
+        
+        # 提取价格和计算涨跌幅
+        price = round(quote[0], 2)
+        prev_close = quote[1] or price
+        change = round(((price - prev_close) / prev_close) * 100, 2)
+        stock_data[name] = {
+            "price": price,
+            "change": change
+        }
+        print(f"✅ 美股数据 - {name}：{price}（{change}%）")
+    
+    if len(stock_data) == len(US_STOCKS):
+        market_open, next_change = us_market_session()
+        valid_until = now + US_STOCK_CACHE_TTL if market_open else next_change.timestamp()
+        with _us_stock_lock:
+            _us_stock_cache.clear()
+            _us_stock_cache.update({
+                "symbols": symbols,
+                "data": stock_data,
+                "fetched_at": now,
+                "valid_until": valid_until
+            })
+            try:
+                save_json_file(cache_path(US_STOCK_CACHE_FILE), _us_stock_cache)
+            except OSError as e:
+                print(f"❌ 美股数据缓存写入失败：{str(e)}")
+    return stock_data
+
+
+def clear_caches():
+    """清空进程内的缓存与按主机状态（财经日历、美股数据、限流器、熔断器、行情数据源统计），下一次调用将重新获取"""
+    with _calendar_lock:
+        _calendar_cache.update({"events": None, "fetched_at": 0.0, "loaded": False, "refreshing": False})
+    with _us_stock_lock:
+        _us_stock_cache.clear()
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+    with _circuit_breakers_lock:
+        _circuit_breakers.clear()
+    for provider in PRICE_PROVIDER_REGISTRY.values():
+        provider.stats = ProviderStats()
+    PREDICTION_CACHE.clear()
+    NEWS_INDEX.close()
+    PREDICTION_HISTORY.close()
+
+
+# --------------------------
+# 2. 获取最新资讯（本地资讯索引 + 近似重复合并）
+# --------------------------
+_NEWS_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_news_text(text):
+    """去除空白与标点并转为小写，用于计算内容哈希与SimHash"""
+    return _NEWS_PUNCTUATION.sub("", str(text)).lower()
+
+
+def simhash(text, shingle=3):
+    """64位SimHash：以字符n-gram为特征（中英文通用），相似文本的签名汉明距离小"""
+    text = normalize_news_text(text)
+    if len(text) <= shingle:
+        features = [text]
+    else:
+        features = [text[i:i + shingle] for i in range(len(text) - shingle + 1)]
+    weights = [0] * 64
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _to_signed64(value):
+    """SQLite整数为有符号64位"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class NewsIndex:
+    """持久化的资讯索引（SQLite）
+    
+    每条资讯保存内容哈希与SimHash签名；与时间窗口内已有资讯的签名足够接近时归入同一聚类，
+    各关键词的上次搜索时间与搜索间隔也保存在索引中，用于跳过短时间内的重复搜索。
+    """
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS news (
+        id INTEGER PRIMARY KEY,
+        query TEXT NOT NULL,
+        title TEXT NOT NULL,
+        snippet TEXT NOT NULL,
+        url TEXT,
+        content_hash TEXT NOT NULL UNIQUE,
+        simhash INTEGER NOT NULL,
+        cluster_id INTEGER,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS news_last_seen ON news (last_seen);
+    CREATE TABLE IF NOT EXISTS query_state (
+        query TEXT PRIMARY KEY,
+        fetched_at REAL NOT NULL,
+        interval REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = None
+    
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(cache_path(self.filename), check_same_thread=False)
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+    
+    def due_queries(self, queries, now=None):
+        """返回已到搜索时间的关键词（从未搜索过的关键词总是需要搜索）"""
+        now = now or time.time()
+        with self.lock:
+            rows = dict((query, fetched_at + interval) for query, fetched_at, interval in
+                        self._connect().execute("SELECT query, fetched_at, interval FROM query_state"))
+        return [query for query in queries if rows.get(query, 0) <= now]
+    
+    def ingest(self, query, items, now=None):
+        """写入一次搜索结果，返回新增的聚类数（完全相同或近似重复的资讯不计入）
+        
+        items为(标题, 摘要, 链接)列表；同时更新该关键词的搜索时间与下次搜索间隔。
+        """
+        now = now or time.time()
+        new_clusters = 0
+        with self.lock:
+            conn = self._connect()
+            window_start = now - NEWS_WINDOW_HOURS * 3600
+            recent = [(cluster_id, signature) for cluster_id, signature in conn.execute(
+                "SELECT cluster_id, simhash FROM news WHERE last_seen >= ?", (window_start,))]
+            for title, snippet, url in items:
+                content_hash = hashlib.sha256(normalize_news_text(f"{title}{snippet}").encode("utf-8")).hexdigest()
+                row = conn.execute("SELECT id FROM news WHERE content_hash = ? OR (url IS NOT NULL AND url = ?)",
+                                   (content_hash, url)).fetchone()
+                if row:
+                    conn.execute("UPDATE news SET last_seen = ? WHERE cluster_id = "
+                                 "(SELECT cluster_id FROM news WHERE id = ?)", (now, row[0]))
+                    continue
+                signature = simhash(f"{title} {snippet}")
+                cluster_id = next((cid for cid, other in recent
+                                   if hamming_distance(signature, other & (1 << 64) - 1) <= NEWS_SIMHASH_DISTANCE),
+                                  None)
+                cursor = conn.execute(
+                    "INSERT INTO news (query, title, snippet, url, content_hash, simhash, cluster_id, "
+                    "first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (query, title, snippet, url, content_hash, _to_signed64(signature), cluster_id, now, now)
+                )
+                if cluster_id is None:
+                    cluster_id = cursor.lastrowid
+                    conn.execute("UPDATE news SET cluster_id = ? WHERE id = ?", (cluster_id, cluster_id))
+                    new_clusters += 1
+                else:
+                    conn.execute("UPDATE news SET last_seen = ? WHERE cluster_id = ?", (now, cluster_id))
+                recent.append((cluster_id, signature))
+            
+            # 有新资讯时恢复默认间隔，否则间隔加倍
+            previous = conn.execute("SELECT interval FROM query_state WHERE query = ?", (query,)).fetchone()
+            if new_clusters or previous is None:
+                interval = NEWS_QUERY_REFRESH_INTERVAL
+            else:
+                interval = min(previous[0] * 2, NEWS_QUERY_MAX_INTERVAL)
+            conn.execute("INSERT OR REPLACE INTO query_state (query, fetched_at, interval) VALUES (?, ?, ?)",
+                         (query, now, interval))
+            conn.execute("DELETE FROM news WHERE last_seen < ?", (now - NEWS_RETENTION_DAYS * 86400,))
+            conn.commit()
+        return new_clusters
+    
+    def clusters(self, since=None, limit=None, now=None):
+        """返回时间窗口内的资讯聚类（代表资讯的标题、摘要与报道数），最新出现的在前
+        
+        since不为None时只返回在该时间之后首次出现的聚类（增量模式）。
+        """
+        now = now or time.time()
+        with self.lock:
+            return self._connect().execute(
+                "SELECT rep.title, rep.snippet, COUNT(*) FROM news rep JOIN news member ON member.cluster_id = rep.id "
+                "WHERE rep.id = rep.cluster_id AND rep.first_seen > ? AND rep.last_seen >= ? "
+                "GROUP BY rep.id ORDER BY rep.first_seen DESC, rep.id LIMIT ?",
+                (since or 0, now - NEWS_WINDOW_HOURS * 3600, -1 if limit is None else limit)
+            ).fetchall()
+    
+    def get_marker(self, key):
+        with self.lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_marker(self, key, value):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            conn.commit()
+
+
+NEWS_INDEX_FILE = "news.sqlite3"
+NEWS_INDEX = NewsIndex(NEWS_INDEX_FILE)
+
+
+def format_news_item(title, snippet, reports=1):
+    """单条资讯在提示词中的格式；近似重复的多篇报道合并为一条并标注报道数"""
+    # "；"用于分隔各条资讯，内容中的"；"替换为"，"
+    text = f"{title}：{snippet[:150]}...".replace("；", "，")
+    return f"{text}（{reports}篇相似报道）" if reports > 1 else text
+
+
+def get_latest_news(incremental=None):
+    """根据博查API调试结果优化的最终版本：单关键词单请求，精准提取资讯（各关键词并发请求）
+    
+    启用资讯索引时，只搜索已到刷新时间的关键词，结果写入索引并合并近似重复的报道，
+    返回时间窗口内的资讯；incremental为True（默认NEWS_INCREMENTAL）时只返回上次运行以来的新资讯。
+    """
+    incremental = NEWS_INCREMENTAL if incremental is None else incremental
+    # 经调试确认的有效认证头
+    headers = {
+        "Authorization": f"Bearer {getattr(_config, 'SEARCH_API_KEY', '')}",
+        "Content-Type": "application/json"
+    }
+    
+    def search(query):
+        query_news = []
+        try:
+            payload = {
+                "query": query,
+                "count": 5,   # 从2增加到5
+                "freshness": "oneDay"     # 只获取1天内的最新资讯
+            }
+            
+            # 执行单次有效请求（限流、熔断与重试由http_request处理）
+            response = http_request(
+                "POST",
+                SEARCH_API_URL,
+                headers=headers,
+                json=payload,
+                timeout=TIMEOUT
+            )
+            
+            # 确保请求成功（状态码200）
+            response.raise_for_status()
+            data = response.json()
+            
+            # 精准匹配博查API的响应结构：data -> webPages -> value
+            if ("data" in data and 
+                "webPages" in data["data"] and 
+                isinstance(data["data"]["webPages"].get("value"), list)):
+                
+                # 提取更多资讯内容
+                for item in data["data"]["webPages"]["value"][:5]:  # 从2增加到5
+                    # 提取标题（优先name字段）、摘要（优先snippet字段）与链接
+                    query_news.append((item.get("name", "无标题"), item.get("snippet", "无摘要"), item.get("url")))
+                
+                print(f"✅ 资讯获取成功（{query}）：{len(query_news)}条结果")
+        
+        except Exception as e:
+            print(f"❌ 资讯获取失败（{query}）：{str(e)}")
+            return None
+        return query_news
+    
+    if not NEWS_INDEX_ENABLED:
+        # 按关键词顺序合并结果，去除完全相同的资讯（保留首次出现的内容）
+        news_summary = [format_news_item(title, snippet)
+                        for query_news in parallel_map(search, SEARCH_QUERIES)
+                        for title, snippet, _ in query_news or []]
+        unique_news = list(dict.fromkeys(news_summary))
+        return "；".join(unique_news[:NEWS_MAX_ITEMS]) if unique_news else "未获取到最新资讯"
+    
+    since = NEWS_INDEX.get_marker("last_run") if incremental else None
+    due = NEWS_INDEX.due_queries(SEARCH_QUERIES)
+    skipped = len(SEARCH_QUERIES) - len(due)
+    if skipped:
+        METRICS.incr("news_queries_skipped_total", skipped)
+        print(f"   资讯索引：{skipped}个关键词未到刷新时间，使用本地资讯")
+    
+    # 并发搜索，按关键词顺序写入索引：资讯的先后顺序不取决于请求完成的先后，同样的搜索结果生成同样的提示词
+    for query, query_news in zip(due, parallel_map(search, due)):
+        # 搜索失败时不更新搜索时间，下次运行重试
+        if query_news is not None:
+            new_clusters = NEWS_INDEX.ingest(query, query_news)
+            METRICS.incr("news_new_clusters_total", new_clusters)
+    # 增量模式的分界点：本轮写入的资讯在下一轮不再视为新资讯
+    NEWS_INDEX.set_marker("last_run", time.time())
+    
+    clusters = NEWS_INDEX.clusters(since=since, limit=NEWS_MAX_ITEMS)
+    if not clusters:
+        return "暂无新增资讯" if incremental and since is not None else "未获取到最新资讯"
+    return "；".join(format_news_item(*cluster) for cluster in clusters)
+
+# --------------------------
+# 3. 获取加密货币价格
+# --------------------------
+def parse_okx_ticker(item):
+    """将OKX行情数据整理为统一字段：最新价、买一/卖一价及24小时成交量等"""
+    def number(key):
+        value = item.get(key)
+        return round(float(value), 15) if value not in (None, "") else None
+    
+    return {
+        "last": number("last"),
+        "bid": number("bidPx"),
+        "ask": number("askPx"),
+        "vol24h": number("vol24h"),          # 24小时成交量（币）
+        "vol_ccy24h": number("volCcy24h"),   # 24小时成交额（计价货币）
+        "open24h": number("open24h"),
+        "high24h": number("high24h"),
+        "low24h": number("low24h"),
+        "ts": item.get("ts")
+    }
+
+
+def fetch_okx_ticker(pair, max_attempts=None, timeout=TIMEOUT):
+    """单个交易对行情：调用/api/v5/market/ticker"""
+    params = {"instId": pair}
+    request_path = f"{urlparse(OKX_API_URL).path}?{urlencode(params)}"
+    response = http_request(
+        "GET",
+        OKX_API_URL,
+        max_attempts=max_attempts,
+        headers=okx_headers(request_path),
+        params=params,
+        timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get("code") == "0" and data.get("data"):
+        return parse_okx_ticker(data["data"][0])
+    return None
+
+
+def fetch_okx_tickers_bulk(inst_type="SPOT", max_attempts=None, timeout=TIMEOUT):
+    """批量行情：一次请求/api/v5/market/tickers，返回instId -> 原始行情的索引"""
+    params = {"instType": inst_type}
+    request_path = f"{urlparse(OKX_TICKERS_URL).path}?{urlencode(params)}"
+    response = http_request(
+        "GET",
+        OKX_TICKERS_URL,
+        max_attempts=max_attempts,
+        headers=okx_headers(request_path),
+        params=params,
+        timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get("code") != "0" or not isinstance(data.get("data"), list):
+        raise ValueError(f"批量行情返回异常：{data.get('msg', data.get('code'))}")
+    return {item["instId"]: item for item in data["data"] if "instId" in item}
+
+
+def parse_binance_ticker(item):
+    """将Binance 24小时行情整理为与parse_okx_ticker相同的字段"""
+    def number(key):
+        value = item.get(key)
+        return round(float(value), 15) if value not in (None, "") else None
+    
+    return {
+        "last": number("lastPrice"),
+        "bid": number("bidPrice"),
+        "ask": number("askPrice"),
+        "vol24h": number("volume"),
+        "vol_ccy24h": number("quoteVolume"),
+        "open24h": number("openPrice"),
+        "high24h": number("highPrice"),
+        "low24h": number("lowPrice"),
+        "ts": str(item["closeTime"]) if item.get("closeTime") is not None else None
+    }
+
+
+# Binance批量行情每次请求的交易对数上限（symbols参数放在查询字符串中）
+BINANCE_SYMBOLS_PER_REQUEST = 100
+
+
+def binance_symbol(pair):
+    """OKX格式的交易对转为Binance代码：BTC-USDT -> BTCUSDT"""
+    return pair.replace("-", "").upper()
+
+
+class ProviderStats:
+    """行情数据源最近PRICE_STATS_WINDOW次请求的耗时与成败，用于按延迟与错误率排序"""
+    
+    def __init__(self, window=None):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=window or PRICE_STATS_WINDOW)
+    
+    def record(self, seconds, ok):
+        with self.lock:
+            self.samples.append((seconds, ok))
+    
+    def score(self):
+        """排序得分（秒，越小越优先）：成功请求的p90延迟 + 错误率 × PRICE_ERROR_PENALTY；没有记录时为0，优先试用"""
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return 0.0
+        latencies = sorted(seconds for seconds, ok in samples if ok)
+        errors = sum(1 for _, ok in samples if not ok) / len(samples)
+        p90 = latencies[int(0.9 * (len(latencies) - 1))] if latencies else PRICE_ERROR_PENALTY
+        return p90 + errors * PRICE_ERROR_PENALTY
+    
+    def snapshot(self):
+        with self.lock:
+            samples = list(self.samples)
+        latencies = sorted(seconds for seconds, ok in samples if ok)
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "p50_seconds": round(latencies[len(latencies) // 2], 4) if latencies else None,
+            "score": round(self.score(), 4)
+        }
+
+
+class PriceProvider(ABC):
+    """行情数据源：fetch_all返回 交易对 -> 行情（字段见parse_okx_ticker），fetch_one返回单个交易对的行情或None
+    
+    子类实现host/_fetch_all/_fetch_one（缺少任一项时无法实例化）；
+    每次调用的耗时与成败记录在stats中，由rank_price_providers用于排序。
+    """
+    
+    name = None
+    
+    def __init__(self):
+        self.stats = ProviderStats()
+    
+    @property
+    @abstractmethod
+    def host(self):
+        """数据源的主机名（用于熔断与限流）"""
+    
+    @abstractmethod
+    def _fetch_all(self, crypto_pairs, max_attempts, timeout):
+        """批量获取，返回 交易对 -> 行情"""
+    
+    @abstractmethod
+    def _fetch_one(self, pair, max_attempts, timeout):
+        """获取单个交易对的行情，失败时返回None"""
+    
+    def _timed(self, func, *args):
+        start = time.monotonic()
+        try:
+            result = func(*args)
+        except Exception:
+            self.stats.record(time.monotonic() - start, False)
+            raise
+        self.stats.record(time.monotonic() - start, True)
+        return result
+    
+    def fetch_all(self, crypto_pairs, max_attempts=None, timeout=TIMEOUT):
+        return self._timed(self._fetch_all, crypto_pairs, max_attempts, timeout)
+    
+    def fetch_one(self, pair, max_attempts=None, timeout=TIMEOUT):
+        return self._timed(self._fetch_one, pair, max_attempts, timeout)
+
+
+class OkxPriceProvider(PriceProvider):
+    name = "okx"
+    
+    @property
+    def host(self):
+        return url_host(OKX_TICKERS_URL)
+    
+    def _fetch_all(self, crypto_pairs, max_attempts, timeout):
+        index = fetch_okx_tickers_bulk(max_attempts=max_attempts, timeout=timeout)
+        return {pair: parse_okx_ticker(index[pair]) for pair in crypto_pairs if pair in index}
+    
+    def _fetch_one(self, pair, max_attempts, timeout):
+        return fetch_okx_ticker(pair, max_attempts=max_attempts, timeout=timeout)
+
+
+class BinancePriceProvider(PriceProvider):
+    """Binance行情：批量模式用symbols参数只请求需要的交易对（每次最多BINANCE_SYMBOLS_PER_REQUEST个）
+    
+    symbols中只要有一个Binance未上线的交易对，整个请求就返回400：此时逐个查询该批交易对，
+    并记住未上线的交易对，之后的批量请求不再包含它们。
+    """
+    
+    name = "binance"
+    
+    def __init__(self):
+        super().__init__()
+        self.unlisted = set()
+    
+    @property
+    def host(self):
+        return url_host(BINANCE_TICKER_URL)
+    
+    def _fetch_all(self, crypto_pairs, max_attempts, timeout):
+        pairs = {binance_symbol(pair): pair for pair in crypto_pairs if binance_symbol(pair) not in self.unlisted}
+        symbols = list(pairs)
+        tickers = {}
+        for start in range(0, len(symbols), BINANCE_SYMBOLS_PER_REQUEST):
+            chunk = symbols[start:start + BINANCE_SYMBOLS_PER_REQUEST]
+            response = http_request("GET", BINANCE_TICKER_URL, max_attempts=max_attempts, timeout=timeout,
+                                    params={"symbols": json.dumps(chunk, separators=(",", ":"))})
+            if response.status_code == 400:
+                results = parallel_map(lambda symbol: self._fetch_one(pairs[symbol], max_attempts, timeout), chunk)
+                tickers.update((pairs[symbol], ticker) for symbol, ticker in zip(chunk, results) if ticker)
+                continue
+            response.raise_for_status()
+            for item in response.json():
+                pair = pairs.get(item.get("symbol"))
+                if pair:
+                    tickers[pair] = parse_binance_ticker(item)
+        return tickers
+    
+    def _fetch_one(self, pair, max_attempts, timeout):
+        response = http_request("GET", BINANCE_TICKER_URL, max_attempts=max_attempts,
+                                params={"symbol": binance_symbol(pair)}, timeout=timeout)
+        if response.status_code == 400:
+            # 交易对未在Binance上线，不计为数据源故障
+            self.unlisted.add(binance_symbol(pair))
+            return None
         response.raise_for_status()
-        result = json.loads(response.content.decode('utf-8'))["choices"][0]["message"]["content"].strip()
+        return parse_binance_ticker(response.json())
+
+
+PRICE_PROVIDER_REGISTRY = {provider.name: provider for provider in (OkxPriceProvider(), BinancePriceProvider())}
+
+
+def rank_price_providers(names=None):
+    """按排序得分返回启用的数据源；熔断中的数据源排除在外（全部熔断时仍返回全部）"""
+    providers = []
+    for name in names or PRICE_PROVIDERS:
+        if name not in PRICE_PROVIDER_REGISTRY:
+            raise ValueError(f"未知的行情数据源：{name}")
+        providers.append(PRICE_PROVIDER_REGISTRY[name])
+    healthy = [provider for provider in providers if not get_circuit_breaker(provider.host).is_open()] or providers
+    return sorted(healthy, key=lambda provider: (provider.stats.score(), providers.index(provider)))
+
+
+def get_price_provider_stats():
+    """各数据源的请求数、错误数、p50延迟与排序得分"""
+    return {name: provider.stats.snapshot() for name, provider in PRICE_PROVIDER_REGISTRY.items()}
+
+
+def _fan_out(providers, fetch, wanted, mode):
+    """并发调用fetch(数据源)（返回 交易对 -> 行情），返回 交易对 -> [(数据源, 行情), ...]（按完成顺序）
+    
+    mode为"first"时wanted中的交易对都有有效行情后立即返回，不等待较慢的数据源。
+    完成顺序经录制文件记录：回放时等待全部数据源，再按录制时的完成顺序排列，使"first"选出同一个数据源。
+    """
+    collected = {}
+    completed = []
+    replaying = is_replaying()
+    executor = ContextThreadPoolExecutor(max_workers=len(providers))
+    try:
+        futures = {executor.submit(fetch, provider): provider for provider in providers}
+        for future in as_completed(futures):
+            provider = futures[future]
+            completed.append(provider.name)
+            try:
+                tickers = future.result()
+            except Exception as e:
+                print(f"❌ 行情获取失败（{provider.name}）：{str(e)}")
+                continue
+            for pair in wanted:
+                ticker = tickers.get(pair)
+                if ticker and ticker["last"] is not None:
+                    collected.setdefault(pair, []).append((provider, ticker))
+            if mode == "first" and len(collected) == len(wanted) and not replaying:
+                break
+    finally:
+        executor.shutdown(wait=False)
+    order = cassette_call("prices.completion_order", [[provider.name for provider in providers], list(wanted)],
+                          lambda: completed)
+    if replaying:
+        rank = {name: index for index, name in enumerate(order)}
+        for candidates in collected.values():
+            candidates.sort(key=lambda candidate: rank.get(candidate[0].name, len(rank)))
+    return collected
+
+
+def select_ticker(candidates, providers, mode):
+    """从各数据源的行情中选出结果：first取最先返回的；median的最新价取中位数，其余字段取排名最高的数据源"""
+    if mode == "median":
+        candidates = sorted(candidates, key=lambda candidate: providers.index(candidate[0]))
+    provider, ticker = candidates[0]
+    ticker = dict(ticker, source=provider.name)
+    if mode == "median" and len(candidates) > 1:
+        prices = sorted(candidate[1]["last"] for candidate in candidates)
+        middle = len(prices) // 2
+        ticker["last"] = prices[middle] if len(prices) % 2 else round((prices[middle - 1] + prices[middle]) / 2, 12)
+        ticker["source"] = ",".join(candidate[0].name for candidate in candidates)
+    return ticker
+
+
+def get_crypto_tickers(crypto_pairs, bulk=None, providers=None, mode=None):
+    """获取各交易对的完整行情（last/bid/ask/24h成交量），ticker["source"]为行情来源
+    
+    按最近的延迟与错误率选出前PRICE_FANOUT个数据源并发请求，每个交易对按mode（默认PRICE_AGGREGATION）
+    采用最先返回的有效行情或取中位数。批量模式下每个数据源用一次请求覆盖全部交易对，
+    仅对批量结果中缺失的交易对逐个补查（同样并发请求各数据源）。
+    """
+    bulk = OKX_BULK_TICKERS if bulk is None else bulk
+    mode = mode or PRICE_AGGREGATION
+    ranked = rank_price_providers(providers)[:max(1, PRICE_FANOUT)]
+    # 各数据源照常在运行预算内重试；有多个数据源时使用较短的超时，慢的交易所由其他数据源兜底
+    max_attempts, timeout = None, (PRICE_TIMEOUT if len(ranked) > 1 else TIMEOUT)
+    tickers = {}
+    
+    # 实时行情模式：行情表中已有的交易对不再请求REST接口，其余交易对加入订阅后本次仍通过REST获取
+    if PRICE_FEED is not None:
+        PRICE_FEED.subscribe(crypto_pairs)
+        tickers = PRICE_FEED.snapshot(crypto_pairs)
+        if tickers:
+            METRICS.incr("price_source_total", len(tickers), source="okx-ws")
+            print(f"✅ 实时行情：{len(tickers)}/{len(crypto_pairs)}个交易对")
+    rest_pairs = [pair for pair in crypto_pairs if pair not in tickers]
+    
+    def accept(pair, candidates):
+        ticker = select_ticker(candidates, ranked, mode)
+        METRICS.incr("price_source_total", source=ticker["source"])
+        tickers[pair] = ticker
+        print(f"✅ {pair} 价格：{ticker['last']} 美元")
+    
+    if bulk and rest_pairs:
+        collected = _fan_out(ranked, lambda provider: provider.fetch_all(rest_pairs, max_attempts, timeout),
+                             rest_pairs, mode)
+        sources = {}
+        for pair in rest_pairs:
+            if pair in collected:
+                accept(pair, collected[pair])
+                sources[tickers[pair]["source"]] = sources.get(tickers[pair]["source"], 0) + 1
+        detail = "，".join(f"{name} {count}个" for name, count in sources.items())
+        print(f"✅ 批量行情获取成功：{sum(sources.values())}/{len(rest_pairs)}个交易对"
+              + (f"（{detail}）" if detail else ""))
+    
+    def fetch(pair):
+        def fetch_one(provider):
+            return {pair: provider.fetch_one(pair, max_attempts, timeout)}
+        
+        candidates = _fan_out(ranked, fetch_one, [pair], mode).get(pair)
+        if not candidates:
+            print(f"❌ {pair} 价格获取失败：所有数据源均未返回有效行情")
+        return pair, candidates
+    
+    missing = [pair for pair in rest_pairs if pair not in tickers]
+    for pair, candidates in parallel_map(fetch, missing):
+        if candidates:
+            accept(pair, candidates)
+    
+    # 保持与输入相同的交易对顺序
+    return {pair: tickers[pair] for pair in crypto_pairs if pair in tickers}
+
+
+def get_crypto_prices(crypto_pairs, bulk=None):
+    """获取各交易对的最新价格（见get_crypto_tickers）：交易对 -> last"""
+    return {pair: ticker["last"] for pair, ticker in get_crypto_tickers(crypto_pairs, bulk).items()}
+
+
+# --------------------------
+# 3.1 全市场筛选：向量化计算各交易对得分，只将前K个交易对交给模型分析
+# --------------------------
+SCREEN_FIELDS = ("last", "bidPx", "askPx", "open24h", "high24h", "low24h", "volCcy24h")
+
+
+def ticker_arrays(index, quote=None):
+    """将批量行情中以quote计价的交易对整理为NumPy数组，返回(交易对数组, 字段 -> float64数组)；缺失值为NaN"""
+    quote = SCREEN_QUOTE if quote is None else quote
+    suffix = f"-{quote}"
+    pairs = [inst_id for inst_id in index if inst_id.endswith(suffix)]
+    
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+    
+    table = np.array([[number(index[pair].get(field)) for field in SCREEN_FIELDS] for pair in pairs],
+                     dtype=np.float64).reshape(len(pairs), len(SCREEN_FIELDS))
+    return np.array(pairs, dtype=object), {field: table[:, i] for i, field in enumerate(SCREEN_FIELDS)}
+
+
+def _robust_zscore(values):
+    """以中位数与MAD标准化，避免个别极端值主导得分"""
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * 1.4826
+    return (values - median) / mad if mad > 0 else np.zeros_like(values)
+
+
+def screen_tickers(index, top_k=None, quote=None, min_volume=None, max_spread=None, weights=None):
+    """对批量行情做全市场筛选，返回按得分从高到低排列的前top_k个结果
+    
+    每个结果为{"pair", "score", "change", "volatility", "spread", "volume"}；
+    成交额低于min_volume、价差高于max_spread或数据不完整的交易对不参与排名。
+    """
+    top_k = SCREEN_TOP_K if top_k is None else top_k
+    min_volume = SCREEN_MIN_VOLUME if min_volume is None else min_volume
+    max_spread = SCREEN_MAX_SPREAD if max_spread is None else max_spread
+    weights = dict(SCREEN_WEIGHTS, **(weights or {}))
+    
+    pairs, f = ticker_arrays(index, quote)
+    if not len(pairs):
+        return []
+    last, bid, ask = f["last"], f["bidPx"], f["askPx"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = last / f["open24h"] - 1
+        volatility = (f["high24h"] - f["low24h"]) / last
+        spread = (ask - bid) / ((ask + bid) / 2)
+        volume = f["volCcy24h"]
+    
+    valid = np.isfinite(change) & np.isfinite(volatility) & np.isfinite(spread) & np.isfinite(volume) \
+        & (last > 0) & (bid > 0) & (ask >= bid) & (volume >= min_volume) & (spread <= max_spread)
+    if not valid.any():
+        return []
+    pairs, change, volatility, spread, volume = (a[valid] for a in (pairs, change, volatility, spread, volume))
+    
+    score = (weights["change"] * _robust_zscore(np.abs(change))
+             + weights["volatility"] * _robust_zscore(volatility)
+             + weights["volume"] * _robust_zscore(np.log10(volume))
+             - weights["spread"] * _robust_zscore(spread))
+    
+    k = min(top_k, len(score))
+    top = np.argpartition(-score, k - 1)[:k]
+    top = top[np.argsort(-score[top], kind="stable")]
+    return [{
+        "pair": pairs[i],
+        "score": round(float(score[i]), 4),
+        "change": round(float(change[i]) * 100, 2),
+        "volatility": round(float(volatility[i]) * 100, 2),
+        "spread": round(float(spread[i]) * 100, 4),
+        "volume": float(volume[i])
+    } for i in top]
+
+
+def screen_market(top_k=None):
+    """一次批量请求获取全部现货行情并筛选，返回前top_k个交易对的行情（交易对 -> 行情，按得分排序）"""
+    index = fetch_okx_tickers_bulk()
+    start = time.process_time()
+    with METRICS.span("screen", instruments=len(index)):
+        candidates = screen_tickers(index, top_k)
+    print(f"✅ 全市场筛选：{len(index)}个现货交易对，选出{len(candidates)}个"
+          f"（CPU耗时{(time.process_time() - start) * 1000:.1f}毫秒）")
+    for rank, item in enumerate(candidates, 1):
+        print(f"   {rank}. {item['pair']} 得分{item['score']}：24h涨跌{item['change']}%，振幅{item['volatility']}%，"
+              f"价差{item['spread']}%，成交额{item['volume']:.0f}")
+    tickers = {item["pair"]: parse_okx_ticker(index[item["pair"]]) for item in candidates}
+    if PRICE_FEED is not None:
+        # 实时行情模式：订阅选出的交易对，分析前用行情表中的最新价替换筛选时的价格
+        PRICE_FEED.subscribe(list(tickers))
+    return tickers
+
+
+# --------------------------
+# 3.2 本地K线存储与技术指标
+# --------------------------
+OKX_CANDLES_PAGE_LIMIT = 300
+CANDLE_COLUMNS = ("ts", "open", "high", "low", "close", "volume")
+
+
+def fetch_okx_candles(pair, bar=None, before=None, after=None, limit=OKX_CANDLES_PAGE_LIMIT):
+    """调用/api/v5/market/candles，返回按时间升序排列的K线数组（列见CANDLE_COLUMNS，ts为毫秒）
+    
+    before/after为OKX的分页参数：只返回时间戳晚于before、早于after的K线。
+    """
+    params = {"instId": pair, "bar": bar or CANDLE_BAR, "limit": limit}
+    if before is not None:
+        params["before"] = int(before)
+    if after is not None:
+        params["after"] = int(after)
+    request_path = f"{urlparse(OKX_CANDLES_URL).path}?{urlencode(params)}"
+    response = http_request(
+        "GET",
+        OKX_CANDLES_URL,
+        headers=okx_headers(request_path),
+        params=params,
+        timeout=TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get("code") != "0" or not isinstance(data.get("data"), list):
+        raise ValueError(f"K线返回异常：{data.get('msg', data.get('code'))}")
+    rows = [[float(value) for value in row[:len(CANDLE_COLUMNS)]] for row in data["data"]]
+    candles = np.array(rows, dtype=np.float64).reshape(len(rows), len(CANDLE_COLUMNS))
+    return candles[np.argsort(candles[:, 0], kind="stable")]
+
+
+def bar_milliseconds(bar):
+    """K线周期的毫秒数（如"15m"、"1H"、"1D"），无法识别时返回None"""
+    match = re.match(r"^(\d+)([mHDW])", bar or "")
+    if not match:
+        return None
+    return int(match.group(1)) * {"m": 60, "H": 3600, "D": 86400, "W": 604800}[match.group(2)] * 1000
+
+
+def merge_candles(stored, new):
+    """按时间戳合并两组K线，同一时间戳以new为准（未收盘的K线会在下次同步时被覆盖）"""
+    combined = np.concatenate([new, stored])
+    _, first = np.unique(combined[:, 0], return_index=True)
+    return combined[first]
+
+
+class CandleStore:
+    """本地K线存储：每个交易对、周期一个.npy文件（float64，列见CANDLE_COLUMNS），读取时整体载入内存
+    
+    同步时只请求本地最后一根K线之后的数据（最后一根可能尚未收盘，会重新获取）；
+    本地已有当前周期的K线时不发请求，同一周期内的多次运行只在第一次访问网络。
+    指定max_age（秒）时，距上次写入超过max_age的未收盘K线会重新获取（守护进程按刷新间隔更新当前K线）。
+    """
+    
+    def __init__(self, directory="candles", bar=None):
+        self.directory = directory
+        self.bar = bar or CANDLE_BAR
+    
+    def path(self, pair):
+        os.makedirs(os.path.join(CACHE_DIR, self.directory), exist_ok=True)
+        return os.path.join(CACHE_DIR, self.directory, f"{pair}_{self.bar}.npy")
+    
+    def load(self, pair):
+        # 不使用内存映射：同步时会用os.replace覆盖同一文件，Windows上无法替换仍被映射的文件
+        try:
+            return np.load(self.path(pair))
+        except (OSError, ValueError):
+            return np.empty((0, len(CANDLE_COLUMNS)), dtype=np.float64)
+    
+    def save(self, pair, candles):
+        path = self.path(pair)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(candles))
+        os.replace(tmp_path, path)
+    
+    def _fetch_since(self, pair, last_ts):
+        """获取last_ts（含）之后的全部K线；超过一页时向前翻页直到与本地数据衔接"""
+        pages = []
+        after = None
+        while True:
+            page = fetch_okx_candles(pair, self.bar, before=last_ts - 1, after=after)
+            if len(page):
+                pages.append(page)
+            if len(page) < OKX_CANDLES_PAGE_LIMIT or page[0, 0] <= last_ts:
+                break
+            after = page[0, 0]
+        return np.concatenate(pages) if pages else np.empty((0, len(CANDLE_COLUMNS)))
+    
+    def backfill(self, pair, start_ts):
+        """向前补齐K线直到覆盖start_ts（毫秒），最多保留CANDLE_MAX_BARS根，返回全部本地K线"""
+        candles, _ = self.sync(pair)
+        pages = []
+        oldest = candles[0, 0] if len(candles) else None
+        total = len(candles)
+        while oldest is not None and oldest > start_ts and total < CANDLE_MAX_BARS:
+            page = fetch_okx_candles(pair, self.bar, after=oldest,
+                                     limit=min(OKX_CANDLES_PAGE_LIMIT, CANDLE_MAX_BARS - total))
+            if not len(page):
+                break
+            pages.append(page)
+            total += len(page)
+            oldest = page[0, 0]
+        if not pages:
+            return candles
+        candles = merge_candles(np.asarray(candles), np.concatenate(pages))
+        self.save(pair, candles)
+        return candles
+    
+    def _fetch_history(self, pair, count):
+        """首次同步：从最新K线向前获取count根"""
+        pages = []
+        after = None
+        total = 0
+        while total < count:
+            page = fetch_okx_candles(pair, self.bar, after=after, limit=min(OKX_CANDLES_PAGE_LIMIT, count - total))
+            if not len(page):
+                break
+            pages.append(page)
+            total += len(page)
+            after = page[0, 0]
+        return np.concatenate(pages) if pages else np.empty((0, len(CANDLE_COLUMNS)))
+    
+    def synced_at(self, pair):
+        """本地K线文件的最后写入时间（Unix时间戳），文件不存在时返回None"""
+        try:
+            return os.path.getmtime(self.path(pair))
+        except OSError:
+            return None
+    
+    def sync(self, pair, max_age=None):
+        """增量同步并返回该交易对的全部本地K线，返回(K线数组, 新获取的K线数)"""
+        stored = self.load(pair)
+        bar_ms = bar_milliseconds(self.bar)
+        if len(stored) and bar_ms and stored[-1, 0] + bar_ms > time.time() * 1000:
+            synced_at = self.synced_at(pair)
+            if max_age is None or (synced_at is not None and time.time() - synced_at < max_age):
+                return stored, 0
+        if len(stored):
+            new = self._fetch_since(pair, stored[-1, 0])
+        else:
+            new = self._fetch_history(pair, CANDLE_HISTORY)
+        if not len(new):
+            return stored, 0
+        candles = merge_candles(np.asarray(stored), new)[-CANDLE_MAX_BARS:]
+        self.save(pair, candles)
+        return candles, len(new)
+
+
+CANDLE_STORE = CandleStore()
+
+
+def rolling_mean(values, window):
+    """简单移动平均（基于累加和，返回长度为len(values) - window + 1的数组）"""
+    sums = np.cumsum(np.insert(values, 0, 0.0))
+    return (sums[window:] - sums[:-window]) / window
+
+
+def compute_indicators(candles, atr_period=14, rsi_period=14, ma_periods=(20, 50)):
+    """在K线数组上向量化计算技术指标，返回最新一根K线的指标字典（数据不足的指标为None）"""
+    if len(candles) < 2:
+        return None
+    candles = np.asarray(candles)
+    high, low, close = candles[:, 2], candles[:, 3], candles[:, 4]
+    bar_ms = float(np.median(np.diff(candles[:, 0])))
+    bars_per_day = max(1, int(round(86400000 / bar_ms))) if bar_ms > 0 else 24
+    last = close[-1]
+    
+    previous_close = close[:-1]
+    true_range = np.maximum.reduce([high[1:] - low[1:], np.abs(high[1:] - previous_close),
+                                    np.abs(low[1:] - previous_close)])
+    changes = np.diff(close)
+    indicators = {
+        "bar": CANDLE_BAR,
+        "close": float(last),
+        "change_1": float(close[-1] / close[-2] - 1) * 100,
+        "change_24h": float(close[-1] / close[-1 - bars_per_day] - 1) * 100 if len(close) > bars_per_day else None,
+        "atr": None,
+        "rsi": None
+    }
+    if len(true_range) >= atr_period:
+        indicators["atr"] = float(rolling_mean(true_range, atr_period)[-1])
+    if len(changes) >= rsi_period:
+        gain = rolling_mean(np.clip(changes, 0, None), rsi_period)[-1]
+        loss = rolling_mean(np.clip(-changes, 0, None), rsi_period)[-1]
+        indicators["rsi"] = 100.0 if loss == 0 else float(100 - 100 / (1 + gain / loss))
+    for period in ma_periods:
+        indicators[f"ma{period}"] = float(rolling_mean(close, period)[-1]) if len(close) >= period else None
+    return indicators
+
+
+def format_indicators(indicators):
+    """将技术指标压缩为提示词中的一行"""
+    if not indicators:
+        return ""
+    parts = [f"近1根{indicators['change_1']:+.2f}%"]
+    if indicators.get("change_24h") is not None:
+        parts.append(f"24h {indicators['change_24h']:+.2f}%")
+    if indicators.get("atr") is not None:
+        parts.append(f"ATR14 {indicators['atr']:.6g}（{indicators['atr'] / indicators['close'] * 100:.2f}%）")
+    if indicators.get("rsi") is not None:
+        parts.append(f"RSI14 {indicators['rsi']:.0f}")
+    for key in sorted(k for k in indicators if k.startswith("ma") and indicators[k] is not None):
+        side = "高" if indicators["close"] >= indicators[key] else "低"
+        parts.append(f"{key.upper()} {indicators[key]:.6g}（现价{side}于均线）")
+    return f"K线（{indicators['bar']}）：" + "，".join(parts)
+
+
+def get_crypto_indicators(crypto_pairs, max_age=None):
+    """增量同步各交易对的K线并计算技术指标，返回 交易对 -> 指标字典（失败的交易对不包含在内）
+    
+    max_age见CandleStore.sync：为None时未收盘的K线每个周期只获取一次。
+    """
+    if not CANDLES_ENABLED:
+        return {}
+    
+    def sync(pair):
+        try:
+            candles, fetched = CANDLE_STORE.sync(pair, max_age)
+            METRICS.incr("candles_fetched_total", fetched)
+            return pair, compute_indicators(candles)
+        except Exception as e:
+            print(f"❌ {pair} K线同步失败：{str(e)}")
+            return pair, None
+    
+    indicators = {pair: value for pair, value in parallel_map(sync, list(crypto_pairs)) if value}
+    print(f"✅ K线同步完成：{len(indicators)}/{len(crypto_pairs)}个交易对")
+    return indicators
+
+
+# --------------------------
+# 3.3 实时行情：OKX公共WebSocket的tickers频道
+# --------------------------
+class TickerFeed:
+    """订阅OKX tickers频道，在内存中维护各交易对的最新行情（字段见parse_okx_ticker，source为"okx-ws"）
+    
+    后台线程负责连接、订阅与接收；连接中断后按指数退避自动重连并重新订阅全部交易对。
+    连接正常时行情表中的行情始终有效（OKX只在价格或盘口变化时推送），断开后超过max_age秒的行情视为过期。
+    record_file不为None时将收到的原始行情消息逐行追加到该文件，可供替身服务回放。
+    """
+    
+    def __init__(self, url=None, max_age=None, record_file=None):
+        self.url = url or OKX_WS_URL
+        self.max_age = PRICE_STREAM_MAX_AGE if max_age is None else max_age
+        self.record_file = record_file
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.pairs = set()
+        self.ticks = {}
+        self.connection = None
+        self.generation = 0
+        self.connected = False
+        self.disconnected_at = time.monotonic()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"messages": 0, "updates": 0, "connects": 0, "errors": 0}
+    
+    def start(self):
+        if self.thread is None:
+            # 在调用线程中导入，未安装websocket-client时立即报错
+            importlib.import_module("websocket")
+            self.thread = threading.Thread(target=self._run, name="cryptosift-ticker-feed", daemon=True)
+            self.thread.start()
+        return self
+    
+    def stop(self):
+        self.stop_event.set()
+        with self.lock:
+            connection = self.connection
+        if connection is not None:
+            connection.close()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+    
+    def subscribe(self, crypto_pairs):
+        """增加订阅的交易对（已连接时立即发送订阅请求）"""
+        with self.lock:
+            new_pairs = [pair for pair in crypto_pairs if pair not in self.pairs]
+            self.pairs.update(new_pairs)
+            connection = self.connection if self.connected else None
+        if new_pairs and connection is not None:
+            try:
+                self._send_subscribe(connection, new_pairs)
+            except Exception as e:
+                # 连接已断开：重连后会重新订阅全部交易对
+                print(f"❌ 实时行情订阅失败：{str(e)}")
+    
+    def _is_fresh(self, tick):
+        if self.connected and tick["generation"] == self.generation:
+            return True
+        return time.monotonic() - tick["received_at"] <= self.max_age
+    
+    def latest(self, pair):
+        """返回交易对的最新行情（副本），没有或已过期时返回None"""
+        with self.lock:
+            tick = self.ticks.get(pair)
+            if tick is None or not self._is_fresh(tick):
+                return None
+            return dict(tick["ticker"])
+    
+    def snapshot(self, crypto_pairs):
+        """返回 交易对 -> 最新行情，只包含有效的交易对"""
+        with self.lock:
+            return {pair: dict(self.ticks[pair]["ticker"]) for pair in crypto_pairs
+                    if pair in self.ticks and self._is_fresh(self.ticks[pair])}
+    
+    def wait_ready(self, crypto_pairs, timeout):
+        """等待各交易对收到第一条行情，超时返回False"""
+        deadline = time.monotonic() + timeout
+        with self.updated:
+            while not all(pair in self.ticks and self._is_fresh(self.ticks[pair]) for pair in crypto_pairs):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.updated.wait(remaining)
+        return True
+    
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats, connected=self.connected, pairs=len(self.pairs), ticks=len(self.ticks))
+    
+    def _send_subscribe(self, connection, crypto_pairs):
+        args = [{"channel": "tickers", "instId": pair} for pair in sorted(crypto_pairs)]
+        connection.send(json.dumps({"op": "subscribe", "args": args}))
+    
+    def _run(self):
+        delay = PRICE_STREAM_RECONNECT_DELAY
+        while not self.stop_event.is_set():
+            try:
+                received = self._connect_and_receive()
+            except Exception as e:
+                received = False
+                if not self.stop_event.is_set():
+                    print(f"❌ 实时行情连接中断：{str(e)}")
+            with self.lock:
+                self.connected = False
+                self.connection = None
+                self.disconnected_at = time.monotonic()
+                if not self.stop_event.is_set():
+                    self.stats["errors"] += 1
+            # 收到过行情的连接断开后从初始等待时间重新开始退避
+            delay = PRICE_STREAM_RECONNECT_DELAY if received else min(delay * 2, PRICE_STREAM_MAX_RECONNECT_DELAY)
+            self.stop_event.wait(delay)
+    
+    def _connect_and_receive(self):
+        """建立一次连接并接收消息，直到连接断开或停止；返回本次连接是否收到过行情"""
+        # websocket-client逐字节校验UTF-8的开销远大于解析行情本身，消息解码为str时已经校验
+        connection = websocket.create_connection(self.url, timeout=PRICE_STREAM_PING_INTERVAL,
+                                                 skip_utf8_validation=True)
+        with self.lock:
+            self.connection = connection
+            self.generation += 1
+            self.connected = True
+            self.stats["connects"] += 1
+            pairs = list(self.pairs)
+        received = False
+        waiting_pong = False
+        try:
+            if pairs:
+                self._send_subscribe(connection, pairs)
+            while not self.stop_event.is_set():
+                try:
+                    message = connection.recv()
+                except websocket.WebSocketTimeoutException:
+                    if waiting_pong:
+                        raise ConnectionError("心跳超时")
+                    connection.send("ping")
+                    waiting_pong = True
+                    continue
+                waiting_pong = False
+                if not message:
+                    # 服务端关闭了连接
+                    return received
+                if message == "pong":
+                    continue
+                received = self._handle(message) or received
+        finally:
+            connection.close()
+        return received
+    
+    def _handle(self, message):
+        data = json.loads(message)
+        if data.get("event") == "error":
+            print(f"❌ 实时行情订阅错误：{data.get('msg', data.get('code'))}")
+            return False
+        if data.get("arg", {}).get("channel") != "tickers" or not data.get("data"):
+            return False
+        if self.record_file:
+            with open(self.record_file, "a", encoding="utf-8") as f:
+                f.write(message.rstrip("\n") + "\n")
+        now = time.monotonic()
+        with self.updated:
+            self.stats["messages"] += 1
+            for item in data["data"]:
+                ticker = parse_okx_ticker(item)
+                if ticker["last"] is None:
+                    continue
+                ticker["source"] = "okx-ws"
+                self.ticks[item["instId"]] = {"ticker": ticker, "received_at": now, "generation": self.generation}
+                self.stats["updates"] += 1
+            self.updated.notify_all()
+        return True
+
+
+PRICE_FEED = None
+
+
+def start_price_feed(crypto_pairs, warmup=None):
+    """启动进程内共享的实时行情（已启动时只增加订阅），最多等待warmup秒（默认PRICE_STREAM_WARMUP）收到首批行情"""
+    global PRICE_FEED
+    if PRICE_FEED is None:
+        PRICE_FEED = TickerFeed().start()
+    PRICE_FEED.subscribe(crypto_pairs)
+    warmup = PRICE_STREAM_WARMUP if warmup is None else warmup
+    if warmup and crypto_pairs and not PRICE_FEED.wait_ready(crypto_pairs, warmup):
+        print(f"   实时行情尚未覆盖全部交易对，缺少的交易对将通过REST获取")
+    return PRICE_FEED
+
+
+def stop_price_feed():
+    global PRICE_FEED
+    if PRICE_FEED is not None:
+        PRICE_FEED.stop()
+        PRICE_FEED = None
+
+
+def live_prices(crypto_prices):
+    """用实时行情表中的最新价替换crypto_prices中的价格（未启用实时行情或行情过期时保持原值）"""
+    if PRICE_FEED is None:
+        return crypto_prices
+    latest = PRICE_FEED.snapshot(crypto_prices)
+    return {pair: latest[pair]["last"] if pair in latest else price for pair, price in crypto_prices.items()}
+
+
+# --------------------------
+# 并发数据采集阶段
+# --------------------------
+def gather_market_data(crypto_pairs, screen_top_k=None):
+    """并发获取资讯、美股数据、加密货币价格与财经日历，总耗时取决于最慢的数据源
+    
+    screen_top_k不为None时忽略crypto_pairs，改为全市场筛选出的前screen_top_k个交易对。
+    """
+    def traced(name, func, *args):
+        with METRICS.span(name):
+            return func(*args)
+    
+    with ContextThreadPoolExecutor(max_workers=5) as executor:
+        news_future = executor.submit(traced, "gather.news", get_latest_news)
+        stock_future = executor.submit(traced, "gather.stocks", get_us_stock_data)
+        if screen_top_k is None:
+            ticker_future = executor.submit(traced, "gather.prices", get_crypto_tickers, crypto_pairs)
+            candle_future = executor.submit(traced, "gather.candles", get_crypto_indicators, crypto_pairs)
+        else:
+            ticker_future = executor.submit(traced, "gather.prices", screen_market, screen_top_k)
+        calendar_future = executor.submit(traced, "gather.calendar", get_crypto_calendar_events)
+        tickers = ticker_future.result()
+        if screen_top_k is not None:
+            # 筛选结果确定后才知道需要同步哪些交易对的K线
+            candle_future = executor.submit(traced, "gather.candles", get_crypto_indicators, list(tickers))
+        return {
+            "news": news_future.result(),
+            "stocks": stock_future.result(),
+            "calendar": calendar_future.result(),
+            "tickers": tickers,
+            "prices": {pair: ticker["last"] for pair, ticker in tickers.items()},
+            "indicators": candle_future.result()
+        }
+
+
+# --------------------------
+# 4. 时间取整工具函数
+# --------------------------
+def round_time(current_time):
+    minute = current_time.minute
+    if minute < 15:
+        return current_time.replace(minute=0, second=0, microsecond=0)
+    elif 15 <= minute < 45:
+        return current_time.replace(minute=30, second=0, microsecond=0)
+    else:
+        return current_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
+# --------------------------
+# 5. 单个加密货币分析（含AI预测）
+# --------------------------
+# 结构化预测结果的字段定义：字段名 -> (允许的类型, 是否必填)
+PREDICTION_SCHEMA = {
+    "prediction": (str, True),
+    "up": ((int, float), True),
+    "down": ((int, float), True),
+    "flat": ((int, float), True),
+    "target_price": ((int, float), False)
+}
+
+JSON_OUTPUT_INSTRUCTION = """请以JSON格式输出，只输出JSON对象，不要输出其他内容，字段如下：
+    {"prediction": "价格走势分析与预测（字符串）", "up": 上涨（价格高于当前）的概率, "down": 下跌（价格低于当前）的概率, "flat": 横盘（价格波动±1%以内）的概率, "target_price": 预测价格（数字）}
+    概率为0-100的整数，三者之和为100。"""
+
+
+class AdaptiveConcurrencyLimiter:
+    """自适应并发上限（AIMD）：请求被限流（429）时上限减半，连续成功后逐步恢复到max_limit"""
+
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.limit < self.max_limit and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """占用一个并发名额，yield的函数用于标记本次请求被限流"""
+        throttled = []
+        self.acquire()
+        try:
+            yield lambda: throttled.append(True)
+        finally:
+            self.release(bool(throttled))
+
+
+DEEPSEEK_CONCURRENCY = AdaptiveConcurrencyLimiter(ANALYSIS_CONCURRENCY)
+
+
+def call_deepseek(messages, on_token=None, **options):
+    """调用DeepSeek对话接口，返回回复文本；options会合并到请求体中
+    
+    传入on_token时使用流式输出（SSE），每收到一段文本即调用on_token(text)。
+    """
+    payload = {"model": DEEPSEEK_MODEL, "messages": messages}
+    stream = on_token is not None
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+    payload.update(options)
+    start = time.monotonic()
+    with DEEPSEEK_CONCURRENCY.slot() as mark_throttled:
+        response = http_request(
+            "POST",
+            DEEPSEEK_API_URL,
+            on_throttle=mark_throttled,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {getattr(_config, 'DEEPSEEK_API_KEY', '')}"
+            },
+            json=payload,
+            stream=stream,
+            timeout=TIMEOUT
+        )
+        if stream:
+            try:
+                response.raise_for_status()
+                return read_deepseek_stream(response, on_token, start)
+            finally:
+                response.close()
+    response.raise_for_status()
+    data = json.loads(response.content.decode('utf-8'))
+    METRICS.record_llm_usage(data.get("usage"))
+    return data["choices"][0]["message"]["content"].strip()
+
+
+def read_deepseek_stream(response, on_token, start=None):
+    """读取DeepSeek的SSE响应：逐段转发增量文本，返回完整回复"""
+    start = start or time.monotonic()
+    parts = []
+    usage = None
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        chunk = json.loads(data.decode("utf-8"))
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if not content:
+                continue
+            if not parts:
+                METRICS.incr("llm_first_token_seconds_total", time.monotonic() - start)
+                METRICS.incr("llm_streams_total")
+            parts.append(content)
+            on_token(content)
+    METRICS.record_llm_usage(usage)
+    return "".join(parts).strip()
+
+
+class StreamingPredictionParser:
+    """增量解析流式返回的JSON预测
+    
+    逐步提取"prediction"字段的文本并通过on_text(交易对, 文本)转发；概率字段完整出现后立即调用
+    on_probabilities(交易对, 涨, 跌, 横盘)。pair为None时按批量格式解析，交易对取自所在对象的键。
+    """
+    
+    PAIR_KEY = re.compile(r'"([A-Za-z0-9]+-[A-Za-z0-9]+)"\s*:\s*\{')
+    PREDICTION_KEY = re.compile(r'"prediction"\s*:\s*"')
+    # 数字后必须跟分隔符，避免把尚未传输完的"45"截成"4"
+    PROBABILITIES = {
+        name: re.compile(rf'"{name}"\s*:\s*"?(-?\d+(?:\.\d+)?)(?=[\s,}}"%])')
+        for name in ("up", "down", "flat")
+    }
+    PAIR_OBJECT = re.compile(r'"([A-Za-z0-9]+-[A-Za-z0-9]+)"\s*:\s*(\{[^{}]*\})')
+
+    def __init__(self, pair=None, on_text=None, on_probabilities=None):
+        self.pair = pair
+        self.on_text = on_text
+        self.on_probabilities = on_probabilities
+        self.buffer = ""
+        self.current_pair = pair
+        self.text_pos = None
+        self.search_pos = 0
+        self.object_pos = 0
+        self.probabilities_sent = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.on_text:
+            self._extract_text()
+        if self.on_probabilities:
+            self._extract_probabilities()
+
+    def _extract_text(self):
+        buffer = self.buffer
+        while True:
+            if self.text_pos is None:
+                match = self.PREDICTION_KEY.search(buffer, self.search_pos)
+                if not match:
+                    return
+                if self.pair is None:
+                    keys = list(self.PAIR_KEY.finditer(buffer, 0, match.start()))
+                    self.current_pair = keys[-1].group(1) if keys else None
+                self.text_pos = match.end()
+            
+            pos, out, finished = self.text_pos, [], False
+            while pos < len(buffer):
+                char = buffer[pos]
+                if char == "\\":
+                    length = 6 if buffer[pos + 1:pos + 2] == "u" else 2
+                    if pos + length > len(buffer):
+                        break
+                    try:
+                        out.append(json.loads(f'"{buffer[pos:pos + length]}"'))
+                    except ValueError:
+                        pass
+                    pos += length
+                elif char == '"':
+                    finished = True
+                    pos += 1
+                    break
+                else:
+                    out.append(char)
+                    pos += 1
+            if out:
+                self.on_text(self.current_pair, "".join(out))
+            if not finished:
+                self.text_pos = pos
+                return
+            self.text_pos = None
+            self.search_pos = pos
+
+    def _extract_probabilities(self):
+        if self.pair is not None:
+            if self.probabilities_sent:
+                return
+            matches = [self.PROBABILITIES[name].search(self.buffer) for name in ("up", "down", "flat")]
+            if all(matches):
+                try:
+                    probs = normalize_probabilities(*[float(m.group(1)) for m in matches])
+                except ValueError:
+                    return
+                self.probabilities_sent = True
+                self.on_probabilities(self.pair, *probs)
+            return
+        
+        # 批量格式：每个交易对的预测对象一旦完整即解析
+        for match in self.PAIR_OBJECT.finditer(self.buffer, self.object_pos):
+            self.object_pos = match.end()
+            try:
+                parsed = validate_prediction(json.loads(match.group(2)))
+            except ValueError:
+                continue
+            self.on_probabilities(match.group(1), parsed["up"], parsed["down"], parsed["flat"])
+
+
+def _to_number(value):
+    """将数字或"45%"、"45.5"之类的字符串转换为float，无法转换时返回None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = re.search(r'-?\d+(?:\.\d+)?', value.replace(",", ""))
+        if match:
+            return float(match.group(0))
+    return None
+
+
+def normalize_probabilities(up, down, flat):
+    """将三个概率修正为和为100的非负整数（最大余数法），全为0时抛出ValueError"""
+    values = [max(0.0, float(v)) for v in (up, down, flat)]
+    total = sum(values)
+    if total <= 0:
+        raise ValueError("概率全为0")
+    scaled = [v * 100 / total for v in values]
+    result = [int(v) for v in scaled]
+    # 余数最大的项依次补1，直到总和为100
+    for index in sorted(range(3), key=lambda i: scaled[i] - result[i], reverse=True)[:100 - sum(result)]:
+        result[index] += 1
+    return tuple(result)
+
+
+def parse_prediction_json(text):
+    """解析并校验模型返回的JSON预测结果
+    
+    容忍代码块包裹、字符串形式的数字以及缺失单个概率等小问题，概率之和不为100时在本地归一化；
+    无法修复时抛出ValueError。
+    """
+    return validate_prediction(extract_json_object(text))
+
+
+def extract_json_object(text):
+    """从模型回复中提取JSON对象（容忍代码块等包裹内容）"""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("未找到JSON对象")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("JSON顶层不是对象")
+    return data
+
+
+def validate_prediction(data):
+    """按PREDICTION_SCHEMA校验单个预测对象并修正概率，无法修复时抛出ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("预测结果不是对象")
+    
+    parsed = {}
+    for field, (types, required) in PREDICTION_SCHEMA.items():
+        value = data.get(field)
+        if types is str:
+            value = str(value).strip() if value is not None else ""
+            if required and not value:
+                raise ValueError(f"缺少字段：{field}")
+        else:
+            value = _to_number(value)
+        parsed[field] = value
+    
+    probs = [parsed["up"], parsed["down"], parsed["flat"]]
+    present = [v for v in probs if v is not None]
+    if present and sum(present) <= 1:
+        # 模型按0-1小数给出概率时换算为百分比
+        probs = [v * 100 if v is not None else None for v in probs]
+    missing = [i for i, v in enumerate(probs) if v is None]
+    if len(missing) == 1 and sum(v for v in probs if v is not None) <= 100:
+        # 只缺一个概率时按总和100推算
+        probs[missing[0]] = 100 - sum(v for v in probs if v is not None)
+    elif missing:
+        raise ValueError(f"缺少概率字段：{[('up', 'down', 'flat')[i] for i in missing]}")
+    parsed["up"], parsed["down"], parsed["flat"] = normalize_probabilities(*probs)
+    return parsed
+
+
+def parse_probability_text(text):
+    """解析"涨xx%，跌xx%，横盘xx%"格式的概率文本，格式不符时返回None"""
+    up_match = re.search(r'涨(\d+)%', text)
+    down_match = re.search(r'跌(\d+)%', text)
+    flat_match = re.search(r'横盘(\d+)%', text)
+    
+    if up_match and down_match and flat_match:
+        return int(up_match.group(1)), int(down_match.group(1)), int(flat_match.group(1))
+    return None
+
+
+def build_prediction_result(crypto_name, price, prediction, up, down, flat, prediction_time, target_price=None):
+    """组装单个币种的预测结果字典（summarize_results使用的格式）"""
+    # 确定主趋势
+    trends = [("涨", up), ("跌", down), ("横盘", flat)]
+    main_trend, main_prob = max(trends, key=lambda x: x[1])
+    
+    return {
+        "name": crypto_name,
+        "current_price": price,
+        "predicted_price": prediction,
+        "target_price": target_price,
+        "up": up,
+        "down": down,
+        "flat": flat,
+        "main_trend": main_trend,
+        "main_prob": main_prob,
+        "prediction_time": prediction_time
+    }
+
+
+def format_time_str(rounded_time):
+    """将取整后的时间格式化为提示词中的北京时间描述"""
+    return rounded_time.strftime("%Y年%m月%d日%H点") + ("30分" if rounded_time.minute == 30 else "")
+
+
+# --------------------------
+# 提示词组装：按相关性与token预算筛选上下文
+# --------------------------
+_CJK_CHAR = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """估算DeepSeek的token数：中文约0.6个/字，其他字符约0.3个/字符"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def split_context_items(text):
+    """将"；"连接的资讯或日历字符串拆分为条目"""
+    return [item.strip() for item in str(text or "").split("；") if item.strip()]
+
+
+def _keyword_pattern(keywords):
+    """英文关键词按单词匹配（避免sol匹配solution），中文关键词按子串匹配"""
+    parts = [rf"(?<![a-z0-9]){re.escape(k)}(?![a-z0-9])" if k.isascii() else re.escape(k) for k in keywords]
+    return re.compile("|".join(parts)) if parts else None
+
+
+def coin_aliases(crypto_name):
+    return COIN_ALIASES.get(crypto_name.lower(), [crypto_name.lower()])
+
+
+_MARKET_PATTERN = None
+_COIN_PATTERN = None
+
+
+def classify_context_item(item):
+    """返回(大盘关键词命中数, 是否提到具体币种)"""
+    global _MARKET_PATTERN, _COIN_PATTERN
+    if _MARKET_PATTERN is None:
+        _MARKET_PATTERN = _keyword_pattern(MARKET_KEYWORDS)
+        _COIN_PATTERN = _keyword_pattern([alias for aliases in COIN_ALIASES.values() for alias in aliases])
+    text = item.lower()
+    market_hits = len(set(_MARKET_PATTERN.findall(text))) if _MARKET_PATTERN else 0
+    return market_hits, bool(_COIN_PATTERN and _COIN_PATTERN.search(text))
+
+
+def select_within_budget(scored_items, budget):
+    """按得分从高到低贪心选取条目直到用完token预算，返回(按原顺序排列的条目, 使用的token数, 未选入条数)"""
+    selected = []
+    used = 0
+    for score, index, item, tokens in sorted(scored_items, key=lambda x: (-x[0], x[1])):
+        if used + tokens <= budget:
+            selected.append((index, item))
+            used += tokens
+    return [item for _, item in sorted(selected)], used, len(scored_items) - len(selected)
+
+
+def context_candidates(calendar_events, latest_news):
+    """将日历与资讯拆分为候选条目：(类别, 序号, 内容, token数, 大盘关键词命中数, 是否提到具体币种, 新近度)
+    
+    资讯与日历均按时间排列（资讯最新在前、日历最近在前），新近度按位置从1递减到0。
+    """
+    candidates = []
+    for kind, text in (("calendar", calendar_events), ("news", latest_news)):
+        items = split_context_items(text)
+        for rank, item in enumerate(items):
+            market_hits, mentions_coin = classify_context_item(item)
+            recency = 1 - rank / len(items)
+            candidates.append((kind, len(candidates), item, estimate_tokens(item) + 1, market_hits,
+                               mentions_coin, recency))
+    return candidates
+
+
+def build_shared_context(calendar_events, stock_data, latest_news, budget=None):
+    """各币种共用的提示词前缀：美股参考与大盘相关的日历、资讯（在PROMPT_SHARED_TOKEN_BUDGET内按相关性选取）
+    
+    前缀只取决于本轮的共享数据，同一轮各币种的请求前缀完全相同，便于服务端上下文缓存命中。
+    返回(前缀文本, 已选入前缀的条目集合)。
+    """
+    budget = PROMPT_SHARED_TOKEN_BUDGET if budget is None else budget
+    stocks = "；".join([f"{name} {info['price']}（{'涨' if info['change'] >=0 else '跌'}{abs(info['change'])}%）"
+                        for name, info in stock_data.items()])
+    budget -= estimate_tokens(stocks)
+    
+    # 大盘资讯优先；只提到具体币种的条目留给各币种自己的上下文
+    scored = [(2 * min(market_hits, 2) + recency, index, (kind, item), tokens)
+              for kind, index, item, tokens, market_hits, mentions_coin, recency
+              in context_candidates(calendar_events, latest_news)
+              if market_hits or not mentions_coin]
+    selected, _, _ = select_within_budget(scored, budget)
+    calendar = "；".join(item for kind, item in selected if kind == "calendar") or "无"
+    news = "；".join(item for kind, item in selected if kind == "news") or "无"
+    prefix = f"""近期财经日历：{calendar}
+    美股参考：{stocks or "无"}
+    最新市场资讯：{news}"""
+    return prefix, {item for _, item in selected}
+
+
+def build_coin_context(crypto_names, calendar_events, latest_news, exclude=(), budget=None):
+    """与指定币种相关的日历与资讯（不含已在共享前缀中的条目），返回(上下文文本, 估算token数, 未选入条数)"""
+    budget = PROMPT_COIN_TOKEN_BUDGET * len(crypto_names) if budget is None else budget
+    pattern = _keyword_pattern([alias for name in crypto_names for alias in coin_aliases(name)])
+    scored = []
+    for kind, index, item, tokens, market_hits, _, recency in context_candidates(calendar_events, latest_news):
+        if item in exclude:
+            continue
+        hits = len(set(pattern.findall(item.lower())))
+        if hits:
+            scored.append((3 * min(hits, 2) + 0.5 * min(market_hits, 2) + recency, index, item, tokens))
+    selected, used, dropped = select_within_budget(scored, budget)
+    return "；".join(selected) or "无", used, dropped
+
+
+def build_prompt(crypto_names, calendar_events, stock_data, latest_news, time_str, body):
+    """组装提示词：稳定前缀（时间与共享上下文）+ 币种相关上下文 + body，并记录估算的token数"""
+    prefix, shared_items = build_shared_context(calendar_events, stock_data, latest_news)
+    coin_context, coin_tokens, dropped = build_coin_context(crypto_names, calendar_events, latest_news,
+                                                            exclude=shared_items)
+    prompt = f"""现在是北京时间{time_str}。
+    {prefix}
+    {"、".join(crypto_names)}相关资讯与事件：{coin_context}
+    {body}"""
+    METRICS.record_prompt(",".join(crypto_names), estimate_tokens(prompt),
+                          shared_tokens=estimate_tokens(prefix), coin_tokens=coin_tokens, dropped=dropped)
+    return prompt
+
+
+# --------------------------
+# 5.0 预测结果缓存（按输入指纹复用）
+# --------------------------
+def price_bucket(price, tolerance=None):
+    """将价格映射到对数区间编号，区间宽度为tolerance（相对值）"""
+    tolerance = PREDICTION_PRICE_TOLERANCE if tolerance is None else tolerance
+    price = float(price)
+    if tolerance <= 0 or price <= 0:
+        return repr(price)
+    return str(math.floor(math.log(price) / math.log1p(tolerance)))
+
+
+def _text_hash(text):
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()[:16]
+
+
+def prediction_fingerprint(crypto_pair, price, rounded_time, prediction_hours, stock_data, latest_news,
+                           calendar_events, indicators=None):
+    """计算一次预测的输入指纹：任一输入变化（价格在容差以内除外）都会得到不同的指纹"""
+    stocks = sorted((name, info.get("price"), info.get("change")) for name, info in (stock_data or {}).items())
+    material = [
+        crypto_pair.upper(),
+        rounded_time.strftime("%Y-%m-%d %H:%M"),
+        price_bucket(price),
+        prediction_hours,
+        _text_hash(latest_news),
+        _text_hash(calendar_events),
+        stocks,
+        ANALYSIS_MODE,
+        DEEPSEEK_MODEL,
+        format_indicators(indicators)
+    ]
+    return hashlib.sha256(json.dumps(material, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """持久化的预测结果缓存（LRU + TTL）
+    
+    键为prediction_fingerprint计算的输入指纹，值为analyze_single_crypto的结果字典；
+    首次使用时从CACHE_DIR加载，写入后由save()统一落盘。
+    """
+    
+    def __init__(self, filename, ttl, max_entries):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.loaded = False
+        self.dirty = False
+    
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        data = load_json_file(os.path.join(CACHE_DIR, self.filename), {})
+        for key, stored_at, result in data.get("entries", []):
+            try:
+                result["prediction_time"] = datetime.fromisoformat(result["prediction_time"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.entries[key] = (float(stored_at), result)
+    
+    def get(self, key):
+        """命中时返回结果字典的副本，未命中或已过期时返回None"""
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.time() - stored_at >= self.ttl:
+                del self.entries[key]
+                self.dirty = True
+                return None
+            self.entries.move_to_end(key)
+            return dict(result)
+    
+    def put(self, key, result):
+        with self.lock:
+            self._load()
+            self.entries[key] = (time.time(), dict(result))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+    
+    def save(self):
+        """有未保存的修改时写入磁盘（同时丢弃已过期的条目）"""
+        with self.lock:
+            if not self.dirty:
+                return
+            now = time.time()
+            entries = []
+            for key, (stored_at, result) in self.entries.items():
+                if now - stored_at < self.ttl:
+                    result = dict(result, prediction_time=result["prediction_time"].isoformat())
+                    entries.append([key, stored_at, result])
+            self.dirty = False
+        try:
+            save_json_file(cache_path(self.filename), {"entries": entries})
+        except OSError as e:
+            print(f"❌ 预测缓存写入失败：{str(e)}")
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.loaded = False
+            self.dirty = False
+
+
+PREDICTION_CACHE_FILE = "predictions.json"
+PREDICTION_CACHE = PredictionCache(PREDICTION_CACHE_FILE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_MAX_ENTRIES)
+# 直接调用analyze_single_crypto（如Kivy应用）时，退出前保存缓存
+atexit.register(PREDICTION_CACHE.save)
+
+
+def get_cached_prediction(crypto_pair, price, rounded_time, prediction_hours, stock_data, latest_news,
+                          calendar_events, indicators=None):
+    """查询预测缓存，返回(指纹, 结果字典或None)；命中时结果中的当前价格更新为本次价格"""
+    if not PREDICTION_CACHE_ENABLED:
+        return None, None
+    key = prediction_fingerprint(crypto_pair, price, rounded_time, prediction_hours, stock_data, latest_news,
+                                 calendar_events, indicators)
+    result = PREDICTION_CACHE.get(key)
+    if result is None:
+        METRICS.incr("prediction_cache_misses_total")
+        return key, None
+    METRICS.incr("prediction_cache_hits_total")
+    result["current_price"] = price
+    return key, result
+
+
+def store_prediction(key, result):
+    """保存预测结果（缓存未启用或结果无效时忽略）"""
+    if key and result:
+        PREDICTION_CACHE.put(key, result)
+
+
+def analyze_single_crypto(crypto_pair, price, prediction_hours, stock_data, latest_news, calendar_events=None,
+                          on_stream=None, indicators=None):
+    """分析单个交易对；传入on_stream时使用流式输出，回调参数为(交易对, "token"或"probabilities", 内容)
+    
+    indicators为该交易对的技术指标（见compute_indicators），传入时以一行摘要加入提示词。
+    """
+    crypto_name = crypto_pair.split('-')[0].lower()
+    current_time = datetime.now()
+    rounded_time = round_time(current_time)
+    time_str = format_time_str(rounded_time)
+    prediction_time = rounded_time + timedelta(hours=prediction_hours)
+    
+    # 获取财经日历事件（未传入时读取缓存，同一轮运行内各币种共享）
+    if calendar_events is None:
+        calendar_events = get_crypto_calendar_events()
+    
+    # 输入与上次预测相同时直接返回缓存结果
+    cache_key, cached = get_cached_prediction(crypto_pair, price, rounded_time, prediction_hours, stock_data,
+                                              latest_news, calendar_events, indicators)
+    if cached:
+        return cached
+    
+    # 构建提示词（共享上下文在前，币种相关内容与问题在后）
+    prompt = build_prompt([crypto_name], calendar_events, stock_data, latest_news, time_str,
+                          f"{crypto_name}现价{price}美元。{format_indicators(indicators)}\n    "
+                          f"请综合分析以上所有信息，预测{prediction_hours}小时后{crypto_name}的价格走势。")
+    
+    try:
+        if ANALYSIS_MODE == "json":
+            # 单次请求：同时获取预测文本、涨跌概率与目标价
+            on_token = None
+            if on_stream:
+                on_token = StreamingPredictionParser(
+                    crypto_pair,
+                    on_text=lambda pair, text: on_stream(pair, "token", text),
+                    on_probabilities=lambda pair, *probs: on_stream(pair, "probabilities", probs)
+                ).feed
+            content = call_deepseek(
+                [{"role": "user", "content": f"{prompt}\n    {JSON_OUTPUT_INSTRUCTION}"}],
+                on_token=on_token,
+                response_format={"type": "json_object"}
+            )
+            try:
+                parsed = parse_prediction_json(content)
+            except ValueError as e:
+                # JSON无法修复时，尝试按"涨xx%，跌xx%，横盘xx%"格式兜底解析
+                probs = parse_probability_text(content)
+                if not probs:
+                    print(f"[{crypto_name}] 结构化结果校验失败：{str(e)}")
+                    return None
+                parsed = {"prediction": content, "target_price": None}
+                parsed["up"], parsed["down"], parsed["flat"] = normalize_probabilities(*probs)
+            
+            result = build_prediction_result(
+                crypto_name, price, parsed["prediction"],
+                parsed["up"], parsed["down"], parsed["flat"],
+                prediction_time, parsed["target_price"]
+            )
+            store_prediction(cache_key, result)
+            return result
+        
+        # legacy模式 第一次请求：获取价格预测
+        result = call_deepseek(
+            [{"role": "user", "content": prompt}],
+            on_token=(lambda text: on_stream(crypto_pair, "token", text)) if on_stream else None
+        )
         
         # 第二次请求：获取涨跌概率
         prob_prompt = f"""基于你对{crypto_name}的价格预测，给出：
@@ -338,51 +3327,29 @@ def analyze_single_crypto(crypto_pair, price, prediction_hours, stock_data, late
         3. 横盘（价格波动±1%以内）的概率
         要求：总和为100%，格式为"涨xx%，跌xx%，横盘xx%"，只输出结果"""
         
-        time.sleep(REQUEST_DELAY)
-        prob_response = session.post(
-            DEEPSEEK_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-            },
-            json={
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "user", "content": prompt},
-                    {"role": "assistant", "content": result},
-                    {"role": "user", "content": prob_prompt}
-                ]
-            },
-            timeout=TIMEOUT
-        )
-        prob_response.raise_for_status()
-        prob_result = json.loads(prob_response.content.decode('utf-8'))["choices"][0]["message"]["content"].strip()
+        prob_tokens = []
+        prob_sent = []
         
-        # 解析概率值
-        up_match = re.search(r'涨(\d+)%', prob_result)
-        down_match = re.search(r'跌(\d+)%', prob_result)
-        flat_match = re.search(r'横盘(\d+)%', prob_result)
+        def on_prob_token(text):
+            # 概率文本一旦完整即提前回调
+            prob_tokens.append(text)
+            probs = parse_probability_text("".join(prob_tokens))
+            if probs and not prob_sent:
+                prob_sent.append(True)
+                on_stream(crypto_pair, "probabilities", probs)
         
-        if up_match and down_match and flat_match:
-            up = int(up_match.group(1))
-            down = int(down_match.group(1))
-            flat = int(flat_match.group(1))
-            
-            # 确定主趋势
-            trends = [("涨", up), ("跌", down), ("横盘", flat)]
-            main_trend, main_prob = max(trends, key=lambda x: x[1])
-            
-            return {
-                "name": crypto_name,
-                "current_price": price,
-                "predicted_price": result,
-                "up": up,
-                "down": down,
-                "flat": flat,
-                "main_trend": main_trend,
-                "main_prob": main_prob,
-                "prediction_time": rounded_time + timedelta(hours=prediction_hours)
-            }
+        prob_result = call_deepseek([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": result},
+            {"role": "user", "content": prob_prompt}
+        ], on_token=on_prob_token if on_stream else None)
+        
+        # 解析概率值
+        probs = parse_probability_text(prob_result)
+        if probs:
+            result = build_prediction_result(crypto_name, price, result, *probs, prediction_time)
+            store_prediction(cache_key, result)
+            return result
         else:
             print(f"[{crypto_name}] 概率格式错误：{prob_result}")
             return None
@@ -392,6 +3359,221 @@ def analyze_single_crypto(crypto_pair, price, prediction_hours, stock_data, late
         return None
 
 
+# --------------------------
+# 5.1 批量分析：一次请求覆盖多个交易对
+# --------------------------
+BATCH_OUTPUT_INSTRUCTION = """请以JSON格式输出，只输出JSON对象，不要输出其他内容。格式为{"predictions": {交易对: 预测对象}}，交易对使用上面列出的名称（如"BTC-USDT"），每个预测对象的字段如下：
+    {"prediction": "价格走势分析与预测（字符串）", "up": 上涨（价格高于当前）的概率, "down": 下跌（价格低于当前）的概率, "flat": 横盘（价格波动±1%以内）的概率, "target_price": 预测价格（数字）}
+    概率为0-100的整数，每个交易对的三个概率之和为100。"""
+
+
+def analyze_crypto_batch(crypto_prices, prediction_hours, stock_data, latest_news, calendar_events=None,
+                         on_stream=None, indicators=None):
+    """在一次请求中分析多个交易对，返回 交易对 -> 结果字典（仅包含校验通过的交易对）
+    
+    indicators为 交易对 -> 技术指标，有指标的交易对在现价后附上指标摘要。
+    """
+    indicators = indicators or {}
+    rounded_time = round_time(datetime.now())
+    prediction_time = rounded_time + timedelta(hours=prediction_hours)
+    if calendar_events is None:
+        calendar_events = get_crypto_calendar_events()
+    
+    results = {}
+    cache_keys = {}
+    for pair, price in list(crypto_prices.items()):
+        cache_keys[pair], cached = get_cached_prediction(pair, price, rounded_time, prediction_hours, stock_data,
+                                                         latest_news, calendar_events, indicators.get(pair))
+        if cached:
+            results[pair] = cached
+    crypto_prices = {pair: price for pair, price in crypto_prices.items() if pair not in results}
+    if not crypto_prices:
+        return results
+    
+    price_lines = "；".join(
+        f"{pair} 现价{price}美元" + (f"，{format_indicators(indicators[pair])}" if indicators.get(pair) else "")
+        for pair, price in crypto_prices.items()
+    )
+    prompt = build_prompt([pair.split('-')[0].lower() for pair in crypto_prices], calendar_events, stock_data,
+                          latest_news, format_time_str(rounded_time),
+                          f"""各交易对现价：{price_lines}
+    请综合分析以上所有信息，分别预测{prediction_hours}小时后以上每个交易对的价格走势。
+    {BATCH_OUTPUT_INSTRUCTION}""")
+    
+    try:
+        on_token = None
+        if on_stream:
+            on_token = StreamingPredictionParser(
+                on_text=lambda pair, text: on_stream(pair or "批量", "token", text),
+                on_probabilities=lambda pair, *probs: on_stream(pair, "probabilities", probs)
+            ).feed
+        content = call_deepseek(
+            [{"role": "user", "content": prompt}],
+            on_token=on_token,
+            response_format={"type": "json_object"}
+        )
+        predictions = extract_json_object(content).get("predictions")
+        if not isinstance(predictions, dict):
+            raise ValueError("缺少predictions对象")
+        # 兼容模型使用小写或币种名作为键
+        lookup = {str(key).upper(): value for key, value in predictions.items()}
+    except Exception as e:
+        print(f"[批量分析] 失败：{str(e)}")
+        return results
+    
+    for pair, price in crypto_prices.items():
+        item = lookup.get(pair.upper(), lookup.get(pair.split('-')[0].upper()))
+        try:
+            parsed = validate_prediction(item)
+        except ValueError as e:
+            print(f"[批量分析] {pair} 结果无效：{str(e)}")
+            continue
+        results[pair] = build_prediction_result(
+            pair.split('-')[0].lower(), price, parsed["prediction"],
+            parsed["up"], parsed["down"], parsed["flat"],
+            prediction_time, parsed["target_price"]
+        )
+        store_prediction(cache_keys.get(pair), results[pair])
+    return results
+
+
+def analyze_with_retries(crypto_pair, price, prediction_hours, stock_data, latest_news, calendar_events=None,
+                         on_stream=None, indicators=None):
+    """单个交易对分析，失败时在全局重试预算内最多重试MAX_RETRIES次；DeepSeek熔断时立即放弃"""
+    for attempt in range(MAX_RETRIES):
+        with METRICS.span("analysis.pair", pair=crypto_pair, attempt=attempt + 1):
+            result = analyze_single_crypto(crypto_pair, price, prediction_hours, stock_data, latest_news,
+                                           calendar_events, on_stream, indicators)
+        if result:
+            return result
+        METRICS.incr("analysis_failures_total", pair=crypto_pair)
+        if attempt == MAX_RETRIES - 1 or get_circuit_breaker(DEEPSEEK_API_URL).is_open() \
+                or not current_run_budget().try_consume_retry():
+            break
+        print(f"   第{attempt + 1}次重试分析 {crypto_pair}...")
+    print(f"   无法完成 {crypto_pair} 的分析")
+    return None
+
+
+def iter_analyses(crypto_prices, prediction_hours, stock_data, latest_news, calendar_events=None,
+                  batch=None, max_concurrency=None, on_stream=None, indicators=None, cancel_event=None):
+    """并发分析全部交易对，按完成顺序逐个产出 (交易对, 结果字典或None)
+    
+    批量模式下每ANALYSIS_BATCH_SIZE个交易对为一个任务，批量结果缺失或校验失败的交易对再作为单独任务分析；
+    同时运行的任务数不超过max_concurrency（默认ANALYSIS_CONCURRENCY）。indicators为 交易对 -> 技术指标。
+    cancel_event被设置后不再等待进行中的任务，立即结束迭代。
+    """
+    indicators = indicators or {}
+    batch = ANALYSIS_BATCH if batch is None else batch
+    max_concurrency = max_concurrency or ANALYSIS_CONCURRENCY
+    if calendar_events is None:
+        calendar_events = get_crypto_calendar_events()
+    
+    def run_batch(chunk):
+        # 任务开始时才读取实时价格，排队等待并发名额的交易对也使用最新价格
+        chunk = live_prices(chunk)
+        print(f"   批量分析 {', '.join(chunk)}...")
+        with METRICS.span("analysis.batch", pairs=len(chunk)):
+            return analyze_crypto_batch(chunk, prediction_hours, stock_data, latest_news, calendar_events, on_stream,
+                                        indicators)
+    
+    def run_single(pair):
+        print(f"   分析 {pair}...")
+        price = live_prices({pair: crypto_prices[pair]})[pair]
+        return analyze_with_retries(pair, price, prediction_hours, stock_data, latest_news,
+                                    calendar_events, on_stream, indicators.get(pair))
+    
+    pairs = list(crypto_prices)
+    executor = ContextThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    pending = {}
+    try:
+        if batch and len(pairs) > 1:
+            for start in range(0, len(pairs), ANALYSIS_BATCH_SIZE):
+                chunk = {pair: crypto_prices[pair] for pair in pairs[start:start + ANALYSIS_BATCH_SIZE]}
+                pending[executor.submit(run_batch, chunk)] = ("batch", chunk)
+        else:
+            for pair in pairs:
+                pending[executor.submit(run_single, pair)] = ("pair", pair)
+        
+        while pending:
+            done, _ = wait(list(pending), timeout=0.2 if cancel_event else None, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            for future in done:
+                kind, item = pending.pop(future)
+                if kind == "pair":
+                    yield item, future.result()
+                    continue
+                results = future.result()
+                for pair in item:
+                    if pair in results:
+                        yield pair, results[pair]
+                    else:
+                        pending[executor.submit(run_single, pair)] = ("pair", pair)
+    finally:
+        # 调用方提前停止迭代时取消尚未开始的任务
+        executor.shutdown(wait=False, cancel_futures=True)
+        PREDICTION_CACHE.save()
+
+
+def analyze_all(crypto_prices, prediction_hours, stock_data, latest_news, calendar_events=None, batch=None,
+                on_result=None, max_concurrency=None, on_stream=None, indicators=None):
+    """分析全部交易对并按输入顺序返回结果列表
+    
+    各交易对并发分析（见iter_analyses），每完成一个即调用on_result(交易对, 结果字典或None)；
+    传入on_stream时以流式输出接收模型回复（见analyze_single_crypto）。
+    """
+    results = {}
+    for pair, result in iter_analyses(crypto_prices, prediction_hours, stock_data, latest_news,
+                                      calendar_events, batch, max_concurrency, on_stream, indicators):
+        if result:
+            results[pair] = result
+        if on_result:
+            on_result(pair, result)
+    record_prediction_history(results, prediction_hours)
+    return [results[pair] for pair in crypto_prices if pair in results]
+
+
+class StreamPrinter:
+    """命令行流式输出：多个交易对并发输出时，切换交易对前先换行并标注名称"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_pair = None
+        self.line_open = False
+
+    def __call__(self, pair, kind, payload):
+        with self.lock:
+            if kind == "probabilities":
+                up, down, flat = payload
+                sys.stdout.write(f"\n   [{pair}] 概率：涨{up}%，跌{down}%，横盘{flat}%")
+                self.last_pair = None
+            else:
+                if pair != self.last_pair:
+                    sys.stdout.write(f"\n   [{pair}] ")
+                    self.last_pair = pair
+                sys.stdout.write(payload)
+            self.line_open = True
+            sys.stdout.flush()
+
+    def end_line(self):
+        """结束当前未换行的流式输出，之后可正常print"""
+        with self.lock:
+            if self.line_open:
+                sys.stdout.write("\n")
+                self.line_open = False
+                self.last_pair = None
+
+
+def print_result(pair, result):
+    """分析完成时立即输出单个交易对的结果"""
+    if result:
+        print(f"   ✅ {pair}：涨{result['up']}%，跌{result['down']}%，横盘{result['flat']}% → "
+              f"主趋势：{result['main_trend']}（{result['main_prob']}%）")
+    else:
+        print(f"   ❌ {pair}：分析失败")
+
+
 # --------------------------
 # 6. 汇总预测结果
 # --------------------------
@@ -415,51 +3597,959 @@ def summarize_results(all_results, latest_news):
     return summary
 
 
+# --------------------------
+# 7. 预测历史与回测
+# --------------------------
+class PredictionHistory:
+    """预测历史（SQLite）：每个交易对、预测时间点与预测时长只保留一条记录，到期后写入实际价格"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS predictions (
+        pair TEXT NOT NULL,
+        horizon_hours REAL NOT NULL,
+        prediction_time REAL NOT NULL,
+        created_at REAL NOT NULL,
+        price REAL NOT NULL,
+        up REAL NOT NULL,
+        down REAL NOT NULL,
+        flat REAL NOT NULL,
+        target_price REAL,
+        realized_price REAL,
+        PRIMARY KEY (pair, prediction_time, horizon_hours)
+    );
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = None
+    
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(cache_path(self.filename), check_same_thread=False)
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+    
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+    
+    def record(self, results, horizon_hours):
+        """记录一轮预测结果（交易对 -> 结果字典）；同一预测重复记录时保留最新一次"""
+        rows = [(pair, horizon_hours, result["prediction_time"].timestamp(), time.time(), result["current_price"],
+                 result["up"], result["down"], result["flat"], _to_number(result.get("target_price")))
+                for pair, result in results.items()]
+        with self.lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO predictions (pair, horizon_hours, prediction_time, created_at, price, "
+                "up, down, flat, target_price) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+    
+    def unresolved(self, now=None):
+        """已到预测时间但尚未写入实际价格的记录：交易对 -> 最早的预测时间（秒）"""
+        with self.lock:
+            return dict(self._connect().execute(
+                "SELECT pair, MIN(prediction_time) FROM predictions "
+                "WHERE realized_price IS NULL AND prediction_time <= ? GROUP BY pair", (now or time.time(),)))
+    
+    def load(self, pair=None):
+        """读取全部记录，返回 列名 -> NumPy数组（pair为字符串数组，其余为float64，缺失值为NaN）"""
+        query = ("SELECT pair, horizon_hours, prediction_time, price, up, down, flat, realized_price "
+                 "FROM predictions")
+        params = ()
+        if pair:
+            query += " WHERE pair = ?"
+            params = (pair,)
+        with self.lock:
+            rows = self._connect().execute(query + " ORDER BY prediction_time", params).fetchall()
+        names = ("pair", "horizon_hours", "prediction_time", "price", "up", "down", "flat", "realized_price")
+        columns = list(zip(*rows)) if rows else [()] * len(names)
+        data = {"pair": np.array(columns[0], dtype=object)}
+        for name, column in zip(names[1:], columns[1:]):
+            data[name] = np.array([np.nan if value is None else value for value in column], dtype=np.float64)
+        return data
+    
+    def set_realized(self, pair, prediction_times, prices):
+        with self.lock:
+            conn = self._connect()
+            conn.executemany("UPDATE predictions SET realized_price = ? WHERE pair = ? AND prediction_time = ?",
+                             [(float(price), pair, float(t)) for t, price in zip(prediction_times, prices)])
+            conn.commit()
+
+
+PREDICTION_HISTORY_FILE = "history.sqlite3"
+PREDICTION_HISTORY = PredictionHistory(PREDICTION_HISTORY_FILE)
+
+
+def record_prediction_history(results, prediction_hours):
+    """将一轮预测结果追加到预测历史（未启用或无结果时忽略）"""
+    if not PREDICTION_HISTORY_ENABLED or not results:
+        return
+    try:
+        PREDICTION_HISTORY.record(results, prediction_hours)
+    except sqlite3.Error as e:
+        print(f"❌ 预测历史写入失败：{str(e)}")
+
+
+def prices_at(candles, times_ms, bar_ms, now_ms=None):
+    """在K线上查询各时间点的价格（所在K线开盘价与收盘价按时间线性插值），无法确定的时间点为NaN
+    
+    只使用在now_ms（默认当前时间）之前已收盘的K线：未收盘K线的收盘价只是同步时的快照，不能作为实际价格。
+    """
+    candles = np.asarray(candles)
+    times_ms = np.asarray(times_ms, dtype=np.float64)
+    now_ms = time.time() * 1000 if now_ms is None else now_ms
+    prices = np.full(len(times_ms), np.nan)
+    if not len(candles) or not len(times_ms):
+        return prices
+    ts = candles[:, 0]
+    index = np.searchsorted(ts, times_ms, side="right") - 1
+    bar_end = ts[np.clip(index, 0, None)] + bar_ms
+    valid = (index >= 0) & (times_ms < bar_end) & (bar_end <= now_ms)
+    index = index[valid]
+    fraction = (times_ms[valid] - ts[index]) / bar_ms
+    prices[valid] = candles[index, 1] + (candles[index, 4] - candles[index, 1]) * fraction
+    return prices
+
+
+def resolve_realized_prices():
+    """为已到期的预测补充实际价格：每个交易对同步一次K线（本地已有的K线不重复获取），返回本次补充的记录数"""
+    unresolved = PREDICTION_HISTORY.unresolved()
+    bar_ms = bar_milliseconds(CANDLE_STORE.bar) or 3600000
+    
+    def resolve(item):
+        pair, start = item
+        # 在同步之前取当前时间：此前已收盘的K线在同步时都会重新获取（见CandleStore.sync），收盘价是最终值
+        now_ms = time.time() * 1000
+        try:
+            candles = CANDLE_STORE.backfill(pair, start * 1000 - bar_ms)
+        except Exception as e:
+            print(f"❌ {pair} 历史K线获取失败：{str(e)}")
+            return 0
+        data = PREDICTION_HISTORY.load(pair)
+        pending = np.isnan(data["realized_price"]) & (data["prediction_time"] * 1000 <= now_ms)
+        times = data["prediction_time"][pending]
+        prices = prices_at(candles, times * 1000, bar_ms, now_ms)
+        found = ~np.isnan(prices)
+        PREDICTION_HISTORY.set_realized(pair, times[found], prices[found])
+        return int(found.sum())
+    
+    return sum(parallel_map(resolve, list(unresolved.items())))
+
+
+def _group_stats(keys, hits, brier):
+    """按分组键聚合命中率与Brier分数"""
+    groups, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    hit_rates = np.bincount(inverse, weights=hits) / counts
+    briers = np.bincount(inverse, weights=brier) / counts
+    return {str(group): {"count": int(count), "hit_rate": round(float(hit_rate), 4), "brier": round(float(b), 4)}
+            for group, count, hit_rate, b in zip(groups, counts, hit_rates, briers)}
+
+
+def backtest_predictions(data, flat_band=None, bins=None):
+    """对已有实际价格的预测做向量化评估
+    
+    实际结果按涨跌幅划分为涨（> flat_band）、跌（< -flat_band）与横盘；
+    返回整体与按交易对、按预测时长分组的命中率（最大概率方向与实际一致的比例）、多分类Brier分数，
+    以及每个方向的校准曲线（按预测概率分箱后的平均预测概率与实际发生频率）。
+    """
+    flat_band = BACKTEST_FLAT_BAND if flat_band is None else flat_band
+    bins = bins or BACKTEST_CALIBRATION_BINS
+    resolved = ~np.isnan(data["realized_price"]) & (data["price"] > 0)
+    n = int(resolved.sum())
+    if not n:
+        return {"count": 0}
+    
+    probs = np.stack([data["up"], data["down"], data["flat"]], axis=1)[resolved]
+    probs = probs / probs.sum(axis=1, keepdims=True)
+    change = data["realized_price"][resolved] / data["price"][resolved] - 1
+    outcome = np.where(change > flat_band, 0, np.where(change < -flat_band, 1, 2))
+    actual = np.eye(3)[outcome]
+    
+    hits = (np.argmax(probs, axis=1) == outcome).astype(np.float64)
+    brier = ((probs - actual) ** 2).sum(axis=1)
+    # 参照基准：始终预测样本中各方向的实际频率
+    base_rates = actual.mean(axis=0)
+    reference = ((base_rates - actual) ** 2).sum(axis=1).mean()
+    
+    calibration = {}
+    edges = np.linspace(0, 1, bins + 1)
+    for column, name in enumerate(("up", "down", "flat")):
+        # 按[下限, 上限)分箱；先舍入到9位小数再向下取整，避免0.6之类落在边界上的概率因浮点误差归入较低的一箱
+        index = np.clip(np.floor(np.round(probs[:, column] * bins, 9)).astype(int), 0, bins - 1)
+        counts = np.bincount(index, minlength=bins)
+        predicted = np.bincount(index, weights=probs[:, column], minlength=bins)
+        observed = np.bincount(index, weights=actual[:, column], minlength=bins)
+        calibration[name] = [
+            {"bin": f"{edges[i]:.1f}-{edges[i + 1]:.1f}", "count": int(counts[i]),
+             "predicted": round(float(predicted[i] / counts[i]), 4),
+             "observed": round(float(observed[i] / counts[i]), 4)}
+            for i in range(bins) if counts[i]
+        ]
+    
+    brier_mean = float(brier.mean())
+    return {
+        "count": n,
+        "hit_rate": round(float(hits.mean()), 4),
+        "brier": round(brier_mean, 4),
+        "brier_skill": round(1 - brier_mean / reference, 4) if reference > 0 else None,
+        "outcomes": {name: int((outcome == i).sum()) for i, name in enumerate(("up", "down", "flat"))},
+        "by_pair": _group_stats(data["pair"][resolved].astype(str), hits, brier),
+        "by_horizon": _group_stats(data["horizon_hours"][resolved], hits, brier),
+        "calibration": calibration
+    }
+
+
+def format_backtest_report(report):
+    """回测结果的文本报告"""
+    if not report.get("count"):
+        return "暂无可评估的预测（预测时间尚未到达或缺少实际价格）"
+    outcomes = report["outcomes"]
+    lines = [
+        "===== 回测结果 =====",
+        f"样本数：{report['count']}（实际 涨{outcomes['up']} / 跌{outcomes['down']} / 横盘{outcomes['flat']}）",
+        f"命中率：{report['hit_rate'] * 100:.1f}%",
+        f"Brier分数：{report['brier']}（越低越好）" +
+        (f"，相对频率基准的技巧分：{report['brier_skill']}" if report.get("brier_skill") is not None else ""),
+        "",
+        "按交易对："
+    ]
+    for pair, stats in sorted(report["by_pair"].items()):
+        lines.append(f"  {pair}：{stats['count']}条，命中率{stats['hit_rate'] * 100:.1f}%，Brier {stats['brier']}")
+    lines.append("按预测时长（小时）：")
+    for horizon, stats in sorted(report["by_horizon"].items(), key=lambda x: float(x[0])):
+        lines.append(f"  {float(horizon):g}：{stats['count']}条，"
+                     f"命中率{stats['hit_rate'] * 100:.1f}%，Brier {stats['brier']}")
+    lines.append("校准曲线（预测概率 → 实际频率）：")
+    for name, label in (("up", "涨"), ("down", "跌"), ("flat", "横盘")):
+        points = "，".join(f"{p['bin']}: {p['predicted']:.2f}→{p['observed']:.2f}（{p['count']}）"
+                          for p in report["calibration"][name])
+        lines.append(f"  {label}：{points}")
+    return "\n".join(lines)
+
+
+def run_backtest():
+    """补充已到期预测的实际价格并输出回测报告，返回报告字典"""
+    print("===== 回测历史预测 =====")
+    with METRICS.span("backtest.resolve"):
+        resolved = resolve_realized_prices()
+    print(f"本次补充实际价格：{resolved}条\n")
+    with METRICS.span("backtest.evaluate"):
+        report = backtest_predictions(PREDICTION_HISTORY.load())
+    print(format_backtest_report(report))
+    return report
+
+
+# --------------------------
+# 8. 守护进程模式：常驻内存，按数据源各自的间隔刷新，在整点/半点只重新分析输入有明显变化的交易对
+# --------------------------
+def next_boundary(now=None):
+    """下一个整点或半点（round_time取整的时间点）"""
+    now = now or datetime.now()
+    boundary = now.replace(minute=30 if now.minute < 30 else 0, second=0, microsecond=0)
+    if now.minute >= 30:
+        boundary += timedelta(hours=1)
+    return boundary
+
+
+class Daemon:
+    """守护进程：在内存中保存各数据源的最新数据与各交易对最近一次的分析结果
+    
+    数据源按DAEMON_INTERVALS各自刷新（获取失败时保留上次的数据，按DAEMON_RETRY_DELAY退避重试），
+    分析周期在整点/半点触发，只有输入有明显变化（见material_change）的交易对会重新请求DeepSeek。
+    """
+    
+    SOURCES = ("prices", "news", "calendar", "stocks", "candles")
+    
+    def __init__(self, crypto_pairs=None, screen_top_k=None, intervals=None, stream=False, metrics_dir=None):
+        self.crypto_pairs = list(crypto_pairs or CRYPTO_LIST)
+        self.screen_top_k = screen_top_k
+        self.intervals = dict(DAEMON_INTERVALS, **(intervals or {}))
+        self.stream = stream
+        self.metrics_dir = metrics_dir
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.data = {"prices": {}, "tickers": {}, "news": "未获取到最新资讯", "calendar": "未获取到近期重要财经事件",
+                     "stocks": {}, "indicators": {}}
+        self.refreshed_at = {}
+        self.next_refresh = {}
+        self.failures = {}
+        self.analyzed = {}
+        self.results = {}
+        self.cycles = 0
+    
+    def pairs(self):
+        with self.lock:
+            return list(self.data["tickers"]) if self.screen_top_k is not None else self.crypto_pairs
+    
+    def fetch(self, source):
+        if source == "prices":
+            if self.screen_top_k is not None:
+                return screen_market(self.screen_top_k)
+            return get_crypto_tickers(self.crypto_pairs)
+        if source == "news":
+            return get_latest_news()
+        if source == "calendar":
+            return get_crypto_calendar_events()
+        if source == "stocks":
+            return get_us_stock_data()
+        return get_crypto_indicators(self.pairs(), max_age=self.intervals.get("candles", 60))
+    
+    def due_sources(self, now=None):
+        now = now or time.monotonic()
+        return [source for source in self.SOURCES if now >= self.next_refresh.get(source, -math.inf)]
+    
+    def schedule(self, source, succeeded, now=None):
+        """安排下次刷新：成功后等待刷新间隔，失败后从DAEMON_RETRY_DELAY开始翻倍退避（不超过刷新间隔）"""
+        now = now or time.monotonic()
+        interval = self.intervals.get(source, 60)
+        if succeeded:
+            self.failures.pop(source, None)
+            self.next_refresh[source] = now + interval
+        else:
+            self.failures[source] = self.failures.get(source, 0) + 1
+            self.next_refresh[source] = now + min(interval, DAEMON_RETRY_DELAY * 2 ** (self.failures[source] - 1))
+    
+    def refresh(self, sources=None):
+        """刷新指定（默认已到期）的数据源；K线依赖交易对列表，在价格之后刷新"""
+        sources = self.due_sources() if sources is None else sources
+        
+        def refresh_one(source):
+            try:
+                with METRICS.span(f"daemon.{source}"):
+                    value = self.fetch(source)
+            except Exception as e:
+                print(f"❌ 数据源刷新失败（{source}）：{str(e)}")
+                with self.lock:
+                    self.schedule(source, False)
+                return
+            with self.lock:
+                self.refreshed_at[source] = time.monotonic()
+                self.schedule(source, True, self.refreshed_at[source])
+                if source == "prices":
+                    if value:
+                        self.data["tickers"] = value
+                        self.data["prices"] = {pair: ticker["last"] for pair, ticker in value.items()}
+                elif source == "candles":
+                    self.data["indicators"].update(value)
+                elif value:
+                    self.data[source] = value
+        
+        # 每次刷新使用独立的运行预算，两轮分析之间的刷新不受上一轮已耗时间影响
+        with run_budget_scope():
+            parallel_map(refresh_one, [source for source in sources if source != "candles"])
+            if "candles" in sources:
+                refresh_one("candles")
+    
+    def context_signature(self, pair):
+        """影响该交易对提示词的上下文摘要：选入共享前缀与币种上下文的资讯/日历条目、美股涨跌幅区间"""
+        with self.lock:
+            data = dict(self.data)
+        crypto_name = pair.split('-')[0].lower()
+        _, shared_items = build_shared_context(data["calendar"], data["stocks"], data["news"])
+        coin_context, _, _ = build_coin_context([crypto_name], data["calendar"], data["news"], exclude=shared_items)
+        stocks = sorted((name, round(info["change"] / DAEMON_STOCK_CHANGE)) for name, info in data["stocks"].items())
+        return _text_hash(json.dumps([sorted(shared_items), coin_context, stocks], ensure_ascii=False))
+    
+    def material_change(self, pair, price, signature, now=None):
+        """判断该交易对是否需要重新分析，返回原因（无需重新分析时返回None）"""
+        previous = self.analyzed.get(pair)
+        if previous is None:
+            return "首次分析"
+        if (now or time.time()) - previous["at"] >= DAEMON_MAX_PREDICTION_AGE:
+            return "预测已过期"
+        if previous["price"] and abs(price / previous["price"] - 1) >= DAEMON_PRICE_CHANGE:
+            return f"价格变动{(price / previous['price'] - 1) * 100:+.2f}%"
+        if signature != previous["signature"]:
+            return "资讯或市场环境变化"
+        return None
+    
+    def run_cycle(self):
+        """一个分析周期：刷新已到期的数据源，重新分析输入有变化的交易对，返回本周期重新分析的交易对"""
+        begin_run()
+        self.cycles += 1
+        print(f"\n===== 守护进程第{self.cycles}轮（{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）=====")
+        with METRICS.span("run"), run_budget_scope():
+            with METRICS.span("gather"):
+                self.refresh()
+            with self.lock:
+                prices = {pair: self.data["prices"][pair] for pair in self.pairs() if pair in self.data["prices"]}
+                data = dict(self.data)
+            
+            changed = {}
+            signatures = {}
+            for pair, price in prices.items():
+                signatures[pair] = self.context_signature(pair)
+                reason = self.material_change(pair, price, signatures[pair])
+                if reason:
+                    changed[pair] = price
+                    print(f"   {pair}：{reason}")
+            print(f"   需要重新分析：{len(changed)}/{len(prices)}个交易对")
+            METRICS.incr("daemon_pairs_reanalyzed_total", len(changed))
+            METRICS.incr("daemon_pairs_skipped_total", len(prices) - len(changed))
+            
+            if changed:
+                printer = StreamPrinter() if self.stream else None
+                
+                def on_result(pair, result):
+                    if printer:
+                        printer.end_line()
+                    print_result(pair, result)
+                    if result:
+                        with self.lock:
+                            self.results[pair] = result
+                            self.analyzed[pair] = {"price": changed[pair], "signature": signatures[pair],
+                                                   "at": time.time()}
+                
+                with METRICS.span("analysis"):
+                    analyze_all(changed, PREDICTION_HOURS, data["stocks"], data["news"], data["calendar"],
+                                on_result=on_result, on_stream=printer, indicators=data["indicators"])
+            
+            with self.lock:
+                current = [self.results[pair] for pair in prices if pair in self.results]
+            print(summarize_results(current, data["news"]))
+        if self.metrics_dir:
+            export_metrics(self.metrics_dir)
+        return list(changed)
+    
+    def snapshot(self):
+        """当前内存中的数据与各交易对的最新预测（浅拷贝）"""
+        with self.lock:
+            return {"data": dict(self.data), "results": dict(self.results), "cycles": self.cycles}
+    
+    def run(self, max_cycles=None):
+        """常驻运行：启动时立即分析一次，此后在每个整点/半点分析，其间按间隔刷新数据源；stop()后退出"""
+        boundary = datetime.now()
+        while not self.stop_event.is_set():
+            if datetime.now() >= boundary:
+                self.run_cycle()
+                boundary = next_boundary()
+                if max_cycles is not None and self.cycles >= max_cycles:
+                    break
+                print(f"下一轮分析：{boundary.strftime('%H:%M')}")
+            else:
+                # 两轮分析之间只刷新数据源（价格等），保持内存中的数据新鲜
+                self.refresh()
+            now = time.monotonic()
+            waits = [(boundary - datetime.now()).total_seconds()]
+            waits += [self.next_refresh.get(source, now) - now for source in self.SOURCES]
+            self.stop_event.wait(max(1.0, min(waits)))
+    
+    def stop(self):
+        self.stop_event.set()
+
+
+def run_daemon(metrics_dir=None, stream=None, screen_top_k=None):
+    """以守护进程模式运行，直到Ctrl+C"""
+    daemon = Daemon(screen_top_k=screen_top_k, stream=DEEPSEEK_STREAM if stream is None else stream,
+                    metrics_dir=metrics_dir)
+    print("===== 守护进程模式启动（Ctrl+C退出）=====")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        PREDICTION_CACHE.save()
+        print("\n===== 守护进程已退出 =====")
+    return daemon
+
+
+# --------------------------
+# 9. 只读HTTP接口：多个客户端共用一个守护进程的数据与预测
+# --------------------------
+class SingleFlight:
+    """合并相同键的并发调用：只有第一个调用方执行，其余调用方等待并共享同一结果（或异常）"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+    
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            METRICS.incr("singleflight_shared_total")
+            call["done"].wait()
+        else:
+            try:
+                call["result"] = func(*args)
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call["done"].set()
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+
+def to_jsonable(value):
+    """将结果字典中的datetime等转换为JSON可序列化的值"""
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+PAIR_PATTERN = re.compile(r"^[A-Z0-9]+-[A-Z0-9]+$")
+
+
+class PredictionService:
+    """HTTP接口背后的数据服务：读取守护进程内存中的数据，缺少或已过期的交易对按需分析
+    
+    守护进程负责的交易对在DAEMON_MAX_PREDICTION_AGE内有效（其间由守护进程按输入变化重新分析）；
+    按需分析的交易对不在守护进程的周期内，只在分析时所在的时间段（round_time）内有效。
+    同一交易对、同一时间段的并发请求只触发一次分析。
+    """
+    
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.flight = SingleFlight()
+    
+    def ensure_data(self):
+        """守护进程尚未获取过数据时先刷新一次（并发请求共用同一次刷新）"""
+        if not self.daemon.refreshed_at:
+            self.flight.do("refresh", self.daemon.refresh, list(Daemon.SOURCES))
+    
+    def fresh_result(self, pair, bucket, now=None):
+        """内存中该交易对仍然有效的预测，没有或已过期时返回None"""
+        with self.daemon.lock:
+            result = self.daemon.results.get(pair)
+            analyzed = self.daemon.analyzed.get(pair)
+            if not result or not analyzed:
+                return None
+            if (now or time.time()) - analyzed["at"] >= DAEMON_MAX_PREDICTION_AGE:
+                return None
+            if pair not in self.daemon.pairs() and analyzed.get("bucket") != bucket:
+                return None
+            return result
+    
+    def prediction(self, pair):
+        bucket = round_time(datetime.now()).isoformat()
+        result = self.fresh_result(pair, bucket)
+        if result:
+            return result
+        return self.flight.do((pair, bucket), self._analyze, pair, bucket)
+    
+    def _analyze(self, pair, bucket):
+        # 按需分析不在守护进程的分析周期内，使用独立的运行预算（埋点仍记入全局METRICS）
+        with run_budget_scope():
+            return self._analyze_in_scope(pair, bucket)
+    
+    def _analyze_in_scope(self, pair, bucket):
+        self.ensure_data()
+        result = self.fresh_result(pair, bucket)
+        if result:
+            return result
+        with self.daemon.lock:
+            data = dict(self.daemon.data)
+            price = data["prices"].get(pair)
+        if price is None:
+            ticker = get_crypto_tickers([pair]).get(pair)
+            if not ticker:
+                return None
+            price = ticker["last"]
+        indicators = data["indicators"].get(pair) or get_crypto_indicators([pair]).get(pair)
+        result = analyze_with_retries(pair, price, PREDICTION_HOURS, data["stocks"], data["news"], data["calendar"],
+                                      indicators=indicators)
+        if result:
+            record_prediction_history({pair: result}, PREDICTION_HOURS)
+            with self.daemon.lock:
+                self.daemon.results[pair] = result
+                self.daemon.analyzed[pair] = {"price": price, "signature": self.daemon.context_signature(pair),
+                                              "at": time.time(), "bucket": bucket}
+        return result
+    
+    def handle(self, path):
+        """处理GET请求，返回(状态码, 响应对象, 缓存秒数)"""
+        parts = [part for part in path.split("/") if part]
+        predictions_ttl = max(1, int((next_boundary() - datetime.now()).total_seconds()))
+        if parts == ["health"]:
+            snapshot = self.daemon.snapshot()
+            return 200, {"status": "ok", "cycles": snapshot["cycles"], "pairs": len(snapshot["results"])}, 0
+        if parts in (["prices"], ["context"], ["predictions"]):
+            self.ensure_data()
+            snapshot = self.daemon.snapshot()
+            data = snapshot["data"]
+            if parts == ["prices"]:
+                return 200, {"prices": data["prices"], "tickers": data["tickers"]}, \
+                    self.daemon.intervals.get("prices", 60)
+            if parts == ["context"]:
+                return 200, {"news": data["news"], "calendar": data["calendar"], "stocks": data["stocks"],
+                             "indicators": data["indicators"]}, self.daemon.intervals.get("news", 900)
+            return 200, {"predictions": snapshot["results"]}, predictions_ttl
+        if len(parts) == 2 and parts[0] == "predictions":
+            pair = parts[1].upper()
+            if not PAIR_PATTERN.match(pair):
+                return 400, {"error": f"无效的交易对：{parts[1]}"}, 0
+            result = self.prediction(pair)
+            if not result:
+                return 502, {"error": f"{pair} 分析失败"}, 0
+            return 200, {"pair": pair, "prediction": result}, predictions_ttl
+        return 404, {"error": "未知路径", "paths": ["/health", "/prices", "/context", "/predictions",
+                                                   "/predictions/{交易对}"]}, 0
+
+
+def create_api_server(service, host=None, port=None):
+    """创建HTTP服务器（尚未启动）；响应带ETag与Cache-Control，If-None-Match一致时返回304"""
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, *args):
+            pass
+        
+        def do_GET(self):
+            try:
+                status, payload, max_age = service.handle(urlparse(self.path).path)
+            except Exception as e:
+                status, payload, max_age = 500, {"error": str(e)}, 0
+            METRICS.incr("api_requests_total", status=status)
+            body = json.dumps(to_jsonable(payload), ensure_ascii=False, sort_keys=True).encode("utf-8")
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            if status == 200 and etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", f"max-age={max_age}")
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 200:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", f"max-age={max_age}")
+            else:
+                self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+    
+    httpd = ThreadingHTTPServer((host or API_HOST, API_PORT if port is None else port), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+
+def run_api_server(host=None, port=None, screen_top_k=None, metrics_dir=None):
+    """启动HTTP接口，同时在后台以守护进程模式刷新数据与预测，直到Ctrl+C"""
+    daemon = Daemon(screen_top_k=screen_top_k, metrics_dir=metrics_dir)
+    httpd = create_api_server(PredictionService(daemon), host, port)
+    worker = threading.Thread(target=daemon.run, name="cryptosift-daemon", daemon=True)
+    worker.start()
+    address, bound_port = httpd.server_address[:2]
+    print(f"===== HTTP接口已启动：http://{address}:{bound_port}/predictions（Ctrl+C退出）=====")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        httpd.server_close()
+        PREDICTION_CACHE.save()
+        print("\n===== HTTP接口已关闭 =====")
+    return daemon
+
+
+# --------------------------
+# 10. 界面使用的后台分析引擎
+# --------------------------
+class AnalysisEngine:
+    """可取消的后台分析引擎（供Kivy应用等界面使用，与命令行使用相同的采集与分析函数）
+    
+    引擎持有一个工作线程与预热的共享上下文：资讯、财经日历与美股数据在ENGINE_CONTEXT_TTL内复用，
+    价格与K线每次运行时获取。运行过程通过on_event(事件, 内容)回调（在工作线程中调用）：
+      "status"        状态文字
+      "prices"        交易对 -> 价格
+      "token"         (交易对, 流式文本片段)
+      "probabilities" (交易对, (涨, 跌, 横盘))
+      "result"        (交易对, 结果字典或None)，每完成一个交易对即回调
+      "done"          汇总文本
+      "cancelled"     None
+      "error"         错误信息
+    新的运行开始或调用cancel()后，旧运行的事件不再回调。
+    """
+    
+    def __init__(self, on_event=None, context_ttl=None):
+        self.on_event = on_event
+        self.context_ttl = ENGINE_CONTEXT_TTL if context_ttl is None else context_ttl
+        self.executor = ContextThreadPoolExecutor(max_workers=1, thread_name_prefix="cryptosift-engine")
+        self.lock = threading.Lock()
+        self.run_id = 0
+        self.cancel_event = threading.Event()
+        self.context = None
+        self.context_at = -math.inf
+    
+    def submit(self, crypto_pairs, prediction_hours=None, stream=False, refresh_context=False):
+        """开始一次分析（若上一次仍在运行则先取消），返回Future（结果为 交易对 -> 结果字典）"""
+        with self.lock:
+            self.cancel_event.set()
+            self.run_id += 1
+            self.cancel_event = threading.Event()
+            run_id, cancel_event = self.run_id, self.cancel_event
+        return self.executor.submit(self._run, run_id, cancel_event, list(crypto_pairs),
+                                    prediction_hours or PREDICTION_HOURS, stream, refresh_context)
+    
+    def cancel(self):
+        """取消当前运行：尚未开始的分析不再执行，进行中的请求完成后结果被丢弃"""
+        with self.lock:
+            self.cancel_event.set()
+    
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _emit(self, run_id, event, payload=None):
+        if self.on_event and run_id == self.run_id and not self.cancel_event.is_set():
+            self.on_event(event, payload)
+    
+    def shared_context(self, refresh=False):
+        """返回共享上下文{"news", "stocks", "calendar"}，超过context_ttl时并发重新获取"""
+        if refresh or self.context is None or time.monotonic() - self.context_at >= self.context_ttl:
+            def traced(name, func):
+                with METRICS.span(name):
+                    return func()
+            
+            with ContextThreadPoolExecutor(max_workers=3) as executor:
+                futures = {
+                    "news": executor.submit(traced, "gather.news", get_latest_news),
+                    "stocks": executor.submit(traced, "gather.stocks", get_us_stock_data),
+                    "calendar": executor.submit(traced, "gather.calendar", get_crypto_calendar_events)
+                }
+                self.context = {key: future.result() for key, future in futures.items()}
+            self.context_at = time.monotonic()
+        return self.context
+    
+    def _run(self, run_id, cancel_event, crypto_pairs, prediction_hours, stream, refresh_context):
+        begin_run()
+        results = {}
+        try:
+            with METRICS.span("run"):
+                self._emit(run_id, "status", "正在获取价格与市场数据...")
+                with METRICS.span("gather"):
+                    with ContextThreadPoolExecutor(max_workers=2) as executor:
+                        context_future = executor.submit(self.shared_context, refresh_context)
+                        ticker_future = executor.submit(get_crypto_tickers, crypto_pairs)
+                        indicators = get_crypto_indicators(crypto_pairs)
+                        tickers = ticker_future.result()
+                        context = context_future.result()
+                prices = {pair: ticker["last"] for pair, ticker in tickers.items()}
+                if not prices:
+                    self._emit(run_id, "error", "获取价格失败")
+                    return results
+                self._emit(run_id, "prices", prices)
+                if cancel_event.is_set():
+                    return results
+                
+                on_stream = None
+                if stream:
+                    def on_stream(pair, kind, payload):
+                        if not cancel_event.is_set():
+                            self._emit(run_id, kind, (pair, payload))
+                
+                self._emit(run_id, "status", f"正在分析{len(prices)}个交易对...")
+                with METRICS.span("analysis"):
+                    analyses = iter_analyses(prices, prediction_hours, context["stocks"], context["news"],
+                                             context["calendar"], on_stream=on_stream, indicators=indicators,
+                                             cancel_event=cancel_event)
+                    try:
+                        for pair, result in analyses:
+                            if cancel_event.is_set():
+                                break
+                            if result:
+                                results[pair] = result
+                            self._emit(run_id, "result", (pair, result))
+                    finally:
+                        # 提前结束时取消尚未开始的分析
+                        analyses.close()
+                record_prediction_history(results, prediction_hours)
+                if cancel_event.is_set():
+                    if self.on_event and run_id == self.run_id:
+                        self.on_event("cancelled", None)
+                    return results
+                ordered = [results[pair] for pair in prices if pair in results]
+                self._emit(run_id, "done", summarize_results(ordered, context["news"]))
+        except Exception as e:
+            self._emit(run_id, "error", f"分析过程出错：{str(e)}")
+        return results
+
+
 # --------------------------
 # 主函数：执行完整流程
 # --------------------------
-def main():
+def begin_run():
+    """每轮运行开始时调用：重置重试预算、埋点数据与连接统计"""
+    reset_run_budget()
+    METRICS.reset()
+    HTTP_CONNECTION_STATS.reset()
+
+
+def export_metrics(directory):
+    """导出本轮运行报告，返回(JSON报告路径, Prometheus文件路径)"""
+    report_path, prom_path = METRICS.export(directory)
+    print(f"运行指标已导出：{report_path}，{prom_path}")
+    return report_path, prom_path
+
+
+def main(metrics_dir=None, stream=None, screen_top_k=None):
     print(f"===== 开始分析（{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}）=====\n")
+    begin_run()
+    try:
+        with METRICS.span("run"):
+            return run_pipeline(DEEPSEEK_STREAM if stream is None else stream, screen_top_k)
+    finally:
+        if metrics_dir:
+            export_metrics(metrics_dir)
+
+
+def run_pipeline(stream=False, screen_top_k=None):
+    """完整流程：数据采集 -> 预测分析 -> 结果汇总，返回预测结果列表
     
-    # 步骤1：获取实时市场资讯
-    print("1. 获取最新市场资讯...")
-    latest_news = get_latest_news()
+    stream为True时逐字输出模型回复；screen_top_k不为None时分析全市场筛选出的交易对而不是CRYPTO_LIST。
+    """
+    # 步骤1-3：并发获取资讯、美股数据与加密货币价格
+    print("1-3. 并发获取市场资讯、美股数据与加密货币价格...")
+    start = time.monotonic()
+    with METRICS.span("gather"):
+        market_data = gather_market_data(CRYPTO_LIST, screen_top_k)
+    latest_news = market_data["news"]
+    stock_data = market_data["stocks"]
+    crypto_prices = market_data["prices"]
+    calendar_events = market_data["calendar"]
+    print(f"   数据采集耗时：{time.monotonic() - start:.1f}秒")
     print(f"   资讯摘要：{latest_news[:100]}...\n")
     
-    # 步骤2：获取美股数据
-    print("2. 获取美股市场数据...")
-    stock_data = get_us_stock_data()
     if not stock_data:
         print("   警告：未获取到任何美股数据\n")
     
-    # 步骤3：获取加密货币价格
-    print("\n3. 获取加密货币价格...")
-    crypto_prices = get_crypto_prices(CRYPTO_LIST)
     if not crypto_prices:
         print("   错误：未获取到任何加密货币价格，程序终止")
-        return
+        return []
     
     # 步骤4：分析并预测
     print("\n4. 开始价格预测分析...")
-    all_results = []
-    for pair, price in crypto_prices.items():
-        print(f"   分析 {pair}...")
-        result = None
-        for attempt in range(MAX_RETRIES):
-            result = analyze_single_crypto(pair, price, PREDICTION_HOURS, stock_data, latest_news)
-            if result:
-                break
-            print(f"   第{attempt + 1}次重试分析 {pair}...")
-        if result:
-            all_results.append(result)
-        else:
-            print(f"   无法完成 {pair} 的分析")
+    printer = StreamPrinter() if stream else None
+    
+    def on_result(pair, result):
+        if printer:
+            printer.end_line()
+        print_result(pair, result)
+    
+    with METRICS.span("analysis"):
+        all_results = analyze_all(crypto_prices, PREDICTION_HOURS, stock_data, latest_news, calendar_events,
+                                  on_result=on_result, on_stream=printer, indicators=market_data["indicators"])
     
     # 步骤5：输出结果
     print("\n===== 分析结果汇总 =====")
-    print(summarize_results(all_results, latest_news))
+    with METRICS.span("summarize"):
+        print(summarize_results(all_results, latest_news))
+    pool_stats = get_http_pool_stats()
+    print(f"\n连接复用：新建{pool_stats['opened']}个，复用{pool_stats['reused']}次")
     print("\n===== 分析结束 =====")
+    return all_results
+
+
+def build_arg_parser():
+    """命令行参数（CryptoSift.py与CryptoSiftApp.py共用）"""
+    parser = argparse.ArgumentParser(description="CryptoSift 加密货币分析工具")
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const="metrics",
+        default=None,
+        metavar="DIR",
+        help="运行结束后将JSON运行报告与Prometheus指标写入DIR（默认：metrics）"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=None,
+        help="以流式输出逐字显示模型回复（默认取config.py中的DEEPSEEK_STREAM）"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="常驻运行：各数据源按各自间隔刷新，每个整点/半点只重新分析输入有变化的交易对"
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        type=int,
+        const=API_PORT,
+        default=None,
+        metavar="PORT",
+        help=f"启动只读HTTP接口（后台以守护进程模式运行），默认端口{API_PORT}"
+    )
+    parser.add_argument(
+        "--backtest",
+        action="store_true",
+        help="不运行分析，评估已记录的历史预测（命中率、Brier分数与校准曲线）"
+    )
+    parser.add_argument(
+        "--live-prices",
+        action="store_true",
+        default=None,
+        help="订阅OKX WebSocket实时行情，价格从内存中的最新行情表读取（默认取config.py中的PRICE_STREAM）"
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="录制本次运行的全部HTTP请求与响应（不含密钥）到FILE（gzip压缩的JSON）"
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="从录制文件回放HTTP响应，不访问网络"
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=0.0,
+        metavar="SCALE",
+        help="回放时按录制的耗时乘以SCALE等待（默认0：不等待）"
+    )
+    parser.add_argument(
+        "--replay-fuzzy",
+        action="store_true",
+        help="回放时DeepSeek请求没有完全匹配的录制时，按词语重合度选取最接近的一条（其他请求仍严格匹配）"
+    )
+    parser.add_argument(
+        "--screen",
+        nargs="?",
+        type=int,
+        const=SCREEN_TOP_K,
+        default=None,
+        metavar="K",
+        help=f"筛选全部OKX现货交易对，只分析得分最高的K个（默认：{SCREEN_TOP_K}）"
+    )
+    return parser
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = build_arg_parser().parse_args()
+    if args.record:
+        use_cassette(args.record, "record")
+    elif args.replay:
+        use_cassette(args.replay, "replay", latency_scale=args.replay_latency, fuzzy=args.replay_fuzzy)
+    if (PRICE_STREAM if args.live_prices is None else args.live_prices) and not args.backtest:
+        start_price_feed(CRYPTO_LIST if args.screen is None else [])
+    if args.backtest:
+        begin_run()
+        run_backtest()
+        if args.metrics:
+            export_metrics(args.metrics)
+    elif args.serve is not None:
+        run_api_server(port=args.serve, screen_top_k=args.screen, metrics_dir=args.metrics)
+    elif args.daemon:
+        run_daemon(metrics_dir=args.metrics, stream=args.stream, screen_top_k=args.screen)
+    else:
+        main(metrics_dir=args.metrics, stream=args.stream, screen_top_k=args.screen)
@@ -13,16 +13,34 @@ from functools import partial
 import threading
 
 from CryptoSift import (
-    get_us_stock_data,
-    get_crypto_prices,
-    analyze_single_crypto,
-    summarize_results,
-    MAX_RETRIES
+    AnalysisEngine,
+    export_metrics,
+    build_arg_parser,
+    use_cassette,
+    start_price_feed,
+    stop_price_feed,
+    DEEPSEEK_STREAM,
+    PRICE_STREAM
 )
 
 class CryptoSiftUI(BoxLayout):
-    def __init__(self, **kwargs):
+    def __init__(self, metrics_dir=None, live_prices=False, stream=None, **kwargs):
         super().__init__(**kwargs)
+        # 运行指标导出目录（--metrics），None表示不导出
+        self.metrics_dir = metrics_dir
+        # 是否流式显示DeepSeek的输出（--stream，未指定时使用配置中的DEEPSEEK_STREAM）
+        self.stream = DEEPSEEK_STREAM if stream is None else stream
+        # 流式输出：各交易对已收到的文本，按帧合并刷新到结果标签
+        self.stream_lock = threading.Lock()
+        self.stream_texts = {}
+        self.stream_scheduled = False
+        # 后台分析引擎：复用共享上下文与连接，事件在工作线程中回调
+        self.engine = AnalysisEngine(on_event=self.on_engine_event)
+        self.current_future = None
+        # 结果区域的内容：状态、各交易对的进度/结果行与最终汇总
+        self.status_text = ''
+        self.pair_lines = {}
+        self.summary_text = ''
         self.orientation = 'vertical'
         self.padding = dp(10)
         self.spacing = dp(10)
@@ -56,8 +74,9 @@ class CryptoSiftUI(BoxLayout):
             'DOGE-USDT', 'DOT-USDT', 'MATIC-USDT'
         ]
         
-        # 复选框字典
+        # 复选框字典与实时价格标签
         self.checkboxes = {}
+        self.price_labels = {}
         
         # 添加加密货币选择项
         for pair in self.crypto_pairs:
@@ -71,12 +90,23 @@ class CryptoSiftUI(BoxLayout):
             
             # 添加标签
             row.add_widget(Label(text=pair))
+            self.price_labels[pair] = Label(text='')
+            row.add_widget(self.price_labels[pair])
             
             self.crypto_grid.add_widget(row)
         
         scroll.add_widget(self.crypto_grid)
         self.add_widget(scroll)
         
+        # 实时行情：订阅全部可选交易对，每秒从内存中的行情表刷新价格（不访问网络）
+        self.price_feed = None
+        if live_prices:
+            try:
+                self.price_feed = start_price_feed(self.crypto_pairs, warmup=0)
+                Clock.schedule_interval(self.refresh_live_prices, 1)
+            except ImportError as e:
+                print(f"实时行情不可用：{str(e)}（需要安装：pip install websocket-client）")
+        
         # 预测时间输入
         hours_layout = BoxLayout(size_hint_y=None, height=dp(40))
         hours_layout.add_widget(Label(
@@ -94,15 +124,24 @@ class CryptoSiftUI(BoxLayout):
         hours_layout.add_widget(self.hours_input)
         self.add_widget(hours_layout)
         
-        # 开始分析按钮
+        # 开始分析 / 取消按钮（分析进行中再次点击开始分析会取消当前运行并重新分析）
+        buttons = BoxLayout(size_hint_y=None, height=dp(50), spacing=dp(10))
         self.analyze_btn = Button(
             text='开始分析',
-            size_hint_y=None,
-            height=dp(50),
             background_color=(0.2, 0.7, 0.3, 1)
         )
         self.analyze_btn.bind(on_press=self.start_analysis)
-        self.add_widget(self.analyze_btn)
+        buttons.add_widget(self.analyze_btn)
+        self.cancel_btn = Button(
+            text='取消',
+            size_hint_x=None,
+            width=dp(100),
+            disabled=True,
+            background_color=(0.8, 0.3, 0.3, 1)
+        )
+        self.cancel_btn.bind(on_press=self.cancel_analysis)
+        buttons.add_widget(self.cancel_btn)
+        self.add_widget(buttons)
         
         # 结果显示区域
         self.result_label = Label(
@@ -132,52 +171,125 @@ class CryptoSiftUI(BoxLayout):
             self.result_label.text = '请输入有效的预测时间'
             return
         
-        # 禁用按钮
-        self.analyze_btn.disabled = True
-        self.result_label.text = '正在分析中，请稍候...'
+        # 重置结果区域（上一次仍在运行时由引擎取消）
+        with self.stream_lock:
+            self.stream_texts = {}
+        self.status_text = '正在分析中，请稍候...'
+        self.pair_lines = {pair: '等待分析...' for pair in selected_pairs}
+        self.summary_text = ''
+        self.render()
+        self.cancel_btn.disabled = False
         
-        # 在新线程中执行分析
-        threading.Thread(target=self.run_analysis, args=(selected_pairs, hours)).start()
+        # 在引擎的工作线程中执行分析，每完成一个交易对即更新界面
+        future = self.engine.submit(selected_pairs, hours, stream=self.stream)
+        self.current_future = future
+        future.add_done_callback(self.on_analysis_finished)
     
-    def run_analysis(self, crypto_pairs, prediction_hours):
-        try:
-            # 获取美股数据
-            stock_data = get_us_stock_data()
-            
-            # 获取加密货币价格
-            prices = get_crypto_prices(crypto_pairs)
-            if not prices:
-                Clock.schedule_once(lambda dt: self.update_result('获取价格失败'))
+    def cancel_analysis(self, instance):
+        self.engine.cancel()
+        self.cancel_btn.disabled = True
+    
+    def on_analysis_finished(self, future):
+        """工作线程中调用：导出运行指标，并在这是最近一次运行时恢复按钮状态"""
+        if self.metrics_dir:
+            export_metrics(self.metrics_dir)
+        if future is self.current_future:
+            Clock.schedule_once(lambda dt: setattr(self.cancel_btn, 'disabled', True))
+    
+    def on_engine_event(self, event, payload):
+        """引擎事件（工作线程中调用）：流式文本按帧合并，其他事件切换到主线程处理"""
+        if event in ("token", "probabilities"):
+            pair, content = payload
+            self.on_stream(pair, event, content)
+            return
+        Clock.schedule_once(partial(self.apply_event, event, payload))
+    
+    def apply_event(self, event, payload, dt):
+        if event == "status":
+            self.status_text = payload
+        elif event == "prices":
+            for pair in self.pair_lines:
+                if pair in payload:
+                    self.pair_lines[pair] = f'现价{payload[pair]}，分析中...'
+                else:
+                    self.pair_lines[pair] = '获取价格失败'
+        elif event == "result":
+            pair, result = payload
+            # 最终结果已确定，之后的流式刷新不再覆盖这一行
+            with self.stream_lock:
+                self.stream_texts.pop(pair, None)
+            if result:
+                self.pair_lines[pair] = (f"涨{result['up']}%，跌{result['down']}%，横盘{result['flat']}% → "
+                                         f"主趋势：{result['main_trend']}（{result['main_prob']}%）")
+            else:
+                self.pair_lines[pair] = '分析失败'
+        elif event == "done":
+            self.status_text = '分析完成'
+            self.summary_text = payload
+        elif event == "cancelled":
+            self.status_text = '已取消'
+        elif event == "error":
+            self.status_text = payload
+        self.render()
+    
+    def refresh_live_prices(self, dt):
+        latest = self.price_feed.snapshot(self.crypto_pairs)
+        for pair, label in self.price_labels.items():
+            label.text = str(latest[pair]['last']) if pair in latest else ''
+    
+    def render(self):
+        lines = [self.status_text]
+        lines += [f'{pair}：{line}' for pair, line in self.pair_lines.items()]
+        if self.summary_text:
+            lines += ['', self.summary_text]
+        self.result_label.text = '\n'.join(lines)
+    
+    def on_stream(self, pair, kind, payload):
+        """后台线程收到流式文本时调用：先累积，再通过Clock.schedule_once在主线程刷新（每帧最多一次）"""
+        with self.stream_lock:
+            if kind == "probabilities":
+                up, down, flat = payload
+                text = f" 概率：涨{up}%，跌{down}%，横盘{flat}%"
+            else:
+                text = payload
+            self.stream_texts[pair] = self.stream_texts.get(pair, "") + text
+            if self.stream_scheduled:
                 return
-            
-            # 分析预测
-            all_results = []
-            for pair, price in prices.items():
-                for attempt in range(MAX_RETRIES):
-                    result = analyze_single_crypto(pair, price, prediction_hours, stock_data)
-                    if result:
-                        all_results.append(result)
-                        break
-            
-            # 生成总结
-            summary = summarize_results(all_results)
-            
-            # 在主线程中更新UI
-            Clock.schedule_once(lambda dt: self.update_result(summary))
-            
-        except Exception as e:
-            Clock.schedule_once(lambda dt: self.update_result(f'分析过程出错：{str(e)}'))
-        finally:
-            # 重新启用按钮
-            Clock.schedule_once(lambda dt: setattr(self.analyze_btn, 'disabled', False))
+            self.stream_scheduled = True
+        Clock.schedule_once(self.flush_stream)
     
-    def update_result(self, text):
-        self.result_label.text = text
+    def flush_stream(self, dt):
+        with self.stream_lock:
+            self.stream_scheduled = False
+            texts = dict(self.stream_texts)
+        # 每个交易对只显示最近收到的一段文字，避免标签过长
+        for pair, content in texts.items():
+            if pair in self.pair_lines:
+                self.pair_lines[pair] = '…' + content.replace('\n', ' ')[-60:]
+        self.render()
 
 class CryptoSiftApp(App):
+    def __init__(self, metrics_dir=None, live_prices=False, stream=None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics_dir = metrics_dir
+        self.live_prices = live_prices
+        self.stream = stream
+    
     def build(self):
-        return CryptoSiftUI()
+        self.ui = CryptoSiftUI(metrics_dir=self.metrics_dir, live_prices=self.live_prices, stream=self.stream)
+        return self.ui
+    
+    def on_stop(self):
+        self.ui.engine.shutdown()
+        stop_price_feed()
 
 if __name__ == '__main__':
+    # Kivy会解析自身的命令行参数，应用参数需放在"--"之后，例如：python CryptoSiftApp.py -- --metrics
+    args, _ = build_arg_parser().parse_known_args()
+    if args.record:
+        use_cassette(args.record, "record")
+    elif args.replay:
+        use_cassette(args.replay, "replay", latency_scale=args.replay_latency, fuzzy=args.replay_fuzzy)
     Window.clearcolor = (0.95, 0.95, 0.95, 1)  # 设置浅灰色背景
-    CryptoSiftApp().run()
\ No newline at end of file
+    live_prices = PRICE_STREAM if args.live_prices is None else args.live_prices
+    CryptoSiftApp(metrics_dir=args.metrics, live_prices=live_prices, stream=args.stream).run()
\ No newline at end of file
@@ -0,0 +1,1020 @@
+"""CryptoSift 离线性能基准
+
+在本地启动OKX、Binance、博查搜索、DeepSeek与财经日历（CoinMarketCal/CoinGecko）的替身服务，
+将配置中的接口地址指向替身，测量完整流程（main）的耗时、请求数与吞吐量，无需真实密钥和网络。
+
+用法：
+    python benchmark.py                                  # 默认测量5、50、500个交易对
+    python benchmark.py --pairs 5,50 --latency 0.2       # 自定义交易对数量与替身延迟
+    python benchmark.py --error-rate 0.05 --rate-limit 20 # 注入随机500错误与服务端429限流
+    python benchmark.py --json bench.json                # 同时保存JSON结果，便于比较不同版本
+    python benchmark.py --startup                        # 冷启动基准：导入耗时与Kivy应用首帧耗时，超出预算时失败
+    python benchmark.py --ws --ws-rate 2000 --ws-drop    # 实时行情基准：WebSocket替身按指定速率推送行情，中途断开一次
+
+说明：美股数据由yfinance直接访问Yahoo，没有替身服务，基准运行时不获取美股数据。
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_PAIR_COUNTS = (5, 50, 500)
+BASE_PAIRS = ["SOL-USDT", "BTC-USDT", "ETH-USDT", "PEPE-USDT", "DOGE-USDT"]
+# 冷启动预算（秒，取多次运行的中位数）：导入CryptoSift、Kivy应用从进程启动到绘制出第一帧
+STARTUP_IMPORT_BUDGET = 0.5
+STARTUP_FIRST_FRAME_BUDGET = 3.0
+# 启动阶段不应导入的重量级依赖（只在对应功能首次使用时导入）
+HEAVY_MODULES = ("numpy", "pandas", "yfinance")
+
+
+# --------------------------
+# 本地替身服务
+# --------------------------
+class StandInBehavior:
+    """替身服务的行为参数：固定延迟+随机抖动（秒）、随机500错误率、服务端限流（每秒请求数，0为不限）、
+    流式响应中相邻两段之间的间隔（秒）"""
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, rate_limit=0, token_delay=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.token_delay = token_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def next_delay(self):
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.jitter)
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+class SSEStream:
+    """处理函数返回该对象时，替身服务以text/event-stream分段发送events中的每个对象"""
+
+    def __init__(self, events):
+        self.events = events
+
+
+class StandInServer:
+    """运行在本地随机端口上的HTTP替身服务
+
+    routes为 (方法, 路径) -> 处理函数，处理函数接收(查询参数, JSON请求体)并返回响应对象
+    （或(状态码, 响应对象)）。
+    """
+
+    def __init__(self, name, routes, behavior):
+        self.name = name
+        self.routes = routes
+        self.behavior = behavior
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+        self._tokens = float(behavior.rate_limit or 0)
+        self._updated = time.monotonic()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"stand-in-{self.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _throttled(self):
+        """服务端令牌桶：超过rate_limit时返回True（响应429）"""
+        rate = self.behavior.rate_limit
+        if not rate:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self._tokens = min(float(rate), self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return False
+            return True
+
+    @staticmethod
+    def _send(request, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _send_stream(self, request, stream):
+        """以分块传输发送SSE事件，最后发送data: [DONE]"""
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.send_header("Transfer-Encoding", "chunked")
+        request.end_headers()
+        events = [f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in stream.events]
+        events.append("data: [DONE]\n\n")
+        for index, event in enumerate(events):
+            if index and self.behavior.token_delay:
+                time.sleep(self.behavior.token_delay)
+            data = event.encode("utf-8")
+            request.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            request.wfile.flush()
+        request.wfile.write(b"0\r\n\r\n")
+
+    def handle(self, request, method):
+        parsed = urlparse(request.path)
+        length = int(request.headers.get("Content-Length") or 0)
+        raw = request.rfile.read(length) if length else b""
+        self._count("requests")
+
+        if self._throttled():
+            self._count("throttled")
+            return self._send(request, 429, {"msg": "Too Many Requests"}, {"Retry-After": "1"})
+        time.sleep(self.behavior.next_delay())
+        if self.behavior.should_fail():
+            self._count("errors")
+            return self._send(request, 500, {"msg": "stand-in error"})
+
+        route = self.routes.get((method, parsed.path))
+        if route is None:
+            return self._send(request, 404, {"msg": f"unknown path {parsed.path}"})
+        try:
+            body = json.loads(raw.decode("utf-8")) if raw else {}
+            payload = route(parse_qs(parsed.query), body)
+        except Exception as e:
+            self._count("errors")
+            return self._send(request, 500, {"msg": str(e)})
+        if isinstance(payload, SSEStream):
+            return self._send_stream(request, payload)
+        if isinstance(payload, tuple):
+            return self._send(request, *payload)
+        return self._send(request, 200, payload)
+
+
+def _stable_fraction(text):
+    """由字符串得到稳定的[0, 1)数值，用于生成可复现的替身数据"""
+    return (zlib.crc32(text.encode("utf-8")) % 10000) / 10000
+
+
+def okx_ticker_item(inst_id):
+    """按OKX /market/ticker(s) 的字段格式生成行情"""
+    fraction = _stable_fraction(inst_id)
+    last = round(0.01 + fraction * 1000, 6)
+    spread = last * 0.0005
+    return {
+        "instType": "SPOT",
+        "instId": inst_id,
+        "last": str(last),
+        "bidPx": str(round(last - spread, 6)),
+        "askPx": str(round(last + spread, 6)),
+        "open24h": str(round(last * (0.95 + fraction / 10), 6)),
+        "high24h": str(round(last * 1.06, 6)),
+        "low24h": str(round(last * 0.93, 6)),
+        "vol24h": str(round(10000 + fraction * 1e6, 2)),
+        "volCcy24h": str(round((10000 + fraction * 1e6) * last, 2)),
+        "ts": str(int(time.time() * 1000))
+    }
+
+
+BAR_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1H": 3600, "4H": 14400, "1D": 86400}
+
+
+def okx_candle_rows(inst_id, bar="1H", before=None, after=None, limit=100):
+    """按OKX /market/candles 的格式生成K线（最新在前）；每根K线的价格只由交易对与时间决定"""
+    step = BAR_SECONDS.get(bar, 3600) * 1000
+    base = float(okx_ticker_item(inst_id)["last"])
+    phase = _stable_fraction(inst_id) * 2 * math.pi
+    newest = int(time.time() * 1000) // step * step
+    if after is not None:
+        newest = min(newest, (int(after) - 1) // step * step)
+    rows = []
+    ts = newest
+    while len(rows) < min(int(limit), 300) and (before is None or ts > int(before)):
+        close = base * (1 + 0.03 * math.sin(ts / step / 12 + phase))
+        open_ = base * (1 + 0.03 * math.sin((ts - step) / step / 12 + phase))
+        rows.append([str(ts), f"{open_:.6f}", f"{max(open_, close) * 1.004:.6f}", f"{min(open_, close) * 0.996:.6f}",
+                     f"{close:.6f}", "1000", f"{1000 * close:.2f}", f"{1000 * close:.2f}",
+                     "0" if ts == newest and after is None else "1"])
+        ts -= step
+    return rows
+
+
+def build_okx_routes(universe):
+    """OKX替身：单个行情返回data[0].last，批量行情返回universe中的全部交易对，K线按请求参数分页"""
+    def ticker(query, body):
+        inst_id = query.get("instId", [""])[0]
+        return {"code": "0", "msg": "", "data": [okx_ticker_item(inst_id)]}
+
+    def tickers(query, body):
+        return {"code": "0", "msg": "", "data": [okx_ticker_item(inst_id) for inst_id in universe]}
+
+    def candles(query, body):
+        def arg(name, default=None):
+            return query.get(name, [default])[0]
+        rows = okx_candle_rows(arg("instId", ""), arg("bar", "1H"), arg("before"), arg("after"), arg("limit", 100))
+        return {"code": "0", "msg": "", "data": rows}
+
+    return {
+        ("GET", "/api/v5/market/ticker"): ticker,
+        ("GET", "/api/v5/market/tickers"): tickers,
+        ("GET", "/api/v5/market/candles"): candles
+    }
+
+
+def binance_ticker_item(inst_id):
+    """按Binance /api/v3/ticker/24hr 的字段格式生成行情，价格与OKX替身相差万分之二"""
+    okx = okx_ticker_item(inst_id)
+    last = float(okx["last"]) * 1.0002
+    return {
+        "symbol": inst_id.replace("-", ""),
+        "lastPrice": f"{last:.6f}",
+        "bidPrice": f"{last * 0.9995:.6f}",
+        "askPrice": f"{last * 1.0005:.6f}",
+        "openPrice": okx["open24h"],
+        "highPrice": okx["high24h"],
+        "lowPrice": okx["low24h"],
+        "volume": okx["vol24h"],
+        "quoteVolume": okx["volCcy24h"],
+        "closeTime": int(okx["ts"])
+    }
+
+
+def build_binance_routes(universe):
+    """Binance替身：symbols返回列出的交易对，不带参数时返回universe中的全部交易对；含未知的交易对时返回400"""
+    items = {item["symbol"]: item for item in (binance_ticker_item(inst_id) for inst_id in universe)}
+
+    def ticker_24hr(query, body):
+        if "symbols" in query:
+            symbols = json.loads(query["symbols"][0])
+            if any(symbol not in items for symbol in symbols):
+                return 400, {"code": -1121, "msg": "Invalid symbol."}
+            return [items[symbol] for symbol in symbols]
+        if "symbol" not in query:
+            return [binance_ticker_item(inst_id) for inst_id in universe]
+        symbol = query["symbol"][0]
+        if symbol not in items:
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+        return items[symbol]
+
+    return {("GET", "/api/v3/ticker/24hr"): ticker_24hr}
+
+
+# 替身资讯的摘要主题（各条内容差异足够大，不会被资讯索引合并为近似重复）
+NEWS_TOPICS = [
+    "机构资金持续流入现货ETF，链上大额转账明显增加",
+    "交易所合约持仓量创出新高，资金费率转为正值",
+    "监管机构发布新的稳定币披露要求，市场反应平淡",
+    "开发者社区公布下一阶段路线图，测试网即将上线",
+    "美元指数走弱叠加降息预期，风险资产普遍反弹",
+    "矿工持仓连续三周下降，长期持有者筹码保持稳定",
+    "去中心化交易所成交额环比增长，新币种交易活跃"
+]
+
+
+def build_search_routes():
+    """博查搜索替身：返回data.webPages.value"""
+    def search(query, body):
+        keyword = body.get("query", "")
+        count = int(body.get("count", 5))
+        return {"code": 200, "data": {"webPages": {"value": [
+            {
+                "name": f"{keyword} 资讯{index + 1}",
+                "snippet": f"{NEWS_TOPICS[(index + len(keyword)) % len(NEWS_TOPICS)]}（{keyword}，替身摘要）",
+                "url": f"https://news.example.com/{abs(hash(keyword)) % 10000}/{index + 1}"
+            }
+            for index in range(count)
+        ]}}}
+
+    return {("POST", "/v1/web-search"): search}
+
+
+def stand_in_prediction(pair):
+    """可复现的预测对象：概率之和为100"""
+    fraction = _stable_fraction(pair)
+    up = 20 + int(fraction * 50)
+    down = (100 - up) // 2
+    return {
+        "prediction": f"{pair}短期走势震荡（替身服务生成）",
+        "up": up,
+        "down": down,
+        "flat": 100 - up - down,
+        "target_price": round(0.01 + fraction * 1000, 6)
+    }
+
+
+def deepseek_reply(messages):
+    """根据提示词内容生成与CryptoSift各分析模式对应的回复文本"""
+    content = messages[-1].get("content", "") if messages else ""
+    if '"predictions"' in content:
+        pairs = re.findall(r"([A-Z0-9]+-[A-Z0-9]+) 现价", content)
+        return json.dumps({"predictions": {pair: stand_in_prediction(pair) for pair in pairs}}, ensure_ascii=False)
+    if '格式为"涨' in content:
+        prediction = stand_in_prediction(content)
+        return f"涨{prediction['up']}%，跌{prediction['down']}%，横盘{prediction['flat']}%"
+    if "JSON" in content:
+        names = re.findall(r"([a-z0-9]+)现价", content)
+        return json.dumps(stand_in_prediction(names[-1] if names else content), ensure_ascii=False)
+    return "综合分析，短期内价格大概率维持震荡（替身服务生成）"
+
+
+def build_deepseek_routes():
+    """DeepSeek替身：返回choices[0].message.content与usage；请求stream为true时以SSE分段返回delta.content"""
+    def chat(query, body):
+        messages = body.get("messages", [])
+        reply = deepseek_reply(messages)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 2
+        completion_tokens = len(reply) // 2
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if body.get("stream"):
+            pieces = [reply[index:index + 4] for index in range(0, len(reply), 4)]
+            events = [{"choices": [{"index": 0, "delta": {"content": piece}}]} for piece in pieces]
+            events.append({"choices": [], "usage": usage})
+            return SSEStream(events)
+        return {
+            "id": "stand-in",
+            "object": "chat.completion",
+            "model": body.get("model", "deepseek-chat"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    return {("POST", "/chat/completions"): chat}
+
+
+def build_coinmarketcal_routes():
+    """CoinMarketCal替身：返回data列表"""
+    def events(query, body):
+        return {"data": [
+            {
+                "title": {"en": f"Stand-in event {index + 1}"},
+                "date_event": query.get("dateRangeStart", ["2026-01-01"])[0],
+                "coins": [{"name": "Bitcoin"}]
+            } for index in range(int(query.get("max", ["5"])[0]))
+        ]}
+
+    return {("GET", "/v1/events"): events}
+
+
+def build_coingecko_routes():
+    """CoinGecko替身：返回data.upcoming_events"""
+    def events(query, body):
+        return {"data": {"upcoming_events": [
+            {"title": {"en": f"Gecko stand-in event {index + 1}"}, "start_date": "2026-01-01"}
+            for index in range(5)
+        ]}}
+
+    return {("GET", "/api/v3/events"): events}
+
+
+def start_stand_ins(universe, **behavior):
+    """启动全部替身服务，返回 名称 -> StandInServer"""
+    seed = behavior.pop("seed", None)
+    builders = {
+        "okx": lambda: build_okx_routes(universe),
+        "binance": lambda: build_binance_routes(universe),
+        "search": build_search_routes,
+        "deepseek": build_deepseek_routes,
+        "coinmarketcal": build_coinmarketcal_routes,
+        "coingecko": build_coingecko_routes
+    }
+    return {
+        name: StandInServer(name, build(), StandInBehavior(seed=seed, **behavior)).start()
+        for name, build in builders.items()
+    }
+
+
+# --------------------------
+# 基准运行
+# --------------------------
+def install_stand_in_config(servers):
+    """用指向替身服务的配置模块替换config，必须在导入CryptoSift之前调用"""
+    config = types.ModuleType("config")
+    config.DEEPSEEK_API_KEY = "stand-in"
+    config.DEEPSEEK_API_URL = servers["deepseek"].base_url + "/chat/completions"
+    config.OKX_API_KEY = "stand-in"
+    config.OKX_SECRET_KEY = "stand-in"
+    config.OKX_PASSPHRASE = "stand-in"
+    config.OKX_API_URL = servers["okx"].base_url + "/api/v5/market/ticker"
+    config.BINANCE_TICKER_URL = servers["binance"].base_url + "/api/v3/ticker/24hr"
+    config.SEARCH_API_KEY = "stand-in"
+    config.SEARCH_API_URL = servers["search"].base_url + "/v1/web-search"
+    config.COINMARKETCAL_TOKEN = "stand-in"
+    sys.modules["config"] = config
+    return config
+
+
+def import_cryptosift(servers, unthrottled=False):
+    """导入CryptoSift并将日历地址、限流配置指向替身服务"""
+    install_stand_in_config(servers)
+    import CryptoSift
+
+    calendar_sources = CryptoSift.get_financial_calendar_sources()
+    calendar_sources["coinmarketcal"]["url"] = servers["coinmarketcal"].base_url + "/v1/events"
+    calendar_sources["coingecko"]["url"] = servers["coingecko"].base_url + "/api/v3/events"
+    # 美股数据没有替身服务
+    CryptoSift.US_STOCKS = {}
+
+    # 替身服务沿用其所代表的真实主机的限流配置，以便反映真实的节奏
+    real_hosts = {
+        "okx": "www.okx.com",
+        "binance": "api.binance.com",
+        "search": "api.bochaai.com",
+        "deepseek": "api.deepseek.com",
+        "coinmarketcal": "api.coinmarketcal.com",
+        "coingecko": "api.coingecko.com"
+    }
+    rate_limits = dict(CryptoSift.RATE_LIMITS)
+    for name, server in servers.items():
+        limit = (1000, 1000) if unthrottled else rate_limits.get(real_hosts[name], CryptoSift.DEFAULT_RATE_LIMIT)
+        rate_limits[CryptoSift.url_host(server.base_url)] = limit
+    CryptoSift.RATE_LIMITS = rate_limits
+    return CryptoSift
+
+
+# --------------------------
+# 实时行情替身（OKX公共WebSocket）
+# --------------------------
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def ws_send_frame(sock, payload, opcode=0x1):
+    """发送一帧服务端消息（不带掩码）"""
+    data = payload.encode("utf-8") if isinstance(payload, str) else payload
+    header = bytes([0x80 | opcode])
+    if len(data) < 126:
+        header += bytes([len(data)])
+    elif len(data) < 65536:
+        header += bytes([126]) + len(data).to_bytes(2, "big")
+    else:
+        header += bytes([127]) + len(data).to_bytes(8, "big")
+    sock.sendall(header + data)
+
+
+def ws_recv_frame(rfile):
+    """读取一帧客户端消息（带掩码），返回(opcode, payload)；连接关闭时返回(None, b"")"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, b""
+    length = head[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), "big")
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), "big")
+    mask = rfile.read(4) if head[1] & 0x80 else bytes(4)
+    data = rfile.read(length)
+    return head[0] & 0x0F, bytes(byte ^ mask[index % 4] for index, byte in enumerate(data))
+
+
+def synthetic_ticks(universe, count=2000, seed=42):
+    """按OKX tickers推送的data条目格式生成行情序列：各交易对轮流出现，价格随机游走"""
+    rng = random.Random(seed)
+    prices = {inst_id: float(okx_ticker_item(inst_id)["last"]) for inst_id in universe}
+    ticks = []
+    for index in range(count):
+        inst_id = universe[index % len(universe)]
+        prices[inst_id] *= 1 + rng.gauss(0, 0.0005)
+        item = okx_ticker_item(inst_id)
+        last = prices[inst_id]
+        item.update(last=f"{last:.6f}", bidPx=f"{last * 0.9995:.6f}", askPx=f"{last * 1.0005:.6f}")
+        ticks.append(item)
+    return ticks
+
+
+def load_recorded_ticks(path):
+    """读取TickerFeed(record_file=...)录制的原始推送消息，返回data条目列表"""
+    ticks = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                ticks.extend(json.loads(line).get("data", []))
+    return ticks
+
+
+class WebSocketStandIn:
+    """OKX公共WebSocket替身：处理tickers频道的订阅与"ping"，按rate（每秒消息数）循环回放ticks
+
+    ticks为tickers推送的data条目列表（录制或合成）；订阅后先推送各交易对最近的一条，再按顺序回放已订阅交易对的行情，
+    推送时ts改为当前时间。drop_connections()断开全部客户端，用于测试重连与重新订阅。
+    """
+
+    def __init__(self, ticks, rate=1000.0):
+        self.ticks = ticks
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.stats = {"connections": 0, "subscriptions": 0, "sent": 0}
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.serve_client(self)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.tcp = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.tcp.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"ws://127.0.0.1:{self.tcp.server_address[1]}/ws/v5/public"
+
+    def start(self):
+        threading.Thread(target=self.tcp.serve_forever, name="stand-in-okx-ws", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.tcp.shutdown()
+        self.tcp.server_close()
+        self.drop_connections()
+
+    def drop_connections(self):
+        with self.lock:
+            clients = list(self.clients)
+        for sock in clients:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def serve_client(self, handler):
+        lines = []
+        while True:
+            line = handler.rfile.readline().decode("latin-1").strip()
+            if not line:
+                break
+            lines.append(line)
+        headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+        key = headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        sock = handler.connection
+        sock.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("ascii"))
+        self._count("connections")
+        with self.lock:
+            self.clients.add(sock)
+
+        send_lock = threading.Lock()
+        subscribed = set()
+        closed = threading.Event()
+
+        def send(payload, opcode=0x1):
+            with send_lock:
+                ws_send_frame(sock, payload, opcode)
+
+        def push(item):
+            item = dict(item, ts=str(int(time.time() * 1000)))
+            send(json.dumps({"arg": {"channel": "tickers", "instId": item["instId"]}, "data": [item]}))
+            self._count("sent")
+
+        def replay():
+            index = 0
+            next_time = time.monotonic()
+            try:
+                while not closed.is_set():
+                    with send_lock:
+                        current = set(subscribed)
+                    item = None
+                    for _ in range(len(self.ticks)):
+                        candidate = self.ticks[index % len(self.ticks)]
+                        index += 1
+                        if candidate["instId"] in current:
+                            item = candidate
+                            break
+                    if item is None:
+                        closed.wait(0.01)
+                        next_time = time.monotonic()
+                        continue
+                    push(item)
+                    next_time += 1 / self.rate
+                    delay = next_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            except OSError:
+                closed.set()
+
+        threading.Thread(target=replay, name="stand-in-okx-ws-replay", daemon=True).start()
+        try:
+            while True:
+                opcode, payload = ws_recv_frame(handler.rfile)
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    send(payload, 0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                text = payload.decode("utf-8")
+                if text == "ping":
+                    send("pong")
+                    continue
+                message = json.loads(text)
+                if message.get("op") != "subscribe":
+                    continue
+                inst_ids = [arg["instId"] for arg in message.get("args", []) if arg.get("channel") == "tickers"]
+                for inst_id in inst_ids:
+                    send(json.dumps({"event": "subscribe", "arg": {"channel": "tickers", "instId": inst_id}}))
+                with send_lock:
+                    subscribed.update(inst_ids)
+                self._count("subscriptions", len(inst_ids))
+                # 订阅后立即推送各交易对最近的一条行情
+                latest = {item["instId"]: item for item in self.ticks if item["instId"] in inst_ids}
+                for item in latest.values():
+                    push(item)
+        except OSError:
+            pass
+        finally:
+            closed.set()
+            with self.lock:
+                self.clients.discard(sock)
+
+
+def run_ws_benchmark(pair_count, rate, seconds, ticks_file=None, drop=False):
+    """实时行情基准：TickerFeed订阅WebSocket替身，测量行情更新吞吐量、行情表时延、重连与行情表读取耗时"""
+    pairs = make_pairs(pair_count)
+    ticks = load_recorded_ticks(ticks_file) if ticks_file else synthetic_ticks(pairs)
+    pairs = sorted({item["instId"] for item in ticks})[:pair_count] if ticks_file else pairs
+    server = WebSocketStandIn(ticks, rate).start()
+    if "config" not in sys.modules:
+        # 实时行情不需要任何密钥
+        sys.modules["config"] = types.ModuleType("config")
+    import CryptoSift
+
+    CryptoSift.PRICE_STREAM_RECONNECT_DELAY = 0.1
+    feed = CryptoSift.TickerFeed(url=server.base_url)
+    feed.subscribe(pairs)
+    start = time.perf_counter()
+    feed.start()
+    try:
+        ready = feed.wait_ready(pairs, 10)
+        ready_seconds = time.perf_counter() - start
+        before = feed.snapshot_stats()
+        measure_start = time.perf_counter()
+        if drop:
+            time.sleep(seconds / 2)
+            server.drop_connections()
+            time.sleep(seconds / 2)
+        else:
+            time.sleep(seconds)
+        elapsed = time.perf_counter() - measure_start
+        after = feed.snapshot_stats()
+        # 行情表时延：当前时间与各交易对最新行情的推送时间之差
+        now_ms = time.time() * 1000
+        table = feed.snapshot(pairs)
+        staleness = [now_ms - int(ticker["ts"]) for ticker in table.values() if ticker.get("ts")]
+        lookups = 10000
+        lookup_start = time.perf_counter()
+        for index in range(lookups):
+            feed.latest(pairs[index % len(pairs)])
+        lookup_seconds = (time.perf_counter() - lookup_start) / lookups
+    finally:
+        feed.stop()
+        server.stop()
+    updates = after["updates"] - before["updates"]
+    return {
+        "pairs": len(pairs),
+        "rate": rate,
+        "ready": ready,
+        "ready_seconds": round(ready_seconds, 4),
+        "updates": updates,
+        "updates_per_second": round(updates / elapsed, 1),
+        "server_sent": server.stats["sent"],
+        "reconnects": after["connects"] - 1,
+        "table_pairs": len(table),
+        "staleness_ms_mean": round(sum(staleness) / len(staleness), 1) if staleness else None,
+        "lookup_microseconds": round(lookup_seconds * 1e6, 2)
+    }
+
+
+def format_ws_table(result):
+    return "\n".join([
+        f"交易对数量：{result['pairs']}，替身推送速率：{result['rate']}条/秒",
+        f"首批行情覆盖全部交易对：{'是' if result['ready'] else '否'}（{result['ready_seconds']:.3f}秒）",
+        f"行情更新：{result['updates']}条，{result['updates_per_second']}条/秒（替身共发送{result['server_sent']}条）",
+        f"重连次数：{result['reconnects']}，行情表交易对：{result['table_pairs']}",
+        f"行情表平均时延：{result['staleness_ms_mean']}毫秒，单次读取：{result['lookup_microseconds']}微秒"
+    ])
+
+
+# --------------------------
+# 冷启动基准
+# --------------------------
+# 每次测量都在新的Python进程中运行；config为空模块，启动阶段不应读取任何密钥
+STARTUP_IMPORT_SCRIPT = """
+import json, sys, time, types
+start = time.perf_counter()
+sys.modules["config"] = types.ModuleType("config")
+import CryptoSift
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+STARTUP_FIRST_FRAME_SCRIPT = """
+import json, os, sys, time, types
+start = time.perf_counter()
+os.environ["KIVY_NO_ARGS"] = "1"
+sys.modules["config"] = types.ModuleType("config")
+try:
+    from kivy.core.window import Window
+except ImportError:
+    print(json.dumps({"skipped": "未安装kivy"}))
+    sys.exit(0)
+import CryptoSiftApp
+app = CryptoSiftApp.CryptoSiftApp()
+result = {}
+
+def on_flip(*args):
+    Window.unbind(on_flip=on_flip)
+    result["seconds"] = time.perf_counter() - start
+    result["loaded"] = [name for name in %r if name in sys.modules]
+    app.stop()
+
+Window.bind(on_flip=on_flip)
+app.run()
+print(json.dumps(result))
+"""
+
+
+def run_startup_script(script, timeout=60):
+    """在新进程中运行测量脚本，返回脚本输出的最后一行JSON（附加进程总耗时），进程失败时返回{"skipped": 原因}"""
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-c", script % (HEAVY_MODULES,)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return {"skipped": f"超过{timeout}秒未完成"}
+    wall = time.perf_counter() - start
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        error = (completed.stderr.strip().splitlines() or ["无输出"])[-1]
+        return {"skipped": f"进程退出码{completed.returncode}：{error}"}
+    result = json.loads(lines[-1])
+    result["process_seconds"] = wall
+    return result
+
+
+def measure_startup(name, script, runs, budget):
+    """运行runs次（另有一次预热，用于生成.pyc），返回中位数耗时与是否满足预算"""
+    run_startup_script(script)
+    samples = [run_startup_script(script) for _ in range(runs)]
+    skipped = next((sample["skipped"] for sample in samples if "skipped" in sample), None)
+    if skipped:
+        return {"name": name, "skipped": skipped, "passed": True}
+    seconds = statistics.median(sample["seconds"] for sample in samples)
+    loaded = sorted({module for sample in samples for module in sample["loaded"]})
+    return {
+        "name": name,
+        "seconds": round(seconds, 4),
+        "process_seconds": round(statistics.median(sample["process_seconds"] for sample in samples), 4),
+        "budget": budget,
+        "heavy_modules": loaded,
+        "passed": seconds <= budget and not loaded
+    }
+
+
+def run_startup_benchmark(runs=5, import_budget=STARTUP_IMPORT_BUDGET, frame_budget=STARTUP_FIRST_FRAME_BUDGET):
+    """冷启动基准：导入CryptoSift的耗时与Kivy应用的首帧耗时（未安装kivy或无法创建窗口时跳过）"""
+    return [
+        measure_startup("import", STARTUP_IMPORT_SCRIPT, runs, import_budget),
+        measure_startup("first_frame", STARTUP_FIRST_FRAME_SCRIPT, runs, frame_budget)
+    ]
+
+
+def format_startup_table(results):
+    """将冷启动基准结果格式化为文本表格"""
+    header = f"{'阶段':<12} {'耗时(s)':>9} {'进程(s)':>9} {'预算(s)':>9}  结果"
+    lines = [header, "-" * len(header)]
+    for item in results:
+        if "skipped" in item:
+            lines.append(f"{item['name']:<12} {'-':>9} {'-':>9} {'-':>9}  跳过（{item['skipped']}）")
+            continue
+        status = "通过" if item["passed"] else "超出预算"
+        if item["heavy_modules"]:
+            status = f"失败（启动时导入了{', '.join(item['heavy_modules'])}）"
+        lines.append(f"{item['name']:<12} {item['seconds']:>9.3f} {item['process_seconds']:>9.3f} "
+                     f"{item['budget']:>9.3f}  {status}")
+    return "\n".join(lines)
+
+
+def make_pairs(count):
+    """生成count个交易对：前几个为常见币种，其余为合成代码"""
+    pairs = BASE_PAIRS[:count]
+    pairs += [f"X{index:04d}-USDT" for index in range(count - len(pairs))]
+    return pairs
+
+
+def run_scenario(cryptosift, servers, pair_count, verbose=False, stream=False):
+    """冷启动运行一次完整流程，返回本次的耗时与请求统计"""
+    pairs = make_pairs(pair_count)
+    cache_dir = tempfile.mkdtemp(prefix="cryptosift-bench-")
+    for server in servers.values():
+        server.reset_stats()
+    cryptosift.clear_caches()
+    cryptosift.CACHE_DIR = cache_dir
+    cryptosift.CRYPTO_LIST = pairs
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    try:
+        if verbose:
+            results = cryptosift.main(stream=stream)
+        else:
+            with contextlib.redirect_stdout(output):
+                results = cryptosift.main(stream=stream)
+    finally:
+        wall = time.perf_counter() - start
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = cryptosift.METRICS.report()
+    requests_by_provider = {name: dict(server.stats) for name, server in servers.items()}
+    total_requests = sum(stats["requests"] for stats in requests_by_provider.values())
+    analyzed = len(results or [])
+    return {
+        "pairs": pair_count,
+        "analyzed": analyzed,
+        "wall_seconds": round(wall, 4),
+        "requests": total_requests,
+        "requests_by_provider": requests_by_provider,
+        "requests_per_second": round(total_requests / wall, 2) if wall else None,
+        "pairs_per_second": round(analyzed / wall, 2) if wall else None,
+        "llm_calls": report["llm_usage"].get("calls", 0),
+        "llm_tokens": report["llm_usage"].get("total_tokens", 0),
+        "llm_first_token_seconds": report["counters"].get("llm_first_token_seconds_total"),
+        "stages": {name: stage["total"] for name, stage in report["stages"].items()},
+        "connections": {key: report["connections"][key] for key in ("opened", "reused")}
+    }
+
+
+def format_table(results):
+    """将基准结果格式化为文本表格"""
+    header = (f"{'交易对':>6} {'完成':>6} {'耗时(s)':>9} {'请求数':>7} {'请求/s':>8} {'交易对/s':>9} "
+              f"{'LLM调用':>8} {'采集(s)':>8} {'分析(s)':>8}")
+    lines = [header, "-" * len(header)]
+    for item in results:
+        lines.append(
+            f"{item['pairs']:>6} {item['analyzed']:>6} {item['wall_seconds']:>9.3f} {item['requests']:>7} "
+            f"{item['requests_per_second']:>8} {item['pairs_per_second']:>9} {item['llm_calls']:>8} "
+            f"{item['stages'].get('gather', 0):>8.3f} {item['stages'].get('analysis', 0):>8.3f}"
+        )
+    return "\n".join(lines)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="CryptoSift 离线性能基准（本地替身服务）")
+    parser.add_argument("--pairs", default=",".join(str(n) for n in DEFAULT_PAIR_COUNTS),
+                        help="逗号分隔的交易对数量（默认：5,50,500）")
+    parser.add_argument("--latency", type=float, default=0.05, help="替身服务的固定延迟，秒（默认：0.05）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="在固定延迟上附加的随机延迟上限，秒")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回500错误的比例（0-1）")
+    parser.add_argument("--rate-limit", type=float, default=0, help="替身服务端限流，每秒请求数，超出返回429（0为不限）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式响应中相邻两段的间隔，秒")
+    parser.add_argument("--stream", action="store_true", help="使用DeepSeek流式输出（SSE）运行")
+    parser.add_argument("--unthrottled", action="store_true", help="不使用客户端限流配置，测量流程自身开销")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子（错误注入与抖动）")
+    parser.add_argument("--json", metavar="FILE", help="将结果写入JSON文件")
+    parser.add_argument("--verbose", action="store_true", help="显示CryptoSift的运行输出")
+    parser.add_argument("--ws", action="store_true",
+                        help="只运行实时行情基准（WebSocket替身，交易对数量取--pairs中的最大值）")
+    parser.add_argument("--ws-rate", type=float, default=1000, help="WebSocket替身每秒推送的行情条数（默认：1000）")
+    parser.add_argument("--ws-seconds", type=float, default=5, help="实时行情基准的测量时长，秒（默认：5）")
+    parser.add_argument("--ws-ticks", metavar="FILE", help="回放TickerFeed录制的行情文件，而不是合成行情")
+    parser.add_argument("--ws-drop", action="store_true", help="测量中途断开一次连接，测试自动重连与重新订阅")
+    parser.add_argument("--startup", action="store_true",
+                        help="只运行冷启动基准（导入耗时与首帧耗时），超出预算时以退出码1结束")
+    parser.add_argument("--startup-runs", type=int, default=5, help="冷启动基准的测量次数（默认：5）")
+    parser.add_argument("--import-budget", type=float, default=STARTUP_IMPORT_BUDGET,
+                        help=f"导入CryptoSift的耗时预算，秒（默认：{STARTUP_IMPORT_BUDGET}）")
+    parser.add_argument("--frame-budget", type=float, default=STARTUP_FIRST_FRAME_BUDGET,
+                        help=f"Kivy应用首帧耗时预算，秒（默认：{STARTUP_FIRST_FRAME_BUDGET}）")
+    return parser
+
+
+def startup_main(args):
+    results = run_startup_benchmark(args.startup_runs, args.import_budget, args.frame_budget)
+    print(format_startup_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "settings": vars(args),
+                "startup": results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入：{args.json}")
+    if not all(item["passed"] for item in results):
+        sys.exit(1)
+    return results
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.startup:
+        return startup_main(args)
+    if args.ws:
+        result = run_ws_benchmark(max(int(n) for n in args.pairs.split(",") if n.strip()), args.ws_rate,
+                                  args.ws_seconds, args.ws_ticks, args.ws_drop)
+        print(format_ws_table(result))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "ws": result},
+                          f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入：{args.json}")
+        return result
+    pair_counts = [int(n) for n in args.pairs.split(",") if n.strip()]
+    universe = make_pairs(max(pair_counts))
+    servers = start_stand_ins(
+        universe,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        token_delay=args.token_delay,
+        seed=args.seed
+    )
+    try:
+        cryptosift = import_cryptosift(servers, unthrottled=args.unthrottled)
+        results = []
+        for count in pair_counts:
+            print(f"运行基准：{count}个交易对...", flush=True)
+            results.append(run_scenario(cryptosift, servers, count, verbose=args.verbose, stream=args.stream))
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    print()
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "settings": vars(args),
+                "results": results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入：{args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 测试不读取真实的config.py（含密钥）：使用占位配置，缓存写入临时目录
+if "config" not in sys.modules:
+    config = types.ModuleType("config")
+    config.DEEPSEEK_API_KEY = "test"
+    config.OKX_API_KEY = "test"
+    config.OKX_SECRET_KEY = "test"
+    config.OKX_PASSPHRASE = "test"
+    config.SEARCH_API_KEY = "test"
+    config.COINMARKETCAL_TOKEN = "test"
+    config.CACHE_DIR = tempfile.mkdtemp(prefix="cryptosift-tests-")
+    sys.modules["config"] = config
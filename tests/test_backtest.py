@@ -0,0 +1,128 @@
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import CryptoSift
+
+
+def history(rows):
+    """rows: (交易对, 时长, 现价, 涨, 跌, 横盘, 实际价格)，返回PredictionHistory.load格式的数据"""
+    columns = list(zip(*rows))
+    data = {"pair": np.array(columns[0], dtype=object)}
+    for name, column in zip(("horizon_hours", "price", "up", "down", "flat", "realized_price"), columns[1:]):
+        data[name] = np.array([np.nan if value is None else value for value in column], dtype=np.float64)
+    data["prediction_time"] = np.arange(len(rows), dtype=np.float64)
+    return data
+
+
+ROWS = [
+    ("BTC-USDT", 8, 100.0, 60, 20, 20, 105.0),   # 实际涨，命中，Brier 0.24
+    ("BTC-USDT", 8, 100.0, 50, 30, 20, 100.5),   # 实际横盘，未命中，Brier 0.98
+    ("ETH-USDT", 4, 10.0, 20, 70, 10, 9.0),      # 实际跌，命中，Brier 0.14
+    ("ETH-USDT", 4, 10.0, 20, 70, 10, None),     # 尚无实际价格，不参与评估
+    ("SOL-USDT", 4, 0.0, 20, 70, 10, 1.0),       # 无效现价，不参与评估
+]
+
+
+def test_backtest_scores():
+    report = CryptoSift.backtest_predictions(history(ROWS), flat_band=0.01, bins=5)
+    assert report["count"] == 3
+    assert report["outcomes"] == {"up": 1, "down": 1, "flat": 1}
+    assert report["hit_rate"] == pytest.approx(2 / 3, abs=1e-4)
+    assert report["brier"] == pytest.approx(1.36 / 3, abs=1e-4)
+    # 基准：三个方向各占1/3，每个样本的Brier为6/9
+    assert report["brier_skill"] == pytest.approx(1 - (1.36 / 3) / (6 / 9), abs=1e-4)
+    assert report["by_pair"] == {
+        "BTC-USDT": {"count": 2, "hit_rate": 0.5, "brier": 0.61},
+        "ETH-USDT": {"count": 1, "hit_rate": 1.0, "brier": 0.14},
+    }
+    assert set(report["by_horizon"]) == {"4.0", "8.0"}
+    assert report["by_horizon"]["8.0"]["count"] == 2
+
+
+def test_backtest_calibration_bins():
+    report = CryptoSift.backtest_predictions(history(ROWS), flat_band=0.01, bins=5)
+    assert report["calibration"]["up"] == [
+        {"bin": "0.2-0.4", "count": 1, "predicted": 0.2, "observed": 0.0},
+        {"bin": "0.4-0.6", "count": 1, "predicted": 0.5, "observed": 0.0},
+        {"bin": "0.6-0.8", "count": 1, "predicted": 0.6, "observed": 1.0},
+    ]
+
+
+def test_backtest_normalizes_probabilities():
+    scaled = [(pair, hours, price, up * 2, down * 2, flat * 2, realized)
+              for pair, hours, price, up, down, flat, realized in ROWS]
+    assert CryptoSift.backtest_predictions(history(scaled), flat_band=0.01, bins=5) == \
+        CryptoSift.backtest_predictions(history(ROWS), flat_band=0.01, bins=5)
+
+
+def test_backtest_without_resolved_predictions():
+    report = CryptoSift.backtest_predictions(history([ROWS[3]]), flat_band=0.01, bins=5)
+    assert report == {"count": 0}
+    assert "暂无" in CryptoSift.format_backtest_report(report)
+
+
+def test_prices_at_interpolates_within_bar():
+    bar_ms = 3_600_000
+    candles = np.array([
+        [0.0, 100.0, 110.0, 90.0, 104.0, 1.0],
+        [bar_ms, 104.0, 120.0, 100.0, 112.0, 1.0],
+    ])
+    times = [0, bar_ms / 4, bar_ms + bar_ms / 2, 2 * bar_ms, -1]
+    prices = CryptoSift.prices_at(candles, times, bar_ms)
+    np.testing.assert_allclose(prices[:3], [100.0, 101.0, 108.0])
+    # 超出已有K线范围的时间点无法确定价格
+    assert np.isnan(prices[3:]).all()
+
+
+def test_prices_at_ignores_bars_that_have_not_closed():
+    bar_ms = 3_600_000
+    candles = np.array([[0.0, 100.0, 110.0, 90.0, 104.0, 1.0]])
+    prices = CryptoSift.prices_at(candles, [bar_ms / 2], bar_ms, now_ms=bar_ms - 1)
+    assert np.isnan(prices).all()
+    prices = CryptoSift.prices_at(candles, [bar_ms / 2], bar_ms, now_ms=bar_ms)
+    np.testing.assert_allclose(prices, [102.0])
+
+
+@pytest.fixture
+def local_stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(CryptoSift, "CACHE_DIR", str(tmp_path))
+    store = CryptoSift.CandleStore(bar="1H")
+    history = CryptoSift.PredictionHistory("history.sqlite3")
+    monkeypatch.setattr(CryptoSift, "CANDLE_STORE", store)
+    monkeypatch.setattr(CryptoSift, "PREDICTION_HISTORY", history)
+    
+    def no_network(*args, **kwargs):
+        raise AssertionError("本地K线已覆盖，不应请求OKX")
+    
+    monkeypatch.setattr(CryptoSift, "fetch_okx_candles", no_network)
+    yield store, history
+    history.close()
+
+
+def test_mid_bar_snapshot_is_not_recorded_as_realized_price(local_stores):
+    store, history = local_stores
+    bar_ms = 3_600_000
+    now_ms = time.time() * 1000
+    current = now_ms // bar_ms * bar_ms
+    # 当前K线在周期中途同步：收盘价200只是快照
+    store.save("BTC-USDT", np.array([
+        [current - 2 * bar_ms, 96.0, 101.0, 95.0, 100.0, 1.0],
+        [current - bar_ms, 100.0, 110.0, 90.0, 104.0, 1.0],
+        [current, 104.0, 250.0, 100.0, 200.0, 1.0],
+    ]))
+    closed_time = (current - bar_ms / 2) / 1000
+    open_time = (current + (now_ms - current) / 2) / 1000
+    history.record({"BTC-USDT": {"prediction_time": datetime.fromtimestamp(closed_time), "current_price": 100.0,
+                                 "up": 50, "down": 30, "flat": 20}}, 8)
+    history.record({"BTC-USDT": {"prediction_time": datetime.fromtimestamp(open_time), "current_price": 100.0,
+                                 "up": 50, "down": 30, "flat": 20}}, 8)
+    
+    assert CryptoSift.resolve_realized_prices() == 1
+    data = history.load("BTC-USDT")
+    np.testing.assert_allclose(data["realized_price"][0], 102.0)
+    # 所在K线尚未收盘的预测保持未解析，收盘后再同步时补充
+    assert np.isnan(data["realized_price"][1])
+    assert set(history.unresolved()) == {"BTC-USDT"}
@@ -0,0 +1,134 @@
+import gzip
+import json
+
+import pytest
+import requests
+
+import CryptoSift
+
+
+class FakeSession:
+    """代替requests.Session：按(方法, 地址)返回预设的响应体，并记录收到的请求"""
+    
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.sent = []
+    
+    def request(self, method, url, **kwargs):
+        self.sent.append((method, url, kwargs))
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response._content = json.dumps(self.bodies[(method, url.split("?")[0])](kwargs)).encode("utf-8")
+        return response
+
+
+TICKER_URL = "https://www.okx.com/api/v5/market/ticker"
+CHAT_URL = "https://api.deepseek.com/chat/completions"
+
+
+def record(path, requests_to_send, calls=()):
+    session = FakeSession({
+        ("GET", TICKER_URL): lambda kwargs: {"instId": kwargs["params"]["instId"], "n": len(session.sent)},
+        ("POST", CHAT_URL): lambda kwargs: {"reply": kwargs["json"]["messages"][0]["content"]},
+    })
+    cassette = CryptoSift.Cassette(str(path), "record")
+    for method, url, kwargs in requests_to_send:
+        cassette.request(session, method, url, **kwargs)
+    for name, args, result in calls:
+        cassette.call(name, args, lambda: result)
+    cassette.save()
+    return session
+
+
+def ticker(pair, **extra):
+    return "GET", TICKER_URL, {"params": dict(instId=pair, **extra), "headers": {"OK-ACCESS-SIGN": "secret"}}
+
+
+def chat(content):
+    return "POST", CHAT_URL, {"json": {"messages": [{"role": "user", "content": content}]},
+                              "headers": {"Authorization": "Bearer secret"}}
+
+
+def replay(path, **options):
+    return CryptoSift.Cassette(str(path), "replay", **options)
+
+
+def test_secrets_are_not_written(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [ticker("BTC-USDT", api_key="k-123"), chat("hello")])
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        text = f.read()
+    assert "secret" not in text
+    assert "k-123" not in text
+    assert "BTC-USDT" in text
+
+
+def test_replay_returns_recorded_responses_in_order(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [ticker("BTC-USDT"), ticker("BTC-USDT"), ticker("ETH-USDT")])
+    cassette = replay(path)
+    method, url, kwargs = ticker("BTC-USDT")
+    first = cassette.request(None, method, url, **kwargs)
+    second = cassette.request(None, method, url, **kwargs)
+    third = cassette.request(None, method, url, **kwargs)
+    assert first.status_code == 200
+    assert first.headers["Content-Type"] == "application/json"
+    # 同一请求键用完后重复最后一次
+    assert [first.json()["n"], second.json()["n"], third.json()["n"]] == [1, 2, 2]
+    method, url, kwargs = ticker("ETH-USDT")
+    assert cassette.request(None, method, url, **kwargs).json() == {"instId": "ETH-USDT", "n": 3}
+
+
+def test_replay_matches_regardless_of_secret_and_time_text(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [chat("现在是2026年5月1日10点，分析BTC-USDT")])
+    cassette = replay(path)
+    method, url, kwargs = chat("现在是2026年6月2日11点，分析BTC-USDT")
+    kwargs["headers"] = {"Authorization": "Bearer other"}
+    assert cassette.request(None, method, url, **kwargs).json() == {"reply": "现在是2026年5月1日10点，分析BTC-USDT"}
+
+
+def test_unmatched_request_on_recorded_route_is_a_miss(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [ticker("BTC-USDT"), chat("分析BTC-USDT，资讯A；资讯B")])
+    cassette = replay(path)
+    for method, url, kwargs in (ticker("ETH-USDT"), chat("分析BTC-USDT，资讯B；资讯A")):
+        with pytest.raises(CryptoSift.CassetteMiss):
+            cassette.request(None, method, url, **kwargs)
+
+
+def test_fuzzy_matching_only_applies_to_opted_in_routes(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [ticker("BTC-USDT"), chat("分析BTC-USDT，资讯A；资讯B"), chat("分析ETH-USDT，资讯C")])
+    chat_route = CryptoSift.normalize_request("POST", CHAT_URL)[1]
+    cassette = replay(path, fuzzy_routes=[chat_route])
+    method, url, kwargs = chat("分析BTC-USDT，资讯B；资讯A")
+    assert cassette.request(None, method, url, **kwargs).json() == {"reply": "分析BTC-USDT，资讯A；资讯B"}
+    method, url, kwargs = ticker("ETH-USDT")
+    with pytest.raises(CryptoSift.CassetteMiss):
+        cassette.request(None, method, url, **kwargs)
+
+
+def test_function_calls_replay_and_miss(tmp_path):
+    path = tmp_path / "run.json.gz"
+    record(path, [], calls=[("yfinance.download", ["^GSPC"], {"^GSPC": [5000.0, 4950.0]})])
+    cassette = replay(path)
+    assert cassette.call("yfinance.download", ["^GSPC"], None) == {"^GSPC": [5000.0, 4950.0]}
+    with pytest.raises(CryptoSift.CassetteMiss):
+        cassette.call("yfinance.download", ["^IXIC"], None)
+
+
+def test_http_request_replays_without_network(tmp_path, monkeypatch):
+    path = tmp_path / "run.json.gz"
+    record(path, [ticker("BTC-USDT")])
+    monkeypatch.setattr(CryptoSift, "HTTP_CASSETTE", replay(path))
+    monkeypatch.setattr(CryptoSift, "_circuit_breakers", {})
+    method, url, kwargs = ticker("BTC-USDT")
+    response = CryptoSift.http_request(method, url, **kwargs)
+    assert response.json() == {"instId": "BTC-USDT", "n": 1}
+    # 回放中的未匹配请求按网络错误处理（不重试等待）
+    method, url, kwargs = ticker("DOGE-USDT")
+    with pytest.raises(CryptoSift.CassetteMiss):
+        CryptoSift.http_request(method, url, max_attempts=1, **kwargs)
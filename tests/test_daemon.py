@@ -0,0 +1,73 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import CryptoSift
+
+
+@pytest.fixture
+def open_bar_store(tmp_path, monkeypatch):
+    """本地已保存当前（未收盘）K线的存储，返回(存储, 请求记录)"""
+    monkeypatch.setattr(CryptoSift, "CACHE_DIR", str(tmp_path))
+    store = CryptoSift.CandleStore(bar="1H")
+    bar_ms = 3_600_000
+    current = time.time() * 1000 // bar_ms * bar_ms
+    store.save("BTC-USDT", np.array([[current - bar_ms, 100.0, 110.0, 90.0, 104.0, 1.0],
+                                     [current, 104.0, 106.0, 103.0, 105.0, 1.0]]))
+    calls = []
+    
+    def fetch(pair, bar, before=None, after=None, limit=100):
+        calls.append(before)
+        return np.array([[current, 104.0, 120.0, 103.0, 118.0, 2.0]])
+    
+    monkeypatch.setattr(CryptoSift, "fetch_okx_candles", fetch)
+    return store, calls
+
+
+def test_open_bar_is_synced_once_per_bar_by_default(open_bar_store):
+    store, calls = open_bar_store
+    candles, fetched = store.sync("BTC-USDT")
+    assert fetched == 0 and not calls
+    assert candles[-1, 4] == 105.0
+
+
+def test_open_bar_is_refetched_after_max_age(open_bar_store):
+    store, calls = open_bar_store
+    _, fetched = store.sync("BTC-USDT", max_age=300)
+    assert fetched == 0 and not calls
+    # 上次写入已超过max_age：重新获取当前K线
+    old = time.time() - 301
+    os.utime(store.path("BTC-USDT"), (old, old))
+    candles, fetched = store.sync("BTC-USDT", max_age=300)
+    assert fetched == 1 and len(calls) == 1
+    assert len(candles) == 2 and candles[-1, 4] == 118.0
+
+
+def test_failed_source_backs_off_until_its_interval(monkeypatch):
+    monkeypatch.setattr(CryptoSift, "DAEMON_RETRY_DELAY", 30)
+    daemon = CryptoSift.Daemon(crypto_pairs=["BTC-USDT"], intervals={"news": 900})
+    delays = []
+    for _ in range(7):
+        daemon.schedule("news", False, now=1000.0)
+        delays.append(daemon.next_refresh["news"] - 1000.0)
+    assert delays == [30, 60, 120, 240, 480, 900, 900]
+    assert daemon.due_sources(now=1000.0 + 899) == [source for source in daemon.SOURCES if source != "news"]
+    daemon.schedule("news", True, now=2000.0)
+    assert daemon.next_refresh["news"] == 2900.0 and "news" not in daemon.failures
+
+
+def test_refresh_failure_is_not_retried_immediately(monkeypatch):
+    daemon = CryptoSift.Daemon(crypto_pairs=["BTC-USDT"])
+    attempts = []
+    
+    def fetch(source):
+        attempts.append(source)
+        raise RuntimeError("offline")
+    
+    monkeypatch.setattr(daemon, "fetch", fetch)
+    daemon.refresh(["news"])
+    daemon.refresh()
+    assert attempts.count("news") == 1
+    assert "news" not in daemon.refreshed_at
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+import CryptoSift
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_open_session_closes_at_four_pm_new_york():
+    # 2026-03-10为周二（夏令时，UTC-4）
+    assert CryptoSift.us_market_session(utc(2026, 3, 10, 15, 0)) == (True, utc(2026, 3, 10, 20, 0))
+
+
+def test_weekend_skips_to_monday_open():
+    # 2026-01-10为周六（标准时间，UTC-5）
+    assert CryptoSift.us_market_session(utc(2026, 1, 10, 12, 0)) == (False, utc(2026, 1, 12, 14, 30))
+
+
+def test_next_open_uses_offset_after_spring_forward():
+    # 周五收盘后，开盘日（周一）已进入夏令时
+    assert CryptoSift.us_market_session(utc(2026, 3, 6, 22, 0)) == (False, utc(2026, 3, 9, 13, 30))
+
+
+def test_next_open_uses_offset_after_fall_back():
+    # 周五收盘后，开盘日（周一）已恢复标准时间
+    assert CryptoSift.us_market_session(utc(2026, 10, 30, 21, 0)) == (False, utc(2026, 11, 2, 14, 30))
@@ -0,0 +1,71 @@
+import pytest
+
+import CryptoSift
+
+
+@pytest.fixture
+def news_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(CryptoSift, "CACHE_DIR", str(tmp_path))
+    index = CryptoSift.NewsIndex("news.sqlite3")
+    yield index
+    index.close()
+
+
+def test_simhash_ignores_punctuation_and_case():
+    assert CryptoSift.simhash("Bitcoin ETF，资金流入！") == CryptoSift.simhash("bitcoin etf 资金流入")
+
+
+def test_simhash_near_duplicates_are_close():
+    a = CryptoSift.simhash("美联储宣布维持利率不变，比特币价格小幅上涨至六万美元附近")
+    b = CryptoSift.simhash("美联储宣布维持利率不变，比特币价格小幅上涨至六万美元上方")
+    c = CryptoSift.simhash("以太坊完成网络升级，Gas费用显著下降，开发者活跃度提升")
+    assert CryptoSift.hamming_distance(a, b) <= CryptoSift.NEWS_SIMHASH_DISTANCE
+    assert CryptoSift.hamming_distance(a, c) > CryptoSift.NEWS_SIMHASH_DISTANCE
+
+
+def test_signed_storage_round_trips():
+    signature = (1 << 64) - 1
+    stored = CryptoSift._to_signed64(signature)
+    assert stored == -1
+    assert stored & (1 << 64) - 1 == signature
+
+
+def test_ingest_clusters_near_duplicates(news_index):
+    now = 1_800_000_000.0
+    snippet = ("美联储周三宣布将基准利率维持在当前区间不变，符合市场预期。声明公布后比特币价格小幅上涨至六万美元{}，"
+               "以太坊同步走强，分析人士认为降息预期升温推动风险资产反弹，现货ETF资金连续三日净流入")
+    items = [
+        ("美联储维持利率不变", snippet.format("附近"), "https://a.example/1"),
+        ("美联储维持利率不变", snippet.format("上方"), "https://b.example/2"),
+        ("以太坊完成网络升级", "Gas费用显著下降，开发者活跃度提升", "https://c.example/3"),
+    ]
+    assert news_index.ingest("q1", items, now=now) == 2
+    clusters = news_index.clusters(now=now)
+    assert sorted(reports for _, _, reports in clusters) == [1, 2]
+    
+    # 完全相同的资讯（或相同链接）再次出现时不新增聚类，也不计入报道数
+    assert news_index.ingest("q2", items[:1], now=now + 60) == 0
+    assert sorted(reports for _, _, reports in news_index.clusters(now=now + 60)) == [1, 2]
+
+
+def test_query_interval_backs_off_without_new_clusters(news_index, monkeypatch):
+    monkeypatch.setattr(CryptoSift, "NEWS_QUERY_REFRESH_INTERVAL", 100)
+    monkeypatch.setattr(CryptoSift, "NEWS_QUERY_MAX_INTERVAL", 300)
+    now = 1_800_000_000.0
+    news_index.ingest("q", [("标题", "摘要", None)], now=now)
+    assert news_index.due_queries(["q", "new"], now=now + 99) == ["new"]
+    assert news_index.due_queries(["q"], now=now + 100) == ["q"]
+    news_index.ingest("q", [], now=now + 100)
+    assert news_index.due_queries(["q"], now=now + 299) == []
+    news_index.ingest("q", [], now=now + 300)
+    news_index.ingest("q", [], now=now + 600)
+    # 间隔加倍但不超过NEWS_QUERY_MAX_INTERVAL
+    assert news_index.due_queries(["q"], now=now + 900) == ["q"]
+
+
+def test_incremental_clusters_only_after_marker(news_index):
+    now = 1_800_000_000.0
+    news_index.ingest("q", [("旧资讯", "内容一", None)], now=now)
+    news_index.ingest("q", [("新资讯", "完全不同的第二条内容", None)], now=now + 10)
+    titles = [title for title, _, _ in news_index.clusters(since=now + 5, now=now + 10)]
+    assert titles == ["新资讯"]
@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+import CryptoSift
+
+
+def parse_in_chunks(text, sizes, pair=None):
+    """按给定的分段长度依次喂给解析器，返回(各交易对的文本, 概率回调列表)"""
+    texts = {}
+    probabilities = []
+    parser = CryptoSift.StreamingPredictionParser(
+        pair=pair,
+        on_text=lambda p, chunk: texts.__setitem__(p, texts.get(p, "") + chunk),
+        on_probabilities=lambda p, up, down, flat: probabilities.append((p, up, down, flat))
+    )
+    pos = 0
+    for size in sizes:
+        parser.feed(text[pos:pos + size])
+        pos += size
+    parser.feed(text[pos:])
+    return texts, probabilities
+
+
+SINGLE = json.dumps({"prediction": "短期震荡\n关注\"支撑位\"，中文\\路径", "up": 45, "down": 30, "flat": 25,
+                     "target_price": 101.5}, ensure_ascii=True)
+BATCH = json.dumps({"predictions": {
+    "BTC-USDT": {"prediction": "突破→上行", "up": 60, "down": 20, "flat": 20},
+    "ETH-USDT": {"prediction": "回调", "up": "20%", "down": "50", "flat": 30}
+}}, ensure_ascii=True)
+
+
+@pytest.mark.parametrize("split", range(1, len(SINGLE)))
+def test_single_prediction_survives_any_split(split):
+    texts, probabilities = parse_in_chunks(SINGLE, [split], pair="BTC-USDT")
+    assert texts == {"BTC-USDT": "短期震荡\n关注\"支撑位\"，中文\\路径"}
+    assert probabilities == [("BTC-USDT", 45, 30, 25)]
+
+
+def test_single_prediction_one_character_at_a_time():
+    texts, probabilities = parse_in_chunks(SINGLE, [1] * len(SINGLE), pair="BTC-USDT")
+    assert texts["BTC-USDT"] == json.loads(SINGLE)["prediction"]
+    assert probabilities == [("BTC-USDT", 45, 30, 25)]
+
+
+def test_unicode_escape_split_is_not_emitted_early():
+    # "短"被拆成"\u7"与"7ed"时不应输出残缺的转义
+    text = '{"prediction": "\\u77ed\\u671f", "up": 1'
+    start = text.index("\\u77ed") + 3
+    texts, _ = parse_in_chunks(text, [start, 2], pair="BTC-USDT")
+    assert texts == {"BTC-USDT": "短期"}
+
+
+def test_probability_number_split_waits_for_delimiter():
+    text = '{"prediction": "x", "up": 45, "down": 30, "flat": 25}'
+    end = text.index("25") + 1
+    _, probabilities = parse_in_chunks(text, [end], pair="BTC-USDT")
+    assert probabilities == [("BTC-USDT", 45, 30, 25)]
+
+
+@pytest.mark.parametrize("split", range(1, len(BATCH)))
+def test_batch_predictions_survive_any_split(split):
+    texts, probabilities = parse_in_chunks(BATCH, [split])
+    assert texts == {"BTC-USDT": "突破→上行", "ETH-USDT": "回调"}
+    assert probabilities == [("BTC-USDT", 60, 20, 20), ("ETH-USDT", 20, 50, 30)]
+
+
+class FakeStreamResponse:
+    def __init__(self, lines):
+        self.lines = lines
+    
+    def iter_lines(self):
+        return iter(self.lines)
+
+
+def sse_lines(pieces):
+    lines = [b": keep-alive", b""]
+    for piece in pieces:
+        chunk = {"choices": [{"delta": {"content": piece}}]}
+        lines += [b"data: " + json.dumps(chunk).encode("utf-8"), b""]
+    lines += [b'data: {"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 5}}', b"data: [DONE]"]
+    return lines
+
+
+def test_sse_stream_feeds_parser_across_escape_and_key_splits():
+    pieces = ['{"predi', 'ction": "a\\', 'nb\\u4e', '2d", "u', 'p": 50, "down": 2', '5, "flat": 25}']
+    texts = {}
+    probabilities = []
+    parser = CryptoSift.StreamingPredictionParser(
+        pair="SOL-USDT",
+        on_text=lambda p, chunk: texts.__setitem__(p, texts.get(p, "") + chunk),
+        on_probabilities=lambda p, *probs: probabilities.append(probs)
+    )
+    reply = CryptoSift.read_deepseek_stream(FakeStreamResponse(sse_lines(pieces)), parser.feed)
+    assert reply == "".join(pieces)
+    assert texts == {"SOL-USDT": "a\nb中"}
+    assert probabilities == [(50, 25, 25)]
+    assert CryptoSift.parse_prediction_json(reply)["prediction"] == "a\nb中"
+
+
+@pytest.mark.parametrize("values, expected", [
+    ((45, 30, 25), (45, 30, 25)),
+    ((1, 1, 1), (34, 33, 33)),
+    ((0.2, 0.3, 0.5), (20, 30, 50)),
+    ((50, 50, 50), (34, 33, 33)),
+    ((-10, 60, 40), (0, 60, 40)),
+    ((33.4, 33.3, 33.3), (34, 33, 33)),
+])
+def test_normalize_probabilities_sums_to_100(values, expected):
+    result = CryptoSift.normalize_probabilities(*values)
+    assert result == expected
+    assert sum(result) == 100
+
+
+def test_normalize_probabilities_rejects_all_zero():
+    with pytest.raises(ValueError):
+        CryptoSift.normalize_probabilities(0, 0, -1)
+
+
+def test_validate_prediction_repairs_minor_issues():
+    parsed = CryptoSift.validate_prediction({"prediction": " 上涨 ", "up": "60%", "down": 0.25, "flat": None})
+    assert (parsed["prediction"], parsed["up"], parsed["down"], parsed["flat"]) == ("上涨", 60, 0, 40)
+    assert parsed["target_price"] is None
+    # 0-1小数形式的概率换算为百分比
+    parsed = CryptoSift.validate_prediction({"prediction": "x", "up": 0.5, "down": 0.3, "flat": 0.2})
+    assert (parsed["up"], parsed["down"], parsed["flat"]) == (50, 30, 20)
+
+
+@pytest.mark.parametrize("data", [
+    {"up": 50, "down": 30, "flat": 20},
+    {"prediction": "x", "up": 50},
+    {"prediction": "x", "up": 0, "down": 0, "flat": 0},
+    ["not", "an", "object"],
+])
+def test_validate_prediction_rejects_unrepairable(data):
+    with pytest.raises(ValueError):
+        CryptoSift.validate_prediction(data)
+
+
+def test_parse_prediction_json_accepts_code_fence():
+    text = '```json\n{"prediction": "x", "up": 70, "down": 20, "flat": 10, "target_price": "1,234.5"}\n```'
+    assert CryptoSift.parse_prediction_json(text)["target_price"] == 1234.5
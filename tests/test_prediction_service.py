@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import CryptoSift
+
+
+@pytest.fixture
+def service():
+    daemon = CryptoSift.Daemon(crypto_pairs=["BTC-USDT"])
+    daemon.refreshed_at = {"prices": 0.0}
+    service = CryptoSift.PredictionService(daemon)
+    calls = []
+    
+    def analyze(pair, bucket):
+        calls.append((pair, bucket))
+        return {"pair": pair, "bucket": bucket}
+    
+    service._analyze = analyze
+    service.calls = calls
+    return service
+
+
+def current_bucket():
+    return CryptoSift.round_time(datetime.now()).isoformat()
+
+
+def store(service, pair, at, bucket=None):
+    service.daemon.results[pair] = {"pair": pair, "stored": True}
+    service.daemon.analyzed[pair] = {"price": 1.0, "signature": "", "at": at, "bucket": bucket}
+
+
+def test_daemon_pair_served_until_max_age(service):
+    now = CryptoSift.time.time()
+    store(service, "BTC-USDT", now - 3600)
+    assert service.prediction("BTC-USDT") == {"pair": "BTC-USDT", "stored": True}
+    store(service, "BTC-USDT", now - CryptoSift.DAEMON_MAX_PREDICTION_AGE - 1)
+    assert service.prediction("BTC-USDT")["bucket"] == current_bucket()
+    assert service.calls == [("BTC-USDT", current_bucket())]
+
+
+def test_on_demand_pair_expires_with_its_bucket(service):
+    now = CryptoSift.time.time()
+    store(service, "SOL-USDT", now, bucket=current_bucket())
+    assert service.prediction("SOL-USDT")["stored"]
+    previous = (datetime.fromisoformat(current_bucket()) - timedelta(minutes=30)).isoformat()
+    store(service, "SOL-USDT", now - 60, bucket=previous)
+    assert service.prediction("SOL-USDT") == {"pair": "SOL-USDT", "bucket": current_bucket()}
+    assert service.calls == [("SOL-USDT", current_bucket())]
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import pytest
+
+import CryptoSift
+
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2026, 5, 1, 10, 0, 0), datetime(2026, 5, 1, 10, 0)),
+    (datetime(2026, 5, 1, 10, 14, 59), datetime(2026, 5, 1, 10, 0)),
+    (datetime(2026, 5, 1, 10, 15), datetime(2026, 5, 1, 10, 30)),
+    (datetime(2026, 5, 1, 10, 44, 59, 999999), datetime(2026, 5, 1, 10, 30)),
+    (datetime(2026, 5, 1, 10, 45), datetime(2026, 5, 1, 11, 0)),
+    (datetime(2026, 12, 31, 23, 50), datetime(2027, 1, 1, 0, 0)),
+])
+def test_round_time_rounds_to_nearest_half_hour(now, expected):
+    assert CryptoSift.round_time(now) == expected
+
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2026, 5, 1, 10, 0), datetime(2026, 5, 1, 10, 30)),
+    (datetime(2026, 5, 1, 10, 29, 59), datetime(2026, 5, 1, 10, 30)),
+    (datetime(2026, 5, 1, 10, 30), datetime(2026, 5, 1, 11, 0)),
+    (datetime(2026, 5, 1, 23, 45), datetime(2026, 5, 2, 0, 0)),
+])
+def test_next_boundary_is_strictly_after_now(now, expected):
+    assert CryptoSift.next_boundary(now) == expected